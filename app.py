@@ -1,51 +1,236 @@
-from flask import Flask, render_template, request, jsonify, url_for
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context, url_for
+import json
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, event, text
 from sqlalchemy.orm import sessionmaker
+from content_store import ensure_columns, register_functions
+from search_index import TOKEN, centred_snippet, has_search_index, index_generation, search as search_pages
+from query_cache import DiskTier, QueryCache
+from segment_index import SegmentIndex
+from suggest import Suggester
 
 load_dotenv()
 
 app = Flask(__name__, static_folder='static')
+# Размер страницы выдачи по умолчанию и предел для limit; NDJSON отдает больше
+SEARCH_LIMIT = int(os.getenv('SEARCH_LIMIT', '20'))
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', '100'))
+SEARCH_MAX_STREAM = int(os.getenv('SEARCH_MAX_STREAM', '10000'))
+# fts - SQLite FTS5, segments - индекс из segment_index.py, like - скан таблицы;
+# запрос может выбрать другой движок параметром engine
+SEARCH_ENGINES = ('fts', 'segments', 'like')
+SEARCH_ENGINE = os.getenv('SEARCH_ENGINE', 'fts')
+segment_index = SegmentIndex(os.getenv('SEARCH_SEGMENT_DIR', 'segments'))
+
+# Кэш страниц выдачи в памяти процесса (SEARCH_CACHE_MB=0 - выключен) и общий
+# для нескольких процессов уровень в SQLite, если задан SEARCH_CACHE_PATH.
+# SEARCH_CACHE_MAX_STALE - на сколько секунд выдача может отстать от базы:
+# во время обхода поколение индекса растет на каждой пачке краулера
+query_cache = None
+if float(os.getenv('SEARCH_CACHE_MB', '64')) > 0:
+    query_cache = QueryCache(
+        max_bytes=int(float(os.getenv('SEARCH_CACHE_MB', '64')) * 1024 * 1024),
+        ttl=float(os.getenv('SEARCH_CACHE_TTL', '300')),
+        disk=DiskTier(os.getenv('SEARCH_CACHE_PATH')) if os.getenv('SEARCH_CACHE_PATH') else None,
+        max_stale=float(os.getenv('SEARCH_CACHE_MAX_STALE', '5')),
+    )
+
+# Подсказки /suggest: SUGGEST_MAX_KEYS ограничивает память, SUGGEST_INTERVAL -
+# как часто подхватываются новые страницы и запросы
+SUGGEST_LIMIT = 10
+suggester = Suggester(
+    'search_engine.db',
+    max_keys=int(os.getenv('SUGGEST_MAX_KEYS', '200000')),
+    k=SUGGEST_LIMIT,
+    interval=float(os.getenv('SUGGEST_INTERVAL', '5')),
+)
+
 engine = create_engine('sqlite:///search_engine.db')
 Session = sessionmaker(bind=engine)
 
+@event.listens_for(engine, 'connect')
+def on_connect(dbapi_connection, connection_record):
+    # page_text() прозрачно распаковывает сжатый текст страниц
+    register_functions(dbapi_connection)
+
+# Поиск читает summary и сжатый текст: базе, которую еще не открывал краулер
+# новой версии, эти колонки добавляются здесь
+raw_connection = engine.raw_connection()
+try:
+    with raw_connection.driver_connection as conn:
+        ensure_columns(conn)
+finally:
+    raw_connection.close()
+
 @app.route('/')
 def home():
     return render_template('index.html')
 
-@app.route('/search')
-def search():
-    query = request.args.get('q', '')
-    if not query:
-        return jsonify([])
-    
-    session = Session()
-    # Простой поиск по содержимому и заголовку
+def search_fts(session, query, limit, offset):
+    # FTS5: все слова запроса, ранжирование bm25; LIMIT/OFFSET выполняет SQLite
+    connection = session.connection().connection.driver_connection
+    return search_pages(connection, query, limit, offset)
+
+def existing_ids(session, ids):
+    found = set()
+    for start in range(0, len(ids), 500):
+        rows = session.execute(
+            text('SELECT id FROM webpages WHERE id IN :ids').bindparams(bindparam('ids', expanding=True)),
+            {'ids': ids[start:start + 500]},
+        )
+        found.update(row.id for row in rows)
+    return found
+
+def search_segments(session, query, limit, offset):
+    # Собственный индекс: куча top-k в WAND размером offset + limit. Страницу
+    # могли удалить из webpages раньше, чем сборщик сегментов это заметил:
+    # такие id пропускаются, а куча берется больше, пока хватает совпадений
+    k = offset + limit
+    while True:
+        hits = segment_index.search(query, k)
+        found = existing_ids(session, [page_id for page_id, _ in hits])
+        complete = len(hits) < k
+        hits = [(page_id, score) for page_id, score in hits if page_id in found]
+        if complete or len(hits) >= offset + limit:
+            break
+        k *= 2
+    hits = hits[offset:offset + limit]
+    if not hits:
+        return
+    rows = session.execute(
+        text("""
+            SELECT id, url, title, COALESCE(summary, substr(content, 1, 300)) as summary
+            FROM webpages WHERE id IN :ids
+        """).bindparams(bindparam('ids', expanding=True)),
+        {'ids': [page_id for page_id, _ in hits]},
+    )
+    pages = {row.id: row for row in rows}
+    for page_id, score in hits:
+        if page_id in pages:
+            yield pages[page_id].url, pages[page_id].title, pages[page_id].summary, score
+
+def search_like(session, query, limit, offset):
+    # Простой поиск по содержимому и заголовку, без индекса
+    # Для выдачи берется короткий summary, полный текст читается только в WHERE
     search_query = text("""
-        SELECT url, title, content, 
+        SELECT url, title, COALESCE(summary, substr(content, 1, 300)) as summary, 
                (CASE 
                    WHEN title LIKE :query THEN 2
-                   WHEN content LIKE :query THEN 1
-                   ELSE 0
+                   ELSE 1
                END) as score
         FROM webpages
-        WHERE title LIKE :query OR content LIKE :query
+        WHERE title LIKE :query OR page_text(content, content_z, content_codec) LIKE :query
         ORDER BY score DESC
+        LIMIT :limit OFFSET :offset
     """)
-    
-    results = []
-    for row in session.execute(search_query, {'query': f'%{query}%'}):
-        result = {
-            'url': row.url,
-            'title': row.title,
-            'content': row.content[:200] + '...',  # Показываем только первые 200 символов
-            'score': row.score
-        }
-        results.append(result)
-    
-    session.close()
-    return jsonify(results)
+    for row in session.execute(search_query, {'query': f'%{query}%', 'limit': limit, 'offset': offset}):
+        yield row.url, row.title, row.summary, row.score
+
+def search_results(session, backend, query, limit, offset):
+    if backend == 'segments':
+        rows = search_segments(session, query, limit, offset)
+    elif backend == 'fts' and has_search_index(session.connection().connection.driver_connection):
+        rows = search_fts(session, query, limit, offset)
+    else:
+        # Индекса FTS еще нет (python search_index.py rebuild) или выбран LIKE
+        rows = search_like(session, query, limit, offset)
+    for url, title, summary, score in rows:
+        # Фрагмент вокруг слов запроса строится из summary, без чтения полного текста
+        yield {'url': url, 'title': title, 'content': centred_snippet(summary, query), 'score': round(score, 3)}
+
+def cache_key(backend, query, limit, offset):
+    # Индексы не различают регистр и пунктуацию, LIKE ищет подстроку как есть
+    normalized = query if backend == 'like' else ' '.join(TOKEN.findall(query.lower()))
+    return f'{backend}\x1f{normalized}\x1f{limit}\x1f{offset}'
+
+def current_generation(session, backend):
+    # Сегменты сами нумеруют свои манифесты, для SQLite поколение ведут триггеры
+    if backend == 'segments':
+        segment_index.refresh()
+        return segment_index.generation
+    return index_generation(session.connection().connection.driver_connection)
+
+def int_arg(name, default, maximum=None, minimum=0):
+    value = int(request.args.get(name, default))
+    if value < minimum:
+        raise ValueError(name)
+    return min(value, maximum) if maximum is not None else value
+
+@app.route('/search')
+def search():
+    query = request.args.get('q', '')
+    # format=ndjson (или Accept: application/x-ndjson) - построчный поток для выгрузок
+    stream = (request.args.get('format') == 'ndjson'
+              or request.accept_mimetypes.best == 'application/x-ndjson')
+    if not query:
+        return Response('', mimetype='application/x-ndjson') if stream else jsonify([])
+    backend = request.args.get('engine', SEARCH_ENGINE)
+    if backend not in SEARCH_ENGINES:
+        return jsonify({'error': f"Неизвестный поисковый движок: {backend}"}), 400
+    try:
+        if stream:
+            limit = int_arg('limit', SEARCH_MAX_STREAM, SEARCH_MAX_STREAM, minimum=1)
+        else:
+            limit = int_arg('limit', SEARCH_LIMIT, SEARCH_MAX_LIMIT, minimum=1)
+        offset = int_arg('offset', 0)
+    except ValueError:
+        return jsonify({'error': "limit должен быть положительным целым, offset - неотрицательным"}), 400
+
+    session = Session()
+    if stream:
+        def lines():
+            try:
+                for result in search_results(session, backend, query, limit, offset):
+                    yield json.dumps(result, ensure_ascii=False) + '\n'
+            finally:
+                session.close()
+        return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+    try:
+        key = cache_key(backend, query, limit, offset)
+        generation = current_generation(session, backend) if query_cache is not None else None
+        results = query_cache.get(key, generation) if generation is not None else None
+        if results is None:
+            # Лишняя строка показывает, есть ли следующая страница
+            results = list(search_results(session, backend, query, limit + 1, offset))
+            if generation is not None:
+                query_cache.put(key, generation, results)
+    finally:
+        session.close()
+    if results and not offset:
+        # Частые запросы попадают в подсказки
+        suggester.record_query(query)
+    page = results[:limit]
+    response = jsonify(page)
+    # На пустой странице следующей нет: иначе клиент будет ходить по кругу
+    if page and len(results) > limit:
+        response.headers['X-Next-Offset'] = str(offset + limit)
+    return response
+
+@app.route('/suggest')
+def suggest():
+    # Снимки строит фоновый поток, до первой сборки подсказок нет
+    suggester.start()
+    try:
+        limit = int_arg('limit', SUGGEST_LIMIT, SUGGEST_LIMIT, minimum=1)
+    except ValueError:
+        return jsonify({'error': "limit должен быть положительным целым"}), 400
+    return jsonify(suggester.suggest(request.args.get('q', ''), limit))
+
+@app.route('/stats')
+def stats():
+    session = Session()
+    try:
+        generation = index_generation(session.connection().connection.driver_connection)
+    finally:
+        session.close()
+    return jsonify({
+        'cache': query_cache.stats() if query_cache is not None else None,
+        'generation': generation,
+        'segments': segment_index.stats(),
+        'suggest': suggester.stats(),
+    })
 
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,305 @@
+import argparse
+import http.server
+import json
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import socketserver
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+
+WORDS = ('поиск', 'страница', 'search', 'crawler', 'python', 'index', 'данные', 'ссылка', 'text', 'example')
+
+
+class SyntheticSite:
+    # Детерминированный сайт: содержимое, ссылки и ошибки страницы i зависят
+    # только от seed и i, поэтому все запуски обходят один и тот же граф
+    def __init__(self, pages=500, fanout=8, page_size=4096, latency=0.01, error_rate=0.02, error_status=404,
+                 hosts=1, seed=42):
+        self.pages = pages
+        self.fanout = fanout
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hosts = hosts
+        self.seed = seed
+        self.ports = []
+        self.servers = []
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def url(self, page):
+        return f'http://127.0.0.1:{self.ports[page % self.hosts]}/page/{page}'
+
+    def is_error(self, page):
+        return page != 0 and random.Random(self.seed * 1000003 + page).random() < self.error_rate
+
+    def render(self, page):
+        rng = random.Random(self.seed * 7919 + page)
+        # Цепочка i -> i + 1 гарантирует, что достижимы все страницы
+        targets = [(page + 1) % self.pages] + [rng.randrange(self.pages) for _ in range(self.fanout - 1)]
+        links = ''.join(f'<li><a href="{self.url(target)}">{rng.choice(WORDS)}</a></li>' for target in targets)
+        paragraphs = []
+        size = len(links)
+        while size < self.page_size:
+            words = ' '.join(f'{rng.choice(WORDS)}{rng.randrange(5000)}' for _ in range(rng.randint(10, 60)))
+            paragraphs.append(f'<p>{words}</p>')
+            size += len(paragraphs[-1])
+        return (
+            '<!DOCTYPE html><html><head><meta charset="utf-8">'
+            f'<title>Страница {page}</title></head>'
+            f'<body><div id="main">{"".join(paragraphs)}</div><ul>{links}</ul></body></html>'
+        ).encode('utf-8')
+
+    def handler(self):
+        site = self
+
+        class SiteHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with site.lock:
+                    site.requests += 1
+                if site.latency:
+                    time.sleep(site.latency)
+                page = None
+                if self.path.startswith('/page/'):
+                    try:
+                        page = int(self.path[len('/page/'):])
+                    except ValueError:
+                        page = None
+                if self.path == '/':
+                    page = 0
+                if page is None or not 0 <= page < site.pages:
+                    self.respond(404, b'not found', 'text/plain')
+                elif site.is_error(page):
+                    self.respond(site.error_status, b'error', 'text/plain')
+                else:
+                    self.respond(200, site.render(page), 'text/html; charset=utf-8')
+
+            def respond(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return SiteHandler
+
+    def start(self):
+        class SiteServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # Краулер закрывает keep-alive соединения когда угодно, это не ошибка сайта
+                pass
+
+        for _ in range(self.hosts):
+            server = SiteServer(('127.0.0.1', 0), self.handler())
+            self.servers.append(server)
+            self.ports.append(server.server_address[1])
+            threading.Thread(target=server.serve_forever, name='bench-site', daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def db_size(path):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    return os.path.getsize(path)
+
+
+def crawl_worker(workdir, start_url, mode, concurrency, results):
+    # Отдельный процесс в пустом каталоге: своя search_engine.db, свой frontier.db
+    # и пиковая память только самого краулера
+    os.chdir(workdir)
+    os.environ.setdefault('CRAWLER_HOST_DELAY', '0')
+    os.environ.setdefault('CRAWLER_SITEMAPS', '0')
+
+    import crawler
+    from page_writer import PageWriter
+
+    started_at = {}
+    latencies = []
+
+    class BenchWriter(PageWriter):
+        def _commit(self, batch):
+            super()._commit(batch)
+            now = time.perf_counter()
+            for kind, row in batch:
+                started = started_at.get(row['url'])
+                if kind == 'insert' and started is not None:
+                    latencies.append(now - started)
+
+    class BenchCrawler(crawler.WebCrawler):
+        def fetch(self, url):
+            started_at[url] = time.perf_counter()
+            return super().fetch(url)
+
+    writer = BenchWriter(
+        crawler.engine,
+        crawler.WebPage.__table__,
+        batch_size=crawler.page_writer.batch_size,
+        flush_interval=crawler.page_writer.flush_interval,
+    )
+    bench = BenchCrawler(start_url, concurrency=concurrency, writer=writer)
+    started = time.perf_counter()
+    if mode == 'async':
+        bench.crawl_async()
+    else:
+        bench.crawl()
+    writer.close()
+    elapsed = time.perf_counter() - started
+    if crawler.parse_pool is not None:
+        crawler.parse_pool.close()
+    crawler.engine.dispose()
+
+    results.put({
+        'pages': bench.pages_processed,
+        'duplicates': bench.duplicates,
+        'elapsed': elapsed,
+        'pages_per_sec': bench.pages_processed / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.5) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+        },
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'db_bytes': db_size('search_engine.db'),
+        'writer': writer.stats(),
+    })
+
+
+def cluster_worker(workdir, seeds, workers, mode, concurrency, base_port, results):
+    # Партиции cluster.py на этой машине: у каждой своя база, общая собирается
+    # слиянием, его время считается отдельно от обхода
+    os.chdir(workdir)
+    os.environ.setdefault('CRAWLER_HOST_DELAY', '0')
+    os.environ.setdefault('CRAWLER_SITEMAPS', '0')
+
+    import cluster
+
+    totals = cluster.run_local(seeds, workers, base_port, mode, concurrency)
+    elapsed = totals['elapsed']
+    results.put({
+        'pages': totals['pages'],
+        'elapsed': elapsed,
+        'pages_per_sec': totals['pages'] / elapsed if elapsed else 0.0,
+        'merge_elapsed': totals['merge_elapsed'],
+        'merged': totals['merged'],
+        'urls_sent': totals['sent'],
+        'urls_dropped': totals['dropped'],
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        'db_bytes': db_size('search_engine.db'),
+    })
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(site, mode='async', concurrency=20, workers=0, base_port=9100):
+    site.start()
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    try:
+        with tempfile.TemporaryDirectory(prefix='bench_crawl_') as workdir:
+            if workers:
+                # По стартовой странице на хост: иначе партиции без своих хостов простаивают
+                seeds = [site.url(page) for page in range(min(site.hosts, site.pages))]
+                target, args = cluster_worker, (workdir, seeds, workers, mode, concurrency, base_port, results)
+            else:
+                target, args = crawl_worker, (workdir, site.url(0), mode, concurrency, results)
+            worker = context.Process(target=target, args=args)
+            worker.start()
+            while True:
+                try:
+                    result = results.get(timeout=1)
+                    break
+                except queue.Empty:
+                    if not worker.is_alive():
+                        raise RuntimeError(f"Процесс краулера завершился без результата (код {worker.exitcode})")
+            worker.join()
+    finally:
+        site.stop()
+    result['requests'] = site.requests
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность краулера на синтетическом локальном сайте")
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--fanout', type=int, default=8, help="ссылок на странице")
+    parser.add_argument('--page-size', type=int, default=4096, help="примерный размер страницы в байтах")
+    parser.add_argument('--latency', type=float, default=0.01, help="задержка ответа сервера в секундах")
+    parser.add_argument('--error-rate', type=float, default=0.02, help="доля страниц, отвечающих ошибкой")
+    parser.add_argument('--error-status', type=int, default=404)
+    parser.add_argument('--hosts', type=int, default=1, help="число хостов (портов), между которыми делятся страницы")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--mode', choices=('sync', 'async'), default='async')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=0,
+                        help="число партиций cluster.py; 0 - один процесс WebCrawler")
+    parser.add_argument('--base-port', type=int, default=9100, help="порт координатора в режиме --workers")
+    parser.add_argument('--output', help="файл результата: .json перезаписывается, .jsonl дополняется строкой")
+    args = parser.parse_args()
+
+    site = SyntheticSite(
+        pages=args.pages, fanout=args.fanout, page_size=args.page_size, latency=args.latency,
+        error_rate=args.error_rate, error_status=args.error_status, hosts=args.hosts, seed=args.seed,
+    )
+    result = run_benchmark(site, args.mode, args.concurrency, args.workers, args.base_port)
+    report = {
+        'timestamp': time.time(),
+        'commit': git_commit(),
+        'params': {key: value for key, value in vars(args).items() if key != 'output'},
+        **result,
+    }
+
+    print(f"Страниц: {result['pages']} за {result['elapsed']:.2f} с ({result['pages_per_sec']:.1f} стр/с), "
+          f"запросов к сайту: {result['requests']}")
+    if 'latency_ms' in result:
+        print(f"Загрузка -> запись: p50 {result['latency_ms']['p50']:.1f} мс, p99 {result['latency_ms']['p99']:.1f} мс")
+    else:
+        print(f"Слияние баз партиций: {result['merged']} страниц за {result['merge_elapsed']:.2f} с")
+    print(f"Пиковая память: {result['peak_rss_mb']:.1f} МБ, размер базы: {result['db_bytes']} байт")
+
+    if args.output:
+        if args.output.endswith('.jsonl'):
+            with open(args.output, 'a') as f:
+                f.write(json.dumps(report, ensure_ascii=False) + '\n')
+        else:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
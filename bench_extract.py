@@ -0,0 +1,68 @@
+import glob
+import os
+import random
+import sys
+import time
+
+from extractor import extract, soup_extract
+
+WORDS = ('поиск', 'страница', 'search', 'crawler', 'python', 'index', 'данные', 'ссылка', 'text', 'example')
+
+
+def make_corpus(pages=300, seed=42):
+    # Фиксированный набор синтетических страниц: одинаковый от запуска к запуску
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(pages):
+        paragraphs = []
+        for _ in range(rng.randint(5, 40)):
+            words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(10, 80)))
+            paragraphs.append(f'<p class="c{rng.randint(0, 9)}">{words} &amp; <b>{rng.choice(WORDS)}</b></p>')
+        links = ''.join(
+            f'<li><a href="/page/{rng.randint(0, 10000)}?q={j}">{rng.choice(WORDS)}</a></li>'
+            for j in range(rng.randint(10, 300))
+        )
+        html = (
+            '<!DOCTYPE html><html><head><meta charset="utf-8">'
+            f'<title>Страница {i}</title>'
+            '<style>body { color: #333; } .c1 { margin: 0 }</style>'
+            f'<script>var data = {{"id": {i}, "items": [1, 2, 3]}}; if (a < b) {{ run(); }}</script>'
+            f'</head><body><div id="main">{"".join(paragraphs)}</div><ul>{links}</ul>'
+            '<!-- footer --><footer>© pieser</footer></body></html>'
+        )
+        corpus.append((f'https://example.com/page/{i}', html.encode('utf-8')))
+    return corpus
+
+
+def load_corpus(directory):
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.html'))):
+        with open(path, 'rb') as f:
+            corpus.append((f'https://example.com/{os.path.basename(path)}', f.read()))
+    return corpus
+
+
+def run(name, func, corpus, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        results = [func(url, body) for url, body in corpus]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    size = sum(len(body) for _, body in corpus)
+    print(f"{name:<12} {best * 1000:9.1f} мс  {len(corpus) / best:9.1f} стр/с  {size / best / 1024 / 1024:7.2f} МБ/с")
+    return results, best
+
+
+if __name__ == '__main__':
+    corpus = load_corpus(sys.argv[1]) if len(sys.argv) > 1 else make_corpus()
+    rounds = int(os.getenv('BENCH_ROUNDS', '5'))
+    print(f"Страниц: {len(corpus)}, байт: {sum(len(body) for _, body in corpus)}, повторов: {rounds}")
+
+    soup_results, soup_time = run('bs4', lambda url, body: soup_extract(url, body.decode('utf-8', 'replace')), corpus, rounds)
+    stream_results, stream_time = run('streaming', lambda url, body: extract(url, [body], 'text/html'), corpus, rounds)
+
+    same_text = sum(a[1] == b[1] for a, b in zip(soup_results, stream_results))
+    same_links = sum(a[2] == b[2] for a, b in zip(soup_results, stream_results))
+    print(f"Ускорение: {soup_time / stream_time:.2f}x")
+    print(f"Совпадает текст: {same_text}/{len(corpus)}, ссылки: {same_links}/{len(corpus)}")
@@ -0,0 +1,491 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from content_store import register_functions
+from crawler import (
+    CRAWL_MODES, DB_PATH, SITEMAPS_ENABLED, WebCrawler, canonicalize, metrics, page_writer, parse_pool,
+    print_writer_stats, render_pool, stop_event, warc_writer,
+)
+from scheduler import host_of
+from search_index import bump_generation
+
+SEND_RETRIES = 5
+FLUSH_INTERVAL = 0.2
+STATUS_INTERVAL = 0.5
+QUIET_PERIOD = 1.5
+
+
+def partition_of(host, partitions):
+    # Стабильный хэш, а не hash(): он одинаков во всех процессах и на всех машинах
+    digest = hashlib.blake2b(host.lower().encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % partitions
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def send_message(address, message, timeout=5.0):
+    # Одно сообщение - одна строка JSON, ответ - тоже одна строка
+    with socket.create_connection(parse_address(address), timeout=timeout) as sock:
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError(f"Пустой ответ от {address}")
+    return json.loads(line)
+
+
+class MessageServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handle):
+        self.handle = handle
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    return
+                reply = self.server.handle(json.loads(line))
+                self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+        super().__init__(parse_address(address), Handler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='cluster-server', daemon=True).start()
+        return self
+
+
+class PartitionCrawler(WebCrawler):
+    # Краулер одной партиции: хост принадлежит ровно одной партиции, поэтому
+    # вежливость, robots.txt, ловушки и бюджеты хоста считаются в одном месте.
+    # Чужие ссылки копятся в исходящих пачках и отправляются владельцу
+    def __init__(self, partition, peers, coordinator=None, seeds=(), **kwargs):
+        super().__init__(f'partition-{partition}', **kwargs)
+        self.partition = partition
+        self.peers = peers
+        self.coordinator = coordinator
+        self.seeds = list(seeds)
+        self.inbox = queue.SimpleQueue()
+        self.outbox = defaultdict(list)
+        self.out_lock = threading.Lock()
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self.waiting = False
+        self.finished = False
+        self.done = threading.Event()
+        self.server = None
+
+    def owner(self, url):
+        return partition_of(host_of(url), len(self.peers))
+
+    def on_message(self, message):
+        if message.get('type') == 'urls':
+            urls = message.get('urls', [])
+            self.received += len(urls)
+            metrics.inc('cluster_urls_received_total', len(urls))
+            if not self.finished:
+                self.waiting = False
+                for url in urls:
+                    self.inbox.put(url)
+            return {'ok': True}
+        if message.get('type') == 'stop':
+            self.done.set()
+            return {'ok': True}
+        return {'ok': False, 'error': 'unknown message'}
+
+    def route(self, owner, url):
+        with self.out_lock:
+            self.outbox[owner].append(url)
+
+    def accept_links(self, links):
+        new_links = []
+        for link in links:
+            new_url = self.canonicalize(link)
+            if not self.is_valid_url(new_url):
+                continue
+            owner = self.owner(new_url)
+            if owner == self.partition:
+                if self.claim(new_url):
+                    new_links.append(self.keep_anchor(link, new_url))
+                elif self.frontier is not None and new_url in self.seen:
+                    self.frontier.touch(new_url, getattr(link, 'anchor', ''))
+            elif self.seen.add(new_url):
+                # Отметка в своем seen только экономит повторные отправки,
+                # окончательно дубликаты отсекает владелец
+                self.route(owner, new_url)
+        return new_links
+
+    def poll_links(self, frontier):
+        super().poll_links(frontier)
+        received = False
+        while True:
+            try:
+                url = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            received = True
+            if self.claim(url):
+                frontier.put(url)
+        if received:
+            self.waiting = False
+            metrics.set('crawler_queue_depth', len(frontier), seed=self.start_url)
+
+    def expecting_links(self):
+        # Сюда попадаем, когда очередь пуста и запросов в работе нет. Пока поток
+        # записи держит страницы или их URL вернулись в failed_urls, партиция
+        # не простаивает: иначе координатор остановит ее до записи
+        if super().expecting_links():
+            self.waiting = False
+            return True
+        self.waiting = True
+        return not self.done.is_set() and not stop_event.is_set()
+
+    def seed_frontier(self, frontier):
+        if len(frontier):
+            print(f"[{self.start_url}] Продолжение с сохраненного фронтира: {len(frontier)} URL")
+        for seed in self.seeds:
+            url = self.canonicalize(seed)
+            owner = self.owner(url)
+            if owner != self.partition:
+                self.route(owner, url)
+                continue
+            if self.seen.add(url):
+                frontier.put(url)
+            if SITEMAPS_ENABLED:
+                self.seed_sitemaps(frontier, url)
+
+    def idle(self):
+        with self.out_lock:
+            pending = any(self.outbox.values())
+        return self.finished or (self.waiting and self.inbox.empty() and not pending)
+
+    def flush_outbox(self):
+        with self.out_lock:
+            batches = [(owner, urls) for owner, urls in self.outbox.items() if urls]
+            self.outbox.clear()
+        for owner, urls in batches:
+            for attempt in range(SEND_RETRIES):
+                try:
+                    send_message(self.peers[owner], {'type': 'urls', 'urls': urls})
+                    self.sent += len(urls)
+                    metrics.inc('cluster_urls_sent_total', len(urls), partition=str(owner))
+                    break
+                except (OSError, ValueError) as e:
+                    if attempt == SEND_RETRIES - 1:
+                        self.dropped += len(urls)
+                        metrics.inc('cluster_urls_dropped_total', len(urls), partition=str(owner))
+                        print(f"[{self.start_url}] Не удалось отправить {len(urls)} URL партиции {owner}: {e}")
+                    else:
+                        time.sleep(0.5 * (attempt + 1))
+
+    def status(self):
+        return {
+            'type': 'status',
+            'partition': self.partition,
+            'idle': self.idle(),
+            'finished': self.finished,
+            'sent': self.sent,
+            'received': self.received,
+            'dropped': self.dropped,
+            'pages': self.pages_processed,
+        }
+
+    def report(self):
+        if self.coordinator is None:
+            return
+        try:
+            reply = send_message(self.coordinator, self.status())
+        except (OSError, ValueError) as e:
+            self.log(f"Координатор недоступен: {e}")
+            return
+        if reply.get('stop'):
+            self.done.set()
+
+    def _exchange(self):
+        last_report = 0.0
+        while not self.done.is_set():
+            self.flush_outbox()
+            if time.monotonic() - last_report >= STATUS_INTERVAL:
+                self.report()
+                last_report = time.monotonic()
+            self.done.wait(FLUSH_INTERVAL)
+
+    def run(self, mode='sync'):
+        self.server = MessageServer(self.peers[self.partition], self.on_message).start()
+        exchange = threading.Thread(target=self._exchange, name='cluster-exchange', daemon=True)
+        exchange.start()
+        try:
+            if mode == 'async':
+                self.crawl_async()
+            else:
+                self.crawl()
+        finally:
+            self.finished = True
+            self.flush_outbox()
+            # Ждем команды координатора: до нее сервер принимает и учитывает сообщения,
+            # иначе отправители считали бы их потерянными
+            if self.coordinator is not None:
+                while not self.done.is_set() and not stop_event.is_set():
+                    self.report()
+                    self.done.wait(STATUS_INTERVAL)
+            self.done.set()
+            exchange.join()
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class Coordinator:
+    # Определяет конец обхода: все партиции простаивают, каждая отправленная
+    # ссылка получена, и счетчики не менялись QUIET_PERIOD секунд
+    def __init__(self, address, partitions, quiet_period=QUIET_PERIOD):
+        self.address = address
+        self.partitions = partitions
+        self.quiet_period = quiet_period
+        self.statuses = {}
+        self.lock = threading.Lock()
+        self.stopping = False
+        self.stopped = set()
+        self.last_snapshot = None
+        self.quiet_since = None
+
+    def on_message(self, message):
+        if message.get('type') != 'status':
+            return {'ok': False, 'error': 'unknown message'}
+        with self.lock:
+            self.statuses[message['partition']] = message
+            self._check()
+            if self.stopping:
+                self.stopped.add(message['partition'])
+            return {'ok': True, 'stop': self.stopping}
+
+    def _check(self):
+        if self.stopping or len(self.statuses) < self.partitions:
+            return
+        statuses = [self.statuses[i] for i in sorted(self.statuses)]
+        sent = sum(status['sent'] for status in statuses)
+        delivered = sum(status['received'] + status['dropped'] for status in statuses)
+        if not all(status['idle'] for status in statuses) or delivered < sent:
+            self.last_snapshot = None
+            return
+        snapshot = [(status['sent'], status['received'], status['dropped']) for status in statuses]
+        now = time.monotonic()
+        if snapshot != self.last_snapshot:
+            self.last_snapshot = snapshot
+            self.quiet_since = now
+        elif now - self.quiet_since >= self.quiet_period:
+            self.stopping = True
+
+    def stop(self):
+        with self.lock:
+            self.stopping = True
+
+    def totals(self):
+        with self.lock:
+            statuses = list(self.statuses.values())
+        return {
+            'pages': sum(status['pages'] for status in statuses),
+            'sent': sum(status['sent'] for status in statuses),
+            'received': sum(status['received'] for status in statuses),
+            'dropped': sum(status['dropped'] for status in statuses),
+        }
+
+    def run(self, timeout=10.0):
+        server = MessageServer(self.address, self.on_message).start()
+        try:
+            while True:
+                with self.lock:
+                    if self.stopping and len(self.stopped) >= self.partitions:
+                        break
+                    stopping_since = self.quiet_since if self.stopping else None
+                # Партиция, которая так и не пришла за командой, не держит координатор вечно
+                if stopping_since is not None and time.monotonic() - stopping_since > self.quiet_period + timeout:
+                    break
+                time.sleep(STATUS_INTERVAL)
+        finally:
+            server.shutdown()
+            server.server_close()
+        return self.totals()
+
+
+def run_worker(partition, peers, coordinator, seeds=(), mode='sync', concurrency=10, max_pages=None):
+    crawler = PartitionCrawler(partition, peers, coordinator, seeds, max_pages=max_pages, concurrency=concurrency)
+    try:
+        crawler.run(mode)
+    except KeyboardInterrupt:
+        stop_event.set()
+    finally:
+        page_writer.close()
+        if parse_pool is not None:
+            parse_pool.close()
+        if warc_writer is not None:
+            warc_writer.close()
+        if render_pool is not None:
+            render_pool.close()
+        print(f"[{crawler.start_url}] Страниц: {crawler.pages_processed}, "
+              f"отправлено URL: {crawler.sent}, получено: {crawler.received}, потеряно: {crawler.dropped}")
+        print_writer_stats()
+
+
+def partition_path(path, partition):
+    root, ext = os.path.splitext(path)
+    return f'{root}.part{partition}{ext or ".db"}'
+
+
+def partition_env(partition):
+    # У каждой партиции своя база и свой фронтир: в общий файл SQLite пускает
+    # только одного писателя, и партиции стояли бы в очереди за блокировкой.
+    # Полнотекстовый индекс и сегменты строятся по общей базе после слияния
+    return {
+        'CRAWLER_DB': partition_path(DB_PATH, partition),
+        'CRAWLER_FRONTIER_PATH': partition_path(os.getenv('CRAWLER_FRONTIER_PATH', 'frontier.db'), partition),
+        'CRAWLER_SEARCH_INDEX': '0',
+        'CRAWLER_SEGMENT_DIR': '',
+    }
+
+
+def merge_partitions(target, paths, drop=False):
+    # Единственный писатель общей базы: страницы партиций переносятся по одной
+    # транзакции на партицию, триггеры обновляют полнотекстовый индекс.
+    # Страница, которая уже есть в общей базе, заменяется только более свежей
+    conn = sqlite3.connect(target, timeout=60)
+    register_functions(conn)
+    merged = 0
+    try:
+        target_columns = [row[1] for row in conn.execute('PRAGMA table_info(webpages)')]
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            conn.execute('ATTACH DATABASE ? AS part', (path,))
+            try:
+                part_columns = {row[1] for row in conn.execute('PRAGMA part.table_info(webpages)')}
+                columns = [name for name in target_columns if name != 'id' and name in part_columns]
+                names = ', '.join(columns)
+                updates = ', '.join(f'{name} = excluded.{name}' for name in columns if name != 'url')
+                with conn:
+                    cursor = conn.execute(
+                        f'INSERT INTO webpages ({names}) SELECT {names} FROM part.webpages WHERE true '
+                        f'ON CONFLICT(url) DO UPDATE SET {updates} '
+                        f'WHERE coalesce(excluded.timestamp, 0) > coalesce(webpages.timestamp, 0)'
+                    )
+                    merged += max(cursor.rowcount, 0)
+                    if cursor.rowcount:
+                        bump_generation(conn)
+            finally:
+                conn.execute('DETACH DATABASE part')
+    finally:
+        conn.close()
+    if drop:
+        for path in paths:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    return merged
+
+
+def run_local(seeds, workers, base_port=9100, mode='sync', concurrency=10, max_pages=None, drop_partitions=False):
+    # Все партиции на одной машине: координатор в этом процессе, партиции - в
+    # отдельных процессах (spawn, как у пула разбора), каждая со своей базой.
+    # После обхода базы партиций сливаются в общую
+    coordinator = Coordinator(f'127.0.0.1:{base_port}', workers)
+    peers = [f'127.0.0.1:{base_port + 1 + i}' for i in range(workers)]
+    owned = defaultdict(list)
+    for seed in seeds:
+        owned[partition_of(host_of(canonicalize(seed)), workers)].append(seed)
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(i, peers, coordinator.address, owned[i], mode, concurrency, max_pages),
+            name=f'partition-{i}',
+        )
+        for i in range(workers)
+    ]
+    started = time.time()
+    for i, process in enumerate(processes):
+        # Дочерний процесс spawn получает окружение на момент start()
+        saved = dict(os.environ)
+        os.environ.update(partition_env(i))
+        try:
+            process.start()
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+    try:
+        totals = coordinator.run()
+    except KeyboardInterrupt:
+        coordinator.stop()
+        totals = coordinator.totals()
+    for process in processes:
+        process.join()
+    elapsed = time.time() - started
+    merge_started = time.time()
+    merged = merge_partitions(DB_PATH, [partition_path(DB_PATH, i) for i in range(workers)], drop_partitions)
+    merge_elapsed = time.time() - merge_started
+    print(f"Партиций: {workers}, страниц: {totals['pages']} за {elapsed:.1f} с "
+          f"({totals['pages'] / elapsed if elapsed else 0:.1f} страниц/с), "
+          f"передано URL: {totals['sent']}, потеряно: {totals['dropped']}")
+    print(f"Слито в {DB_PATH}: {merged} страниц за {merge_elapsed:.1f} с")
+    return {**totals, 'elapsed': elapsed, 'merged': merged, 'merge_elapsed': merge_elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Распределенный обход с разбиением фронтира по хостам")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    local = commands.add_parser('local', help="координатор и N партиций на этой машине")
+    local.add_argument('seeds', nargs='+')
+    local.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    local.add_argument('--base-port', type=int, default=9100)
+    local.add_argument('--drop-partitions', action='store_true', help="удалить базы партиций после слияния")
+
+    merge = commands.add_parser('merge', help="слить базы партиций в общую")
+    merge.add_argument('paths', nargs='+')
+    merge.add_argument('--drop-partitions', action='store_true')
+
+    coordinator = commands.add_parser('coordinator', help="только координатор")
+    coordinator.add_argument('--listen', default='0.0.0.0:9100')
+    coordinator.add_argument('--partitions', type=int, required=True)
+
+    worker = commands.add_parser('worker', help="одна партиция")
+    worker.add_argument('seeds', nargs='*')
+    worker.add_argument('--partition', type=int, required=True)
+    worker.add_argument('--peers', required=True, help="адреса всех партиций по порядку: host:port,host:port,...")
+    worker.add_argument('--coordinator', required=True)
+
+    for command in (local, worker):
+        command.add_argument('--mode', choices=CRAWL_MODES, default='sync')
+        command.add_argument('--concurrency', type=int, default=10)
+        command.add_argument('--max-pages', type=int, default=None, help="лимит страниц на партицию")
+
+    args = parser.parse_args()
+    if args.command == 'local':
+        run_local(args.seeds, args.workers, args.base_port, args.mode, args.concurrency, args.max_pages,
+                  args.drop_partitions)
+    elif args.command == 'merge':
+        merged = merge_partitions(DB_PATH, args.paths, args.drop_partitions)
+        print(f"Слито в {DB_PATH}: {merged} страниц")
+    elif args.command == 'coordinator':
+        totals = Coordinator(args.listen, args.partitions).run()
+        print(f"Страниц: {totals['pages']}, передано URL: {totals['sent']}, потеряно: {totals['dropped']}")
+    else:
+        peers = [peer.strip() for peer in args.peers.split(',') if peer.strip()]
+        run_worker(args.partition, peers, args.coordinator, args.seeds, args.mode, args.concurrency, args.max_pages)
+
+
+if __name__ == '__main__':
+    main()
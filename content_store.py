@@ -0,0 +1,136 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ('zlib', 'zstd')
+SUMMARY_LENGTH = 300
+
+
+def compress(text, codec='zlib'):
+    data = text.encode('utf-8')
+    if codec == 'zlib':
+        return zlib.compress(data, 6)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Для сжатия zstd нужен пакет zstandard (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"Неизвестный кодек: {codec}")
+
+
+def decompress(blob, codec):
+    if codec == 'zlib':
+        return zlib.decompress(blob).decode('utf-8')
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Для чтения zstd нужен пакет zstandard (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(blob).decode('utf-8')
+    raise ValueError(f"Неизвестный кодек: {codec}")
+
+
+def make_summary(text, length=SUMMARY_LENGTH):
+    if not text or len(text) <= length:
+        return text
+    cut = text.rfind(' ', 0, length)
+    return text[:cut if cut > length // 2 else length]
+
+
+def content_hash(title, text):
+    # Хеш извлеченного заголовка и текста, а не байтов ответа: токены CSRF,
+    # nonce в скриптах и служебные атрибуты разметки не делают страницу новой
+    normalized = ' '.join((title or '').split()) + '\n' + ' '.join((text or '').split())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def content_fields(text, codec=None):
+    # Колонки страницы для записи: без кодека текст хранится как раньше,
+    # с кодеком - только сжатый BLOB. Краткое описание пишется всегда
+    if not codec:
+        return {'content': text, 'content_z': None, 'content_codec': None, 'summary': make_summary(text)}
+    return {
+        'content': None,
+        'content_z': compress(text or '', codec),
+        'content_codec': codec,
+        'summary': make_summary(text),
+    }
+
+
+def page_text(content, content_z, codec):
+    if content is not None:
+        return content
+    if content_z is None:
+        return None
+    return decompress(content_z, codec)
+
+
+def register_functions(dbapi_connection):
+    # page_text(content, content_z, content_codec) в SQL возвращает текст
+    # страницы независимо от того, сжат он или нет
+    dbapi_connection.create_function('page_text', 3, page_text, deterministic=True)
+
+
+def ensure_columns(conn):
+    # Колонки сжатого текста и summary в базе прежней версии; без таблицы ничего не делает
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(webpages)')}
+    if not existing:
+        return
+    for name, column_type in (('content_z', 'BLOB'), ('content_codec', 'VARCHAR(8)'), ('summary', 'TEXT')):
+        if name not in existing:
+            conn.execute(f'ALTER TABLE webpages ADD COLUMN {name} {column_type}')
+
+
+def db_size(conn, path):
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return os.path.getsize(path)
+
+
+def migrate(path, codec='zlib', batch=500):
+    # Переводит существующую базу на сжатое хранение и заполняет summary
+    conn = sqlite3.connect(path)
+    # UPDATE ниже вызывает триггеры полнотекстового индекса, им нужна page_text()
+    register_functions(conn)
+    ensure_columns(conn)
+    conn.commit()
+    before = db_size(conn, path)
+
+    migrated = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, content FROM webpages WHERE id > ? AND content IS NOT NULL ORDER BY id LIMIT ?',
+            (last_id, batch),
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row_id, content in rows:
+            fields = content_fields(content, codec)
+            updates.append((fields['content'], fields['content_z'], fields['content_codec'], fields['summary'], row_id))
+        with conn:
+            conn.executemany(
+                'UPDATE webpages SET content = ?, content_z = ?, content_codec = ?, summary = ? WHERE id = ?',
+                updates,
+            )
+        migrated += len(rows)
+        last_id = rows[-1][0]
+        print(f"Обработано страниц: {migrated}")
+
+    conn.execute('VACUUM')
+    after = db_size(conn, path)
+    conn.close()
+    print(f"Размер базы: {before} -> {after} байт ({after / before * 100 if before else 0:.1f}%)")
+
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'search_engine.db'
+    db_codec = sys.argv[2] if len(sys.argv) > 2 else 'zlib'
+    if db_codec not in CODECS:
+        print(f"Кодек должен быть одним из: {', '.join(CODECS)}")
+        sys.exit(1)
+    migrate(db_path, db_codec)
@@ -1,23 +1,48 @@
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urlparse
 import time
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, String, Text, Float, Integer
+from sqlalchemy import create_engine, event, Column, String, Text, Float, Integer, LargeBinary
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy.exc import IntegrityError
-import threading
-from queue import Queue
 import concurrent.futures
+import asyncio
+import threading
+from collections import Counter, deque
+from scheduler import HostScheduler, HostFrontier, host_of
+from http_pool import SessionPool
+from url_seen import SeenUrls
+from page_writer import PageWriter, enable_wal
+from frontier import FrontierStore, DiskFrontier
+from extractor import extract, Link
+from parse_pool import ParsePool
+from content_store import content_fields, content_hash, register_functions
+from simhash import SimHashIndex, simhash, to_signed, from_signed
+from metrics import Metrics, FAST_BUCKETS
+from url_rules import Canonicalizer, TrapDetector, DEFAULT_STRIP_PARAMS
+from download import BodyReader, ContentGate, HTML_TYPES, PROBE_EXTENSIONS, declared_length
+from sitemap import SitemapReader
+from warc import WarcWriter
+from render import RenderError, RenderPool, RenderRules
+from priority import PriorityFrontier, default_scorer, parse_weights, TOKEN, DEFAULT_WEIGHTS
+from search_index import BUMP_GENERATION, INDEXED_COLUMNS, ensure_search_index
+from segment_index import SegmentIndexer
 
 load_dotenv()
 
 # Создаем базу данных
 Base = declarative_base()
-engine = create_engine('sqlite:///search_engine.db')
+# Партиции cluster.py пишут каждая в свой файл, см. run_local
+DB_PATH = os.getenv('CRAWLER_DB', 'search_engine.db')
+engine = create_engine(f'sqlite:///{DB_PATH}')
+enable_wal(engine, cache_kb=int(os.getenv('CRAWLER_SQLITE_CACHE_KB', '65536')))
 Session = sessionmaker(bind=engine)
 
+@event.listens_for(engine, 'connect')
+def on_connect(dbapi_connection, connection_record):
+    # page_text() вызывают триггеры полнотекстового индекса при записи страниц
+    register_functions(dbapi_connection)
+
 class WebPage(Base):
     __tablename__ = 'webpages'
     
@@ -25,17 +50,299 @@ class WebPage(Base):
     url = Column(String(500), unique=True)
     title = Column(String(500))
     content = Column(Text)
-    timestamp = Column(Float)
+    # По индексу segment_index находит страницы, измененные после прошлого прохода
+    timestamp = Column(Float, index=True)
+    # Данные для повторного обхода
+    etag = Column(String(200))
+    last_modified = Column(String(100))
+    content_hash = Column(String(40))
+    missing_count = Column(Integer)
+    revisit_interval = Column(Float)
+    next_visit = Column(Float, index=True)
+    check_count = Column(Integer)
+    change_count = Column(Integer)
+    # Сжатый текст (content при этом NULL) и краткое описание для выдачи
+    content_z = Column(LargeBinary)
+    content_codec = Column(String(8))
+    summary = Column(Text)
+    simhash = Column(Integer)
+
+
+def add_missing_columns(engine, table):
+    # create_all не добавляет новые колонки в уже существующую таблицу
+    with engine.begin() as connection:
+        existing = {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info({table.name})')}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
 
 # Создаем таблицы
 Base.metadata.create_all(engine)
+add_missing_columns(engine, WebPage.__table__)
+
+# Полнотекстовый индекс для /search; дальше его обновляют триггеры на webpages,
+# а поколение для кэша выдачи поток записи увеличивает раз на пачку
+SEARCH_INDEX = os.getenv('CRAWLER_SEARCH_INDEX', '1') == '1'
+if SEARCH_INDEX:
+    ensure_search_index(engine)
+
+# Индекс из сегментов для /search?engine=segments (CRAWLER_SEGMENT_DIR): новые
+# страницы индексируются и сегменты сливаются в отдельном процессе, пока идет обход
+segment_indexer = None
+if os.getenv('CRAWLER_SEGMENT_DIR'):
+    segment_indexer = SegmentIndexer(
+        os.getenv('CRAWLER_SEGMENT_DIR'),
+        engine.url.database,
+        interval=float(os.getenv('CRAWLER_SEGMENT_INTERVAL', '30')),
+    )
+
+# Интервалы повторного обхода в секундах
+REVISIT_INITIAL = float(os.getenv('CRAWLER_REVISIT_INITIAL', '86400'))
+REVISIT_MIN = float(os.getenv('CRAWLER_REVISIT_MIN', '3600'))
+REVISIT_MAX = float(os.getenv('CRAWLER_REVISIT_MAX', str(30 * 86400)))
+
+# zlib или zstd - хранить текст страниц сжатым, пусто - как раньше
+CONTENT_CODEC = os.getenv('CRAWLER_CONTENT_CODEC', '') or None
+
+# Один планировщик на процесс: все краулеры делят лимиты по хостам
+host_scheduler = HostScheduler(
+    delay=float(os.getenv('CRAWLER_HOST_DELAY', '1')),
+    burst=int(os.getenv('CRAWLER_HOST_BURST', '1')),
+    respect_crawl_delay=os.getenv('CRAWLER_RESPECT_CRAWL_DELAY', '1') == '1',
+)
+
+# Пул keep-alive сессий, тоже общий для всех краулеров
+http_pool = SessionPool(
+    pool_size=int(os.getenv('CRAWLER_POOL_SIZE', '10')),
+    retries=int(os.getenv('CRAWLER_RETRIES', '2')),
+    backoff=float(os.getenv('CRAWLER_BACKOFF', '0.5')),
+)
+
+# Отпечатки всех встреченных URL, общие для всех краулеров.
+# Заполняются из webpages один раз, дальше база по ссылкам не опрашивается
+seen_urls = SeenUrls(
+    memory_budget=int(os.getenv('CRAWLER_SEEN_MEMORY_MB', '64')) * 1024 * 1024,
+    fp_rate=float(os.getenv('CRAWLER_SEEN_FP_RATE', '0.001')),
+)
+
+# URL страниц, которые поток записи так и не сохранил. Они уже отмечены в seen,
+# поэтому ссылки на них больше не встанут в очередь; их забирает poll_links
+failed_urls = deque()
+
+
+def requeue_failed(items):
+    for kind, row in items:
+        if kind == 'insert':
+            failed_urls.append(row['url'])
+
+
+def bump_search_generation(connection):
+    connection.exec_driver_sql(BUMP_GENERATION)
+
+
+# Расписание повторного обхода: повторное извлечение из WARC (upsert) его не сбрасывает
+SCHEDULE_COLUMNS = ('revisit_interval', 'next_visit', 'check_count', 'change_count', 'missing_count')
+
+# Поток пакетной записи страниц, краулеры только ставят страницы в очередь
+page_writer = PageWriter(
+    engine,
+    WebPage.__table__,
+    batch_size=int(os.getenv('CRAWLER_WRITE_BATCH', '200')),
+    flush_interval=float(os.getenv('CRAWLER_WRITE_INTERVAL', '1')),
+    retries=int(os.getenv('CRAWLER_WRITE_RETRIES', '6')),
+    on_failure=requeue_failed,
+    upsert_keep=SCHEDULE_COLUMNS,
+    on_change=bump_search_generation if SEARCH_INDEX else None,
+    watch_columns=INDEXED_COLUMNS,
+)
+
+# Фронтир на диске (CRAWLER_FRONTIER=disk) переживает перезапуск краулера
+FRONTIER_KIND = os.getenv('CRAWLER_FRONTIER', 'memory')
+frontier_store = None
+if FRONTIER_KIND == 'disk':
+    frontier_store = FrontierStore(os.getenv('CRAWLER_FRONTIER_PATH', 'frontier.db'))
+
+# Приоритетный фронтир (CRAWLER_FRONTIER=priority): сначала неглубокие, часто
+# упоминаемые и подходящие под ключевые слова ссылки, служебные страницы - в конец.
+# По ключевым словам же считается доля полезных страниц (harvest rate)
+FOCUS_KEYWORDS = [word.lower() for word in TOKEN.findall(os.getenv('CRAWLER_KEYWORDS', ''))]
+PRIORITY_WEIGHTS = {**DEFAULT_WEIGHTS, **parse_weights(os.getenv('CRAWLER_PRIORITY_WEIGHTS', ''))}
+priority_scorer = default_scorer(
+    PRIORITY_WEIGHTS,
+    FOCUS_KEYWORDS,
+    [p.strip() for p in os.getenv('CRAWLER_PRIORITY_PATTERNS', '').split(',') if p.strip()],
+)
+
+# Поиск почти одинаковых страниц по SimHash перед сохранением
+DEDUP_ENABLED = os.getenv('CRAWLER_DEDUP', '1') == '1'
+DEDUP_MIN_TOKENS = int(os.getenv('CRAWLER_DEDUP_MIN_TOKENS', '50'))
+DEDUP_FOLLOW_LINKS = os.getenv('CRAWLER_DEDUP_FOLLOW_LINKS', '1') == '1'
+dedup_index = SimHashIndex(max_distance=int(os.getenv('CRAWLER_DEDUP_DISTANCE', '3')))
+
+# Разбор в пуле процессов (CRAWLER_PARSE_WORKERS > 0), иначе прямо в потоке загрузки.
+# SimHash для дедупликации считается там же
+parse_pool = None
+if int(os.getenv('CRAWLER_PARSE_WORKERS', '0')) > 0:
+    parse_pool = ParsePool(
+        workers=int(os.getenv('CRAWLER_PARSE_WORKERS')),
+        max_pending=int(os.getenv('CRAWLER_PARSE_QUEUE', '0')) or None,
+        fingerprint_min_tokens=DEDUP_MIN_TOKENS if DEDUP_ENABLED else None,
+    )
+
+# Нормализация ссылок до проверки seen и эвристики против ловушек краулера
+canonicalize = Canonicalizer(
+    strip_params=[p.strip() for p in os.getenv('CRAWLER_STRIP_PARAMS', ','.join(DEFAULT_STRIP_PARAMS)).split(',') if p.strip()],
+    trailing_slash=os.getenv('CRAWLER_TRAILING_SLASH', 'keep'),
+)
+trap_detector = TrapDetector(
+    max_depth=int(os.getenv('CRAWLER_MAX_DEPTH', '12')),
+    max_segment_repeats=int(os.getenv('CRAWLER_MAX_SEGMENT_REPEATS', '2')),
+    max_query_params=int(os.getenv('CRAWLER_MAX_QUERY_PARAMS', '8')),
+    host_budget=int(os.getenv('CRAWLER_HOST_BUDGET', '0')),
+    pattern_cap=int(os.getenv('CRAWLER_PATTERN_CAP', '0')),
+)
+
+# Тело читается потоком: не-HTML и страницы больше CRAWLER_MAX_BODY_BYTES обрываются
+# по заголовкам или посреди загрузки. HEAD-проба для ссылок на файлы по CRAWLER_HEAD_PROBE=1
+content_gate = ContentGate(
+    max_bytes=int(os.getenv('CRAWLER_MAX_BODY_BYTES', str(5 * 1024 * 1024))),
+    allowed_types=[t.strip() for t in os.getenv('CRAWLER_ALLOWED_TYPES', ','.join(HTML_TYPES)).split(',') if t.strip()],
+    head_probe=os.getenv('CRAWLER_HEAD_PROBE', '0') == '1',
+    probe_extensions=[e.strip() for e in os.getenv('CRAWLER_PROBE_EXTENSIONS', ','.join(PROBE_EXTENSIONS)).split(',') if e.strip()],
+)
+
+# Перед обходом URL из карт сайта (Sitemap: в robots.txt или /sitemap.xml) загружаются
+# в фронтир сразу, свежие по lastmod - первыми. CRAWLER_SITEMAPS=0 отключает
+SITEMAPS_ENABLED = os.getenv('CRAWLER_SITEMAPS', '1') == '1'
+SITEMAP_MAX_URLS = int(os.getenv('CRAWLER_SITEMAP_MAX_URLS', '100000'))
+
+# Сырые ответы в сжатые WARC (CRAWLER_WARC_DIR), чтобы исправления разбора
+# применялись командой python warc.py reextract без повторного обхода
+warc_writer = None
+if os.getenv('CRAWLER_WARC_DIR'):
+    warc_writer = WarcWriter(
+        os.getenv('CRAWLER_WARC_DIR'),
+        prefix=os.getenv('CRAWLER_WARC_PREFIX', 'pieser'),
+        max_bytes=int(os.getenv('CRAWLER_WARC_MAX_MB', '256')) * 1024 * 1024,
+    )
+
+# Рендеринг JavaScript в QtWebEngine только для хостов из CRAWLER_RENDER_HOSTS
+# (шаблоны через запятую) и, при CRAWLER_RENDER_MIN_TEXT > 0, для страниц, где
+# статический HTML дал меньше текста. Без этих настроек пул не создается
+render_rules = RenderRules(
+    hosts=[h.strip() for h in os.getenv('CRAWLER_RENDER_HOSTS', '').split(',') if h.strip()],
+    min_text=int(os.getenv('CRAWLER_RENDER_MIN_TEXT', '0')),
+)
+render_pool = None
+if render_rules.patterns or render_rules.min_text:
+    render_pool = RenderPool(
+        pages=int(os.getenv('CRAWLER_RENDER_PAGES', '2')),
+        timeout=float(os.getenv('CRAWLER_RENDER_TIMEOUT', '15')),
+        idle_ms=int(os.getenv('CRAWLER_RENDER_IDLE_MS', '500')),
+        recycle_after=int(os.getenv('CRAWLER_RENDER_RECYCLE', '50')),
+    )
+
+# Метрики краулера; построчный вывод по каждому URL только при CRAWLER_VERBOSE=1
+VERBOSE = os.getenv('CRAWLER_VERBOSE', '0') == '1'
+metrics = Metrics()
+
+
+def writer_metrics():
+    stats = page_writer.stats()
+    return {
+        'crawler_db_batches_total': stats['batches'],
+        'crawler_db_pages_written_total': stats['pages_written'],
+        'crawler_db_pending_pages': stats['pending'],
+        'crawler_db_commits_per_sec': stats['commits_per_sec'],
+        'crawler_db_pages_per_batch': stats['pages_per_batch'],
+        'crawler_db_write_seconds_total': stats['write_time'],
+        'crawler_db_retries_total': stats['retried'],
+        'crawler_db_failed_pages_total': stats['failed'],
+    }
+
+
+metrics.add_collector(writer_metrics)
+
+# Выставляется по Ctrl-C, чтобы краулеры в потоках успели сохранить фронтир
+stop_event = threading.Event()
+
+
+def warm_start_seen_urls(seen=None):
+    seen = seen_urls if seen is None else seen
+    if seen.warmed:
+        return
+    session = Session()
+    try:
+        seen.warm_start(url for (url,) in session.query(WebPage.url).yield_per(10000))
+    finally:
+        session.close()
+
+
+def warm_start_dedup_index(index=None):
+    index = dedup_index if index is None else index
+    if index.warmed:
+        return
+    session = Session()
+    try:
+        rows = session.query(WebPage.simhash, WebPage.url).filter(WebPage.simhash.isnot(None)).yield_per(10000)
+        index.warm_start((from_signed(value), url) for value, url in rows)
+    finally:
+        session.close()
+
+
+def new_page_fields(etag, last_modified, body_hash, fetched_at=None):
+    # Колонки повторного обхода для только что скачанной страницы
+    fetched_at = time.time() if fetched_at is None else fetched_at
+    return {
+        'etag': etag,
+        'last_modified': last_modified,
+        'content_hash': body_hash,
+        'revisit_interval': REVISIT_INITIAL,
+        'next_visit': fetched_at + REVISIT_INITIAL,
+        'check_count': 0,
+        'change_count': 0,
+    }
+
+
+CRAWL_MODES = ('sync', 'async')
+
 
 class WebCrawler:
-    def __init__(self, start_url, max_pages=None):
+    def __init__(self, start_url, max_pages=None, concurrency=10, timeout=10, scheduler=None, http=None, seen=None,
+                 writer=None, store=None, parser=None, dedup=None, canonicalizer=None, traps=None, gate=None,
+                 archive=None, renderer=None):
         self.start_url = start_url
         self.max_pages = max_pages
-        self.visited_urls = set()
-        self.session = Session()
+        # Сколько запросов одновременно держит асинхронный режим
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.scheduler = scheduler or host_scheduler
+        self.http = http or http_pool
+        self.pages_processed = 0
+        self.seen = seen_urls if seen is None else seen
+        warm_start_seen_urls(self.seen)
+        self.writer = page_writer if writer is None else writer
+        self.frontier_store = frontier_store if store is None else store
+        self.parse_pool = parse_pool if parser is None else parser
+        self.dedup = dedup_index if dedup is None else dedup
+        if DEDUP_ENABLED:
+            warm_start_dedup_index(self.dedup)
+        self.duplicates = 0
+        self.canonicalize = canonicalize if canonicalizer is None else canonicalizer
+        self.traps = trap_detector if traps is None else traps
+        self.gate = content_gate if gate is None else gate
+        self.warc = warc_writer if archive is None else archive
+        self.render_pool = render_pool if renderer is None else renderer
+        self.skipped = Counter()
+        self.bytes_saved = 0
+        self.frontier = None
+        # Доля полезных страниц среди скачанных; process_response идет в потоках пула
+        self.fetched_pages = 0
+        self.relevant_pages = 0
+        self.harvest_lock = threading.Lock()
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -43,7 +350,6 @@ class WebCrawler:
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1',
         }
-        self.lock = threading.Lock()
 
     def is_valid_url(self, url):
         try:
@@ -52,87 +358,456 @@ class WebCrawler:
         except:
             return False
 
-    def extract_text(self, soup):
-        for script in soup(["script", "style"]):
-            script.decompose()
-        return soup.get_text(separator=' ', strip=True)
+    def log(self, message):
+        if VERBOSE:
+            print(f"[{self.start_url}] {message}")
+
+    def save_page(self, url, title, text, **fields):
+        # Дубликаты отсекает ON CONFLICT в потоке записи
+        started = time.perf_counter()
+        fields.update(content_fields(text, CONTENT_CODEC))
+        content = fields.pop('content')
+        self.writer.enqueue(url, title, content, time.time(), **fields)
+        # Время постановки в очередь записи: растет, когда поток записи не успевает
+        metrics.observe('crawler_store_seconds', time.perf_counter() - started, FAST_BUCKETS)
+        return True
+
+    def page_fields(self, response, title, text):
+        return new_page_fields(
+            response.headers.get('ETag'), response.headers.get('Last-Modified'), content_hash(title, text),
+        )
+
+    def find_duplicate(self, url, text, fields, fingerprint=None):
+        # Короткие страницы не проверяются: у них SimHash слишком шумный.
+        # Отпечаток обычно уже посчитан в пуле разбора
+        if not DEDUP_ENABLED or len(text.split()) < DEDUP_MIN_TOKENS:
+            return None
+        if fingerprint is None:
+            fingerprint = simhash(text)
+        fields['simhash'] = to_signed(fingerprint)
+        original = self.dedup.check_and_add(fingerprint, url)
+        # Та же страница еще раз: ее вернули в очередь после неудачной записи
+        return None if original == url else original
+
+    def duplicate_rate(self):
+        total = self.pages_processed + self.duplicates
+        return self.duplicates / total if total else 0.0
+
+    def skip_content(self, url, reason, saved=0):
+        self.skipped[reason] += 1
+        self.bytes_saved += saved
+        metrics.inc('crawler_skipped_total', reason=reason)
+        metrics.inc('crawler_bytes_saved_total', saved)
+        self.log(f"Пропуск {url}: {reason}")
+
+    def fetch(self, url):
+        # None, если HEAD-проба показала, что тело читать не стоит
+        if self.gate.should_probe(url):
+            probe = self.http.head(url, headers=self.headers, timeout=self.timeout, allow_redirects=True)
+            reason = self.gate.check(probe.headers) if probe.status_code == 200 else None
+            if reason is not None:
+                self.skip_content(url, reason, declared_length(probe.headers) or 0)
+                return None
+        started = time.perf_counter()
+        # stream=True: до чтения тела приходят только заголовки
+        response = self.http.get(url, headers=self.headers, timeout=self.timeout, stream=True)
+        metrics.observe('crawler_fetch_seconds', time.perf_counter() - started, host=urlparse(url).netloc)
+        metrics.inc('crawler_responses_total', status=response.status_code)
+        return response
+
+    def open_body(self, url, response):
+        # BodyReader для тела или None, если заголовки его отсекли
+        reason = self.gate.check(response.headers)
+        if reason is not None:
+            response.close()
+            self.skip_content(url, reason, declared_length(response.headers) or 0)
+            return None
+        return BodyReader(response, self.gate.max_bytes)
+
+    def parse(self, url, body):
+        # (title, text, links, SimHash или None, если его не посчитал пул разбора)
+        started = time.perf_counter()
+        content_type = body.response.headers.get('Content-Type')
+        # Относительные ссылки - от адреса, который вернул сервер (после
+        # редиректов), а не от канонического ключа: тот мог потерять слеш
+        base = body.response.url or url
+        # Один проход по байтам тела по мере загрузки, BeautifulSoup только для битой разметки
+        if self.parse_pool is not None:
+            data = body.read()
+            result = (None, '', [], None) if body.too_large else self.parse_pool.parse(url, data, content_type, base)
+        else:
+            result = extract(url, body, content_type, base) + (None,)
+        metrics.observe('crawler_parse_seconds', time.perf_counter() - started, FAST_BUCKETS)
+        metrics.inc('crawler_bytes_total', body.size)
+        return result
+
+    def render(self, url, title, text, links, base=None):
+        # DOM после выполнения JavaScript; при ошибке остается статический разбор.
+        # Браузер запрашивает страницу заново, поэтому ждет паузу хоста и
+        # проверяет robots.txt, как обычная загрузка
+        robots = self.scheduler.ensure_robots(url, self.headers, self.http)
+        if robots is not None and not robots.can_fetch(self.scheduler.user_agent, url):
+            metrics.inc('crawler_render_total', result='robots')
+            self.log(f"Рендеринг {url} запрещен robots.txt")
+            return title, text, links
+        self.scheduler.acquire([host_of(url)])
+        started = time.perf_counter()
+        try:
+            html, timed_out = self.render_pool.render(url, robots=robots, agent=self.scheduler.user_agent)
+        except RenderError as e:
+            metrics.inc('crawler_render_total', result='error')
+            self.log(f"Не удалось отрендерить {url}: {e}")
+            return title, text, links
+        metrics.observe('crawler_render_seconds', time.perf_counter() - started)
+        metrics.inc('crawler_render_total', result='timeout' if timed_out else 'ok')
+        rendered = extract(url, [html.encode('utf-8')], 'text/html; charset=utf-8', base)
+        render_rules.learn(url, text, rendered[1])
+        return rendered
 
-    def url_exists(self, url):
-        with self.lock:
-            return self.session.query(WebPage).filter_by(url=url).first() is not None
+    def process_response(self, url, response):
+        # Общая часть обоих режимов: разбор, сохранение и отбор новых ссылок.
+        # Возвращает (сохранена ли страница, список новых ссылок)
+        if response is None:
+            return False, []
+        self.log(f"Статус код: {response.status_code}")
 
-    def save_page(self, url, title, text):
-        with self.lock:
+        if response.status_code != 200:
+            response.close()
+            self.log(f"Пропуск {url}: статус код {response.status_code}")
+            return False, []
+
+        body = self.open_body(url, response)
+        if body is None:
+            return False, []
+        title, text, links, fingerprint = self.parse(url, body)
+        if body.error is not None:
+            raise body.error
+        if body.too_large:
+            self.skip_content(url, 'too_large', body.bytes_saved())
+            return False, []
+        if self.render_pool is not None and render_rules.should_render(url, text):
+            rendered = self.render(url, title, text, links, response.url or url)
+            if rendered[1] != text:
+                fingerprint = None
+            title, text, links = rendered
+        if self.warc is not None:
+            self.warc.write_response(url, response, body.content)
+        self.count_harvest(title, text)
+        fields = self.page_fields(response, title, text)
+
+        original = self.find_duplicate(url, text, fields, fingerprint)
+        if original is not None:
+            self.duplicates += 1
+            metrics.inc('crawler_duplicates_total')
+            self.log(f"Пропуск {url}: почти совпадает с {original}")
+            if not DEDUP_FOLLOW_LINKS:
+                return False, []
+            saved = False
+        else:
+            saved = self.save_page(url, title, text, **fields)
+
+        return saved, self.accept_links(links)
+
+    def accept_links(self, links):
+        new_links = []
+        for link in links:
+            new_url = self.canonicalize(link)
+            if not self.is_valid_url(new_url):
+                continue
+            if self.claim(new_url):
+                new_links.append(self.keep_anchor(link, new_url))
+            elif self.frontier is not None and new_url in self.seen:
+                self.frontier.touch(new_url, getattr(link, 'anchor', ''))
+        return new_links
+
+    def claim(self, url):
+        # True, если URL прошел проверку на ловушки и впервые отмечен в seen.
+        # Сначала проверка: отвергнутый URL в seen не попадает и может быть
+        # принят позже. add() атомарен, поэтому URL поставит в очередь один краулер
+        if url in self.seen or not self.admit(url):
+            return False
+        if not self.seen.add(url):
+            return False
+        self.traps.record(url)
+        return True
+
+    def keep_anchor(self, link, url):
+        # После канонизации остается простая строка; текст ссылки и источник
+        # нужны приоритетному фронтиру
+        if isinstance(link, Link):
+            return Link(url, link.anchor, link.source)
+        return url
+
+    def is_relevant(self, title, text):
+        if not FOCUS_KEYWORDS:
+            return True
+        tokens = set(TOKEN.findall(f'{title} {text}'.lower()))
+        return any(word in tokens for word in FOCUS_KEYWORDS)
+
+    def count_harvest(self, title, text):
+        relevant = self.is_relevant(title, text)
+        with self.harvest_lock:
+            self.fetched_pages += 1
+            self.relevant_pages += relevant
+            rate = self.harvest_rate()
+        if relevant:
+            metrics.inc('crawler_relevant_pages_total')
+        metrics.set('crawler_harvest_rate', rate, seed=self.start_url)
+
+    def harvest_rate(self):
+        return self.relevant_pages / self.fetched_pages if self.fetched_pages else 0.0
+
+    def admit(self, url):
+        reason = self.traps.check(url)
+        if reason is None:
+            return True
+        metrics.inc('crawler_urls_rejected_total', reason=reason)
+        self.log(f"Пропуск {url}: {reason}")
+        return False
+
+    def handle_result(self, url, saved, new_links, frontier):
+        # Общее завершение обработки страницы для обоих режимов
+        if saved:
+            self.pages_processed += 1
+            metrics.inc('crawler_pages_total')
+            self.log(f"Сохранено: {url} (Всего: {self.pages_processed})")
+
+        for new_url in new_links:
+            frontier.put(new_url)
+
+        metrics.set('crawler_queue_depth', len(frontier), seed=self.start_url)
+        self.log(f"Найдено новых ссылок: {len(new_links)}")
+        self.log(f"Размер очереди: {len(frontier)}")
+
+    def handle_error(self, url, error):
+        metrics.inc('crawler_errors_total', type=type(error).__name__)
+        if isinstance(error, requests.exceptions.RequestException):
+            print(f"[{self.start_url}] Ошибка сети при обработке {url}: {str(error)}")
+        else:
+            print(f"[{self.start_url}] Неожиданная ошибка при обработке {url}: {str(error)}")
+
+    def poll_links(self, frontier):
+        # Точка расширения для ссылок, приходящих не из разобранных страниц.
+        # Здесь - страницы, которые не удалось записать в базу: они скачиваются заново
+        while failed_urls:
             try:
-                webpage = WebPage(
-                    url=url,
-                    title=title,
-                    content=text,
-                    timestamp=time.time()
+                url = failed_urls.popleft()
+            except IndexError:
+                break
+            metrics.inc('crawler_write_requeued_total')
+            frontier.put(url)
+
+    def expecting_links(self):
+        # True, если очередь пуста, но ссылки еще могут прийти извне: пока
+        # поток записи не закоммитил последние страницы, они могут вернуться
+        return bool(failed_urls) or self.writer.pending() > 0
+
+    def next_url(self, frontier):
+        # Ждем, пока освободится хоть один хост из очереди, вместо фиксированной паузы
+        while len(frontier):
+            host = self.scheduler.acquire(frontier.hosts())
+            url = frontier.pop(host)
+            if url is not None:
+                return url
+            self.scheduler.refund(host)
+        return None
+
+    def make_frontier(self):
+        if self.frontier_store is not None:
+            self.frontier = DiskFrontier(self.frontier_store, self.start_url)
+        elif FRONTIER_KIND == 'priority':
+            self.frontier = PriorityFrontier(priority_scorer, PRIORITY_WEIGHTS['host_share'])
+        else:
+            self.frontier = HostFrontier()
+        return self.frontier
+
+    def seed_frontier(self, frontier):
+        if len(frontier):
+            print(f"[{self.start_url}] Продолжение с сохраненного фронтира: {len(frontier)} URL")
+        start_url = self.canonicalize(self.start_url)
+        if self.seen.add(start_url):
+            frontier.put(start_url)
+        if SITEMAPS_ENABLED:
+            self.seed_sitemaps(frontier, start_url)
+
+    def seed_sitemaps(self, frontier, start_url):
+        robots = self.scheduler.ensure_robots(start_url, self.headers, self.http)
+        reader = SitemapReader(self.http, self.scheduler, self.headers, self.timeout, max_urls=SITEMAP_MAX_URLS)
+        entries = reader.read(reader.sitemaps_for(robots, start_url))
+        if not entries:
+            return 0
+        # Свежие по lastmod страницы встают в очередь первыми
+        entries.sort(key=lambda entry: entry[1] or 0, reverse=True)
+        new_links = self.accept_links([url for url, _ in entries])
+        for url in new_links:
+            frontier.put(url)
+        due = self.schedule_changed(entries)
+        metrics.inc('crawler_sitemaps_total', reader.fetched)
+        metrics.inc('crawler_sitemap_urls_total', len(entries))
+        print(f"[{self.start_url}] Карты сайта: {reader.fetched}, URL в них: {len(entries)}, "
+              f"новых в очереди: {len(new_links)}, к повторному обходу: {due}")
+        return len(new_links)
+
+    def schedule_changed(self, entries, chunk=500):
+        # Уже сохраненные страницы, которые по lastmod изменились после нашего
+        # визита, получают next_visit = сейчас и уходят в ближайший повторный обход
+        lastmods = {self.canonicalize(url): lastmod for url, lastmod in entries if lastmod}
+        if not lastmods:
+            return 0
+        urls = list(lastmods)
+        now = time.time()
+        due = 0
+        session = Session()
+        try:
+            for start in range(0, len(urls), chunk):
+                rows = (
+                    session.query(WebPage.url, WebPage.timestamp, WebPage.next_visit)
+                    .filter(WebPage.url.in_(urls[start:start + chunk]))
+                    .all()
                 )
-                self.session.add(webpage)
-                self.session.commit()
-                return True
-            except IntegrityError:
-                self.session.rollback()
-                return False
+                for url, fetched_at, next_visit in rows:
+                    if fetched_at and lastmods[url] > fetched_at and (next_visit or 0) > now:
+                        self.writer.enqueue_update(url, next_visit=now)
+                        due += 1
+        finally:
+            session.close()
+        return due
 
     def crawl(self):
-        queue = Queue()
-        queue.put(self.start_url)
-        pages_processed = 0
-        
-        while not queue.empty() and (self.max_pages is None or pages_processed < self.max_pages):
-            url = queue.get()
-            
-            if url in self.visited_urls or self.url_exists(url):
-                continue
-                
-            try:
-                print(f"[{self.start_url}] Обработка: {url}")
-                response = requests.get(url, headers=self.headers, timeout=10)
-                print(f"[{self.start_url}] Статус код: {response.status_code}")
-                
-                if response.status_code != 200:
-                    print(f"[{self.start_url}] Пропуск {url}: статус код {response.status_code}")
+        frontier = self.make_frontier()
+        self.seed_frontier(frontier)
+        try:
+            self._crawl(frontier)
+        finally:
+            frontier.checkpoint()
+
+    def _crawl(self, frontier):
+        while self.max_pages is None or self.pages_processed < self.max_pages:
+            if stop_event.is_set():
+                break
+            self.poll_links(frontier)
+            if not len(frontier):
+                if self.expecting_links():
+                    time.sleep(0.2)
                     continue
-                    
-                soup = BeautifulSoup(response.text, 'html.parser')
-                text = self.extract_text(soup)
-                title = soup.title.string if soup.title else url
-                
-                if self.save_page(url, title, text):
-                    self.visited_urls.add(url)
-                    pages_processed += 1
-                    print(f"[{self.start_url}] Сохранено: {url} (Всего: {pages_processed})")
+                break
+            url = self.next_url(frontier)
+            if url is None:
+                break
                 
-                links_found = 0
-                for link in soup.find_all('a', href=True):
-                    new_url = urljoin(url, link['href'])
-                    if self.is_valid_url(new_url) and new_url not in self.visited_urls and not self.url_exists(new_url):
-                        queue.put(new_url)
-                        links_found += 1
-                
-                print(f"[{self.start_url}] Найдено новых ссылок: {links_found}")
-                print(f"[{self.start_url}] Размер очереди: {queue.qsize()}")
-                
-                time.sleep(1)
+            try:
+                self.log(f"Обработка: {url}")
+                self.scheduler.ensure_robots(url, self.headers, self.http)
+                response = self.fetch(url)
+                saved, new_links = self.process_response(url, response)
+                self.handle_result(url, saved, new_links, frontier)
                 
-            except requests.exceptions.RequestException as e:
-                print(f"[{self.start_url}] Ошибка сети при обработке {url}: {str(e)}")
-                continue
             except Exception as e:
-                print(f"[{self.start_url}] Неожиданная ошибка при обработке {url}: {str(e)}")
+                self.handle_error(url, e)
+                continue
+
+    def crawl_async(self):
+        asyncio.run(self._crawl_async())
+
+    async def _crawl_async(self):
+        # requests блокирующий, поэтому сами запросы и разбор идут в отдельном
+        # пуле потоков, а цикл событий держит до concurrency страниц в работе
+        loop = asyncio.get_running_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        frontier = self.make_frontier()
+        self.seed_frontier(frontier)
+        in_flight = set()
+        changed = asyncio.Condition()
+
+        workers = [
+            asyncio.create_task(self._async_worker(loop, executor, frontier, in_flight, changed))
+            for _ in range(self.concurrency)
+        ]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+            frontier.checkpoint()
+
+    def _budget_exhausted(self, in_flight):
+        return self.max_pages is not None and self.pages_processed + len(in_flight) >= self.max_pages
+
+    async def _async_worker(self, loop, executor, frontier, in_flight, changed):
+        while True:
+            # Очередь пуста, но другие воркеры еще могут принести ссылки
+            async with changed:
+                while True:
+                    self.poll_links(frontier)
+                    if len(frontier) or not (in_flight or self.expecting_links()):
+                        break
+                    try:
+                        await asyncio.wait_for(changed.wait(), timeout=0.2)
+                    except asyncio.TimeoutError:
+                        pass
+                if not len(frontier) or self._budget_exhausted(in_flight) or stop_event.is_set():
+                    changed.notify_all()
+                    return
+
+            host = await self.scheduler.acquire_async(frontier.hosts())
+            if self._budget_exhausted(in_flight) or stop_event.is_set():
+                self.scheduler.refund(host)
                 continue
+            url = frontier.pop(host)
+            if url is None:
+                self.scheduler.refund(host)
+                continue
+
+            in_flight.add(url)
+            try:
+                self.log(f"Обработка: {url}")
+                await loop.run_in_executor(executor, self.scheduler.ensure_robots, url, self.headers, self.http)
+                response = await loop.run_in_executor(executor, self.fetch, url)
+                saved, new_links = await loop.run_in_executor(executor, self.process_response, url, response)
+                self.handle_result(url, saved, new_links, frontier)
+
+            except Exception as e:
+                self.handle_error(url, e)
+            finally:
+                in_flight.discard(url)
+                async with changed:
+                    changed.notify_all()
 
-def run_crawler(url):
-    crawler = WebCrawler(url, max_pages=None)
+def run_crawler(url, mode='sync', concurrency=10):
+    if mode not in CRAWL_MODES:
+        raise ValueError(f"Неизвестный режим краулинга: {mode}")
+    crawler = WebCrawler(url, max_pages=None, concurrency=concurrency)
     try:
-        crawler.crawl()
+        if mode == 'async':
+            crawler.crawl_async()
+        else:
+            crawler.crawl()
     except KeyboardInterrupt:
         print(f"\nКраулинг {url} остановлен пользователем")
     finally:
-        print(f"Всего обработано страниц для {url}: {len(crawler.visited_urls)}")
+        crawler.writer.flush()
+        print(f"Всего обработано страниц для {url}: {crawler.pages_processed}")
+        print(f"Почти дубликатов для {url}: {crawler.duplicates} ({crawler.duplicate_rate():.1%})")
+        if crawler.skipped:
+            reasons = ', '.join(f'{reason}: {count}' for reason, count in sorted(crawler.skipped.items()))
+            print(f"Пропущено по заголовкам и размеру для {url}: {reasons}, сэкономлено байт: {crawler.bytes_saved}")
+        if FOCUS_KEYWORDS:
+            print(f"Полезных страниц для {url}: {crawler.relevant_pages} из {crawler.fetched_pages} "
+                  f"(harvest rate {crawler.harvest_rate():.1%})")
+
+
+def print_pool_stats():
+    for host, stats in http_pool.stats().items():
+        print(f"[{host}] Запросов: {stats['requests']}, соединений: {stats['connections']}, переиспользовано: {stats['reused']}")
+
+
+def print_writer_stats():
+    stats = page_writer.stats()
+    print(f"Запись: {stats['pages_written']} страниц в {stats['batches']} транзакциях "
+          f"({stats['commits_per_sec']:.2f} коммитов/с, {stats['pages_per_batch']:.1f} страниц на пачку, "
+          f"дубликатов: {stats['duplicates']}, обновлений: {stats['updates']}, удалений: {stats['deletes']}, ошибок: {stats['errors']}, "
+          f"повторов: {stats['retried']}, не записано: {stats['failed']})")
 
 if __name__ == "__main__":
     print("Введите URL через пробел (например: https://www.python.org https://www.github.com):")
@@ -142,17 +817,45 @@ if __name__ == "__main__":
         print("Не указано ни одного URL")
         exit(1)
     
-    print(f"Запуск краулеров для {len(urls)} URL...")
+    # Режим и число одновременных запросов задаются через .env
+    mode = os.getenv('CRAWLER_MODE', 'sync')
+    concurrency = int(os.getenv('CRAWLER_CONCURRENCY', '10'))
+
+    print(f"Запуск краулеров для {len(urls)} URL (режим: {mode})...")
+
+    # Метрики: текст для Prometheus на /metrics и JSON на /metrics.json, либо снимки в файл
+    if os.getenv('CRAWLER_METRICS_PORT'):
+        metrics.serve(int(os.getenv('CRAWLER_METRICS_PORT')))
+    if os.getenv('CRAWLER_METRICS_FILE'):
+        metrics.write_snapshots(os.getenv('CRAWLER_METRICS_FILE'), float(os.getenv('CRAWLER_METRICS_INTERVAL', '10')))
+    if segment_indexer is not None:
+        segment_indexer.start()
     
     # Создаем пул потоков
     with concurrent.futures.ThreadPoolExecutor(max_workers=len(urls)) as executor:
         # Запускаем краулер для каждого URL
-        futures = [executor.submit(run_crawler, url) for url in urls]
+        futures = [executor.submit(run_crawler, url, mode, concurrency) for url in urls]
         
         try:
             # Ждем завершения всех краулеров
             concurrent.futures.wait(futures)
         except KeyboardInterrupt:
             print("\nОстановка всех краулеров...")
+            stop_event.set()
             for future in futures:
-                future.cancel() 
\ No newline at end of file
+                future.cancel()
+
+    page_writer.close()
+    # Последний проход индексатора забирает страницы, записанные при остановке
+    if segment_indexer is not None:
+        segment_indexer.close()
+    if parse_pool is not None:
+        parse_pool.close()
+    if warc_writer is not None:
+        warc_writer.close()
+    if render_pool is not None:
+        render_pool.close()
+    print_pool_stats()
+    print_writer_stats()
+    if os.getenv('CRAWLER_METRICS_FILE'):
+        metrics.dump(os.getenv('CRAWLER_METRICS_FILE'))
\ No newline at end of file
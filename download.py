@@ -0,0 +1,98 @@
+from urllib.parse import urlsplit
+
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+PROBE_EXTENSIONS = (
+    '.pdf', '.zip', '.gz', '.tgz', '.tar', '.rar', '.7z', '.bz2', '.xz', '.exe', '.msi', '.dmg', '.iso', '.apk',
+    '.mp3', '.mp4', '.m4a', '.avi', '.mov', '.mkv', '.webm', '.flac', '.wav',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.ico', '.tif', '.tiff',
+    '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.odt', '.epub',
+)
+
+
+def media_type(content_type):
+    return (content_type or '').split(';')[0].strip().lower()
+
+
+def declared_length(headers):
+    try:
+        return int(headers.get('Content-Length'))
+    except (TypeError, ValueError):
+        return None
+
+
+class ContentGate:
+    # Решает по заголовкам, стоит ли читать тело: чужой Content-Type или
+    # объявленный размер больше max_bytes отсекаются до первого байта тела
+    def __init__(self, max_bytes=5 * 1024 * 1024, allowed_types=HTML_TYPES, head_probe=False,
+                 probe_extensions=PROBE_EXTENSIONS):
+        self.max_bytes = max_bytes
+        self.allowed_types = tuple(t.lower() for t in allowed_types)
+        self.head_probe = head_probe
+        self.probe_extensions = tuple(e.lower() for e in probe_extensions)
+
+    def should_probe(self, url):
+        # HEAD только для адресов, похожих на файлы, остальным он стоил бы лишнего запроса
+        if not self.head_probe:
+            return False
+        return urlsplit(url).path.lower().endswith(self.probe_extensions)
+
+    def check(self, headers):
+        # Причина отказа или None. Без Content-Type тело читаем: тип определит разбор
+        content_type = media_type(headers.get('Content-Type'))
+        if self.allowed_types and content_type and content_type not in self.allowed_types:
+            return 'content_type'
+        length = declared_length(headers)
+        if self.max_bytes and length is not None and length > self.max_bytes:
+            return 'too_large'
+        return None
+
+
+class BodyReader:
+    # Тело ответа, прочитанное с stream=True. Итерация отдает куски по мере
+    # загрузки, так что разбор идет параллельно чтению; после max_bytes чтение
+    # обрывается и соединение закрывается. Повторная итерация берет сохраненные куски
+    def __init__(self, response, max_bytes=0, chunk_size=65536):
+        self.response = response
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.size = 0
+        self.too_large = False
+        self.error = None
+        self.done = False
+
+    def __iter__(self):
+        if self.done:
+            yield from self.chunks
+            return
+        try:
+            for chunk in self.response.iter_content(chunk_size=self.chunk_size):
+                if self.max_bytes and self.size + len(chunk) > self.max_bytes:
+                    self.too_large = True
+                    break
+                self.chunks.append(chunk)
+                self.size += len(chunk)
+                yield chunk
+            self.done = True
+        except Exception as e:
+            # Обрыв сети посреди тела: разбор получит то, что успело прийти,
+            # а вызывающий код увидит ошибку в error
+            self.error = e
+        finally:
+            if self.too_large or self.error is not None:
+                self.done = True
+            self.response.close()
+
+    def read(self):
+        for _ in self:
+            pass
+        return self.content
+
+    @property
+    def content(self):
+        return b''.join(self.chunks)
+
+    def bytes_saved(self):
+        # Сколько не скачали по сравнению с полным телом; известно только при Content-Length
+        length = declared_length(self.response.headers)
+        return max(0, length - self.size) if length is not None else 0
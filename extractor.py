@@ -0,0 +1,154 @@
+import codecs
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+SKIP_TAGS = {'script', 'style'}
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([A-Za-z0-9_.:-]+)', re.IGNORECASE)
+HEADER_CHARSET = re.compile(r'charset\s*=\s*["\']?\s*([A-Za-z0-9_.:-]+)', re.IGNORECASE)
+SNIFF_BYTES = 2048
+
+
+def header_charset(content_type):
+    if not content_type:
+        return None
+    match = HEADER_CHARSET.search(content_type)
+    return match.group(1) if match else None
+
+
+def valid_charset(name):
+    try:
+        return codecs.lookup(name).name
+    except (LookupError, TypeError):
+        return None
+
+
+class Link(str):
+    # URL ссылки, который для остального кода остается обычной строкой, плюс
+    # текст ссылки и адрес страницы, где она найдена, - для приоритета фронтира
+    def __new__(cls, url, anchor='', source=None):
+        link = super().__new__(cls, url)
+        link.anchor = anchor
+        link.source = source
+        return link
+
+
+class PageExtractor(HTMLParser):
+    # Заголовок, видимый текст и ссылки за один проход, без построения дерева.
+    # Текст собирается так же, как soup.get_text(separator=' ', strip=True).
+    # Относительные ссылки разрешаются от base - адреса, с которого тело
+    # действительно пришло; url - ключ страницы в краулере
+    def __init__(self, url, base=None):
+        super().__init__(convert_charrefs=True)
+        self.url = url
+        self.base = base or url
+        self.title = None
+        self.links = []
+        self.parts = []
+        self.skip_depth = 0
+        self.in_title = False
+        self.title_parts = []
+        self.anchor_parts = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'title' and self.title is None:
+            self.in_title = True
+        elif tag == 'a':
+            self.close_anchor()
+            for name, value in attrs:
+                if name == 'href' and value is not None:
+                    self.links.append(urljoin(self.base, value))
+                    self.anchor_parts = []
+                    break
+
+    def close_anchor(self):
+        if self.anchor_parts is not None:
+            self.links[-1] = Link(self.links[-1], ' '.join(self.anchor_parts), self.url)
+            self.anchor_parts = None
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            if self.skip_depth:
+                self.skip_depth -= 1
+        elif tag == 'title' and self.in_title:
+            self.in_title = False
+            self.title = ''.join(self.title_parts)
+        elif tag == 'a':
+            self.close_anchor()
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.in_title:
+            self.title_parts.append(data)
+        data = data.strip()
+        if data:
+            self.parts.append(data)
+            if self.anchor_parts is not None:
+                self.anchor_parts.append(data)
+
+    def result(self):
+        if self.in_title:
+            self.title = ''.join(self.title_parts)
+        self.close_anchor()
+        return self.title or self.url, ' '.join(self.parts), self.links
+
+
+def extract_text(soup):
+    for script in soup(["script", "style"]):
+        script.decompose()
+    return soup.get_text(separator=' ', strip=True)
+
+
+def soup_extract(url, html, base=None):
+    # Прежний путь через BeautifulSoup, остается запасным для битой разметки
+    soup = BeautifulSoup(html, 'html.parser')
+    text = extract_text(soup)
+    title = soup.title.string if soup.title else url
+    base = base or url
+    links = [Link(urljoin(base, link['href']), link.get_text(' ', strip=True), url) for link in soup.find_all('a', href=True)]
+    return title or url, text, links
+
+
+def extract(url, chunks, content_type=None, base=None):
+    # chunks - байты тела по частям. Кодировка берется из заголовка HTTP,
+    # затем из <meta charset> в начале документа, иначе utf-8. base - адрес
+    # ответа после редиректов, если он отличается от url
+    chunks = iter(chunks)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= SNIFF_BYTES:
+            break
+
+    charset = valid_charset(header_charset(content_type))
+    if charset is None:
+        match = META_CHARSET.search(head[:SNIFF_BYTES])
+        charset = valid_charset(match.group(1).decode('ascii')) if match else None
+    decoder = codecs.getincrementaldecoder(charset or 'utf-8')(errors='replace')
+
+    parser = PageExtractor(url, base)
+    raw = [head]
+    try:
+        parser.feed(decoder.decode(head))
+        for chunk in chunks:
+            raw.append(chunk)
+            parser.feed(decoder.decode(chunk))
+        parser.feed(decoder.decode(b'', final=True))
+        parser.close()
+    except Exception:
+        return soup_extract(url, b''.join(raw).decode(charset or 'utf-8', errors='replace'), base)
+
+    title, text, links = parser.result()
+    if not text and not links and len(head) > 0:
+        # Ничего не нашлось в непустом документе - отдаем разбор BeautifulSoup
+        return soup_extract(url, b''.join(raw).decode(charset or 'utf-8', errors='replace'), base)
+    return title, text, links
+
+
+def extract_response(url, response, chunk_size=65536):
+    return extract(url, response.iter_content(chunk_size=chunk_size), response.headers.get('Content-Type'), response.url)
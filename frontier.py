@@ -0,0 +1,164 @@
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+
+from scheduler import host_of
+
+
+class FrontierStore:
+    # Очереди всех краулеров в одном SQLite-файле, отдельном от search_engine.db,
+    # чтобы запись фронтира не конкурировала с записью страниц
+    def __init__(self, path='frontier.db'):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS frontier (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    seed TEXT NOT NULL,
+                    host TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    added REAL,
+                    UNIQUE (seed, url)
+                )
+            """)
+            self.conn.execute('CREATE INDEX IF NOT EXISTS frontier_seed_host ON frontier (seed, host, id)')
+
+    def host_counts(self, seed):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT host, COUNT(*) FROM frontier WHERE seed = ? GROUP BY host', (seed,)
+            ).fetchall()
+        return dict(rows)
+
+    def depths(self):
+        with self.lock:
+            return dict(self.conn.execute('SELECT seed, COUNT(*) FROM frontier GROUP BY seed').fetchall())
+
+    def load(self, seed, host, after_id, limit):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT id, url FROM frontier WHERE seed = ? AND host = ? AND id > ? ORDER BY id LIMIT ?',
+                (seed, host, after_id, limit),
+            ).fetchall()
+
+    def write(self, seed, urls, done_ids):
+        # Одна транзакция на чекпоинт: удаление уже выданных и новые URL. Удаление
+        # первым: выданный URL, который вернули в очередь, должен встать заново
+        inserted = {}
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.executemany('DELETE FROM frontier WHERE id = ?', [(row_id,) for row_id in done_ids])
+                for url, host in urls:
+                    cursor = self.conn.execute(
+                        'INSERT OR IGNORE INTO frontier (seed, host, url, added) VALUES (?, ?, ?, ?)',
+                        (seed, host, url, now),
+                    )
+                    if cursor.rowcount > 0:
+                        inserted[host] = inserted.get(host, 0) + 1
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return inserted
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class DiskFrontier:
+    # Тот же интерфейс, что у HostFrontier, но очередь живет в FrontierStore.
+    # В памяти держится не больше chunk URL на хост; выданные URL удаляются
+    # из базы только на чекпоинте, так что после падения они будут скачаны заново
+    def __init__(self, store, seed, chunk=64, checkpoint_every=500, checkpoint_interval=5.0):
+        self.store = store
+        self.seed = seed
+        self.chunk = chunk
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+        self.counts = store.host_counts(seed)
+        self.size = sum(self.counts.values())
+        self.windows = {}
+        self.last_ids = {}
+        self.outbox = {}
+        self.done_ids = []
+        self.last_checkpoint = time.monotonic()
+
+    def put(self, url):
+        if url not in self.outbox:
+            self.outbox[url] = host_of(url)
+            self.size += 1
+        self._maybe_checkpoint()
+
+    def hosts(self):
+        hosts = [host for host, count in self.counts.items() if count > 0]
+        seen = set(hosts)
+        for host in self.outbox.values():
+            if host not in seen:
+                seen.add(host)
+                hosts.append(host)
+        return hosts
+
+    def pop(self, host):
+        window = self.windows.get(host)
+        if not window:
+            if host in self.outbox.values():
+                self.checkpoint()
+            rows = self.store.load(self.seed, host, self.last_ids.get(host, 0), self.chunk)
+            if not rows:
+                self.windows.pop(host, None)
+                return None
+            window = self.windows[host] = deque(rows)
+            self.last_ids[host] = rows[-1][0]
+
+        row_id, url = window.popleft()
+        if not window:
+            del self.windows[host]
+        self.counts[host] -= 1
+        if not self.counts[host]:
+            del self.counts[host]
+        self.size -= 1
+        self.done_ids.append(row_id)
+        self._maybe_checkpoint()
+        return url
+
+    def touch(self, url, anchor=''):
+        pass
+
+    def _maybe_checkpoint(self):
+        if (len(self.outbox) + len(self.done_ids) >= self.checkpoint_every
+                or time.monotonic() - self.last_checkpoint >= self.checkpoint_interval):
+            self.checkpoint()
+
+    def checkpoint(self):
+        queued = len(self.outbox)
+        inserted = self.store.write(self.seed, list(self.outbox.items()), self.done_ids)
+        for host, count in inserted.items():
+            self.counts[host] = self.counts.get(host, 0) + count
+        # Уже стоявшие в очереди URL база проигнорировала
+        self.size -= queued - sum(inserted.values())
+        self.outbox = {}
+        self.done_ids = []
+        self.last_checkpoint = time.monotonic()
+
+    def __len__(self):
+        return self.size
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'frontier.db'
+    store = FrontierStore(path)
+    depths = store.depths()
+    if not depths:
+        print("Фронтир пуст")
+    for seed, depth in sorted(depths.items(), key=lambda item: -item[1]):
+        print(f"{depth:>10}  {seed}")
+    store.close()
@@ -0,0 +1,83 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from scheduler import host_of
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class SessionPool:
+    # Сессии requests по одной на хост, общие для всех краулеров процесса,
+    # чтобы TCP/TLS соединения переиспользовались между страницами
+    def __init__(self, pool_size=10, retries=2, backoff=0.5, headers=None):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.headers = headers or {}
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def _make_session(self):
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def session_for(self, url):
+        host = host_of(url)
+        session = self.sessions.get(host)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(host)
+                if session is None:
+                    session = self.sessions[host] = self._make_session()
+        return session
+
+    def get(self, url, **kwargs):
+        return self.session_for(url).get(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.session_for(url).head(url, **kwargs)
+
+    def stats(self):
+        # num_requests / num_connections берутся из пулов urllib3:
+        # чем меньше соединений на запрос, тем больше переиспользование
+        with self.lock:
+            sessions = dict(self.sessions)
+        result = {}
+        for host, session in sessions.items():
+            requests_count = 0
+            connections = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    requests_count += pool.num_requests
+                    connections += pool.num_connections
+            result[host] = {
+                'requests': requests_count,
+                'connections': connections,
+                'reused': max(0, requests_count - connections),
+            }
+        return result
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
@@ -0,0 +1,199 @@
+import bisect
+import http.server
+import json
+import os
+import socketserver
+import threading
+import time
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Оценка по верхней границе корзины, как histogram_quantile в Prometheus
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metrics:
+    # Счетчики, значения и гистограммы краулера. Запись - одно обновление
+    # словаря под блокировкой, все форматирование делается только при чтении
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def add_collector(self, collector):
+        # collector() возвращает {имя: значение} и вызывается при каждом чтении
+        self.collectors.append(collector)
+
+    def _collected(self):
+        values = {}
+        for collector in self.collectors:
+            try:
+                values.update(collector())
+            except Exception:
+                pass
+        return values
+
+    def snapshot(self):
+        uptime = time.time() - self.started
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {
+                key: (h.count, h.sum, h.quantile(0.5), h.quantile(0.99))
+                for key, h in self.histograms.items()
+            }
+
+        def label_name(name, labels):
+            return name + _format_labels(labels)
+
+        result = {
+            'timestamp': time.time(),
+            'uptime': uptime,
+            'counters': {label_name(*key): value for key, value in counters.items()},
+            'gauges': {label_name(*key): value for key, value in gauges.items()},
+            'histograms': {
+                label_name(*key): {'count': count, 'sum': total, 'p50': p50, 'p99': p99}
+                for key, (count, total, p50, p99) in histograms.items()
+            },
+        }
+        result['gauges'].update(self._collected())
+        pages = sum(value for (name, _), value in counters.items() if name == 'crawler_pages_total')
+        received = sum(value for (name, _), value in counters.items() if name == 'crawler_bytes_total')
+        result['pages_per_sec'] = pages / uptime if uptime else 0.0
+        result['bytes_per_sec'] = received / uptime if uptime else 0.0
+        return result
+
+    def prometheus(self):
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {kind}')
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                declare(name, 'counter')
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+            for (name, labels), value in sorted(self.gauges.items()):
+                declare(name, 'gauge')
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+            for (name, labels), h in sorted(self.histograms.items()):
+                declare(name, 'histogram')
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {h.count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {h.sum}')
+                lines.append(f'{name}_count{_format_labels(labels)} {h.count}')
+        for name, value in sorted(self._collected().items()):
+            declare(name, 'gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        metrics = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/metrics.json'):
+                    body = json.dumps(metrics.snapshot()).encode('utf-8')
+                    content_type = 'application/json'
+                elif self.path.startswith('/metrics'):
+                    body = metrics.prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class MetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        server = MetricsServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        return server
+
+    def write_snapshots(self, path, interval=10.0):
+        def run():
+            while True:
+                time.sleep(interval)
+                self.dump(path)
+
+        threading.Thread(target=run, name='metrics-snapshot', daemon=True).start()
+
+    def dump(self, path):
+        # Через временный файл, чтобы читатель не увидел половину JSON
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
@@ -0,0 +1,266 @@
+import threading
+import time
+from queue import Queue, Empty
+
+from sqlalchemy import bindparam, delete, event, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+
+_STOP = object()
+# Ошибки, после которых пачку имеет смысл записать еще раз: другой процесс
+# держит блокировку дольше busy_timeout
+TRANSIENT_ERRORS = ('database is locked', 'database table is locked', 'database is busy')
+MAX_RETRY_DELAY = 5.0
+
+
+def enable_wal(engine, cache_kb=65536, busy_timeout_ms=5000):
+    # WAL позволяет app.py читать базу, пока краулер пишет, а synchronous=NORMAL
+    # убирает fsync на каждый коммит (в WAL это безопасно для целостности)
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA cache_size=-{int(cache_kb)}')
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout_ms)}')
+        cursor.close()
+
+
+def is_transient(error):
+    message = str(error).lower()
+    return any(text in message for text in TRANSIENT_ERRORS)
+
+
+class PageWriter:
+    # Отдельный поток записи: краулеры только кладут страницы в очередь,
+    # а здесь они пишутся пачками по batch_size или раз в flush_interval секунд.
+    # Занятую базу пачка пережидает с растущей паузой; строки, которые так и не
+    # записались, отдаются в on_failure, чтобы краулер скачал их заново.
+    # upsert_keep - колонки, которые upsert заполняет только у новой строки.
+    # on_change(connection) вызывается внутри транзакции пачки, если она добавила,
+    # удалила или перезаписала страницы либо обновила одну из watch_columns
+    def __init__(self, engine, table, batch_size=200, flush_interval=1.0, max_queue=10000, retries=6,
+                 retry_delay=0.2, on_failure=None, upsert_keep=(), on_change=None, watch_columns=()):
+        self.engine = engine
+        self.table = table
+        self.upsert_keep = set(upsert_keep)
+        self.on_change = on_change
+        self.watch_columns = set(watch_columns)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.on_failure = on_failure
+        self.queue = Queue(maxsize=max_queue)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.batches = 0
+        self.pages_written = 0
+        self.duplicates = 0
+        self.updates = 0
+        self.deletes = 0
+        self.errors = 0
+        self.retried = 0
+        self.failed = 0
+        self.write_time = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.started_at = time.monotonic()
+                self.thread = threading.Thread(target=self._run, name='page-writer', daemon=True)
+                self.thread.start()
+
+    def enqueue(self, url, title, content, timestamp=None, **fields):
+        self.start()
+        row = {
+            'url': url,
+            'title': title,
+            'content': content,
+            'timestamp': timestamp if timestamp is not None else time.time(),
+        }
+        row.update(fields)
+        self.queue.put(('insert', row))
+
+    def enqueue_upsert(self, url, title, content, timestamp=None, **fields):
+        # Как enqueue, но уже сохраненная страница перезаписывается, кроме колонок upsert_keep
+        self.start()
+        row = {
+            'url': url,
+            'title': title,
+            'content': content,
+            'timestamp': timestamp if timestamp is not None else time.time(),
+        }
+        row.update(fields)
+        self.queue.put(('upsert', row))
+
+    def enqueue_update(self, url, **fields):
+        # Обновление отдельных колонок уже сохраненной страницы
+        self.start()
+        self.queue.put(('update', dict(fields, url=url)))
+
+    def enqueue_delete(self, url):
+        # Страница пропала с сайта; индексы поиска чистят триггеры на webpages
+        self.start()
+        self.queue.put(('delete', {'url': url}))
+
+    def pending(self):
+        # Поставлено в очередь, но еще не закоммичено (или не отдано в on_failure)
+        return self.queue.unfinished_tasks
+
+    def flush(self):
+        # Ждет, пока все уже поставленные страницы будут закоммичены
+        self.queue.join()
+
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                item = None
+
+            if item is _STOP:
+                self._commit(batch)
+                self.queue.task_done()
+                return
+            if item is not None:
+                batch.append(item)
+                if len(batch) == 1:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._commit(batch)
+                batch = []
+
+    def _commit(self, batch):
+        if not batch:
+            return
+        started = time.monotonic()
+        try:
+            failed = self._write_with_retries(batch)
+            if failed:
+                self.failed += len(failed)
+                if self.on_failure is not None:
+                    self.on_failure(failed)
+        finally:
+            self.write_time += time.monotonic() - started
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write_with_retries(self, batch):
+        # Пустой список, если пачка записана, иначе строки, которые записать не удалось.
+        # Повтор идет здесь же, а не через очередь: порядок записей и flush() не меняются
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                self._write(batch)
+                return []
+            except OperationalError as e:
+                if not is_transient(e) or attempt == self.retries:
+                    error = e
+                    break
+                self.retried += 1
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            except Exception as e:
+                error = e
+                break
+        self.errors += 1
+        print(f"Ошибка записи пачки из {len(batch)} страниц: {str(error)}")
+        if is_transient(error) or len(batch) == 1:
+            return batch
+        # Пачку могла сломать одна строка: по одной записываются все остальные
+        failed = []
+        for item in batch:
+            try:
+                self._write([item])
+            except Exception:
+                failed.append(item)
+        return failed
+
+    def _write(self, batch):
+        inserts = inserted = upserts = updates = deletes = 0
+        watched = False
+        with self.engine.begin() as connection:
+            for kind, rows in self._runs(batch):
+                if kind == 'delete':
+                    connection.execute(
+                        delete(self.table).where(self.table.c.url == bindparam('v_url')),
+                        [{'v_url': row['url']} for row in rows],
+                    )
+                    deletes += len(rows)
+                    continue
+                # executemany требует одинаковый набор колонок в каждой строке
+                groups = {}
+                for row in rows:
+                    groups.setdefault(tuple(sorted(row)), []).append(row)
+                for keys, group in groups.items():
+                    if kind == 'insert':
+                        statement = sqlite_insert(self.table).on_conflict_do_nothing(index_elements=['url'])
+                        inserted += max(0, connection.execute(statement, group).rowcount)
+                        inserts += len(group)
+                    elif kind == 'upsert':
+                        connection.execute(self._upsert_statement(keys), group)
+                        upserts += len(group)
+                    else:
+                        connection.execute(self._update_statement(keys), [
+                            {f'v_{key}': value for key, value in row.items()} for row in group
+                        ])
+                        updates += len(group)
+                        watched = watched or bool(self.watch_columns.intersection(keys))
+            if self.on_change is not None and (inserted or upserts or deletes or watched):
+                self.on_change(connection)
+        self.batches += 1
+        self.pages_written += inserted + upserts
+        self.duplicates += inserts - inserted
+        self.updates += updates
+        self.deletes += deletes
+
+    def _runs(self, batch):
+        # Пачка делится на отрезки подряд идущих записей одного вида, отрезки
+        # пишутся в порядке очереди. Повтор URL тоже начинает новый отрезок:
+        # внутри отрезка строки группируются по колонкам и могут переставиться
+        runs = []
+        urls = set()
+        for kind, row in batch:
+            if not runs or runs[-1][0] != kind or row['url'] in urls:
+                runs.append((kind, []))
+                urls = set()
+            urls.add(row['url'])
+            runs[-1][1].append(row)
+        return runs
+
+    def _upsert_statement(self, keys):
+        statement = sqlite_insert(self.table)
+        values = {key: statement.excluded[key] for key in keys if key != 'url' and key not in self.upsert_keep}
+        return statement.on_conflict_do_update(index_elements=['url'], set_=values)
+
+    def _update_statement(self, keys):
+        values = {key: bindparam(f'v_{key}') for key in keys if key != 'url'}
+        return update(self.table).where(self.table.c.url == bindparam('v_url')).values(values)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            'batches': self.batches,
+            'pages_written': self.pages_written,
+            'duplicates': self.duplicates,
+            'updates': self.updates,
+            'deletes': self.deletes,
+            'errors': self.errors,
+            'retried': self.retried,
+            'failed': self.failed,
+            'pending': self.queue.qsize(),
+            'commits_per_sec': self.batches / elapsed if elapsed else 0.0,
+            'pages_per_batch': (self.pages_written + self.duplicates + self.updates + self.deletes) / self.batches if self.batches else 0.0,
+            'write_time': self.write_time,
+        }
@@ -0,0 +1,61 @@
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+
+from extractor import extract
+from simhash import simhash
+
+
+def parse_body(url, body, content_type, min_tokens=None, base=None):
+    # Выполняется в дочернем процессе, поэтому получает только байты. Там же
+    # считается SimHash для поиска дубликатов: он занял бы GIL потока загрузки.
+    # None вместо отпечатка - страница короче min_tokens или дедупликация выключена
+    title, text, links = extract(url, [body], content_type, base)
+    fingerprint = None
+    if min_tokens is not None and len(text.split()) >= min_tokens:
+        fingerprint = simhash(text)
+    return title, text, links, fingerprint
+
+
+class ParsePool:
+    # Разбор HTML в отдельных процессах, чтобы он не упирался в GIL потоков
+    # загрузки. Семафор ограничивает число страниц, ждущих разбора: когда
+    # процессы не успевают, потоки загрузки ждут здесь, а не копят тела в памяти
+    def __init__(self, workers=None, max_pending=None, fingerprint_min_tokens=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.fingerprint_min_tokens = fingerprint_min_tokens
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.executor is None:
+                # spawn: форк процесса с живыми потоками и соединениями SQLite небезопасен
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+        return self.executor
+
+    def submit(self, url, body, content_type=None, base=None):
+        executor = self.start()
+        self.slots.acquire()
+        try:
+            future = executor.submit(parse_body, url, body, content_type, self.fingerprint_min_tokens, base)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def parse(self, url, body, content_type=None, base=None):
+        return self.submit(url, body, content_type, base).result()
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+                self.executor = None
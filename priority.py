@@ -0,0 +1,210 @@
+import heapq
+import itertools
+import math
+import re
+import threading
+from collections import OrderedDict
+
+from scheduler import host_of
+
+# Страницы, на которые обычно уходит бюджет без пользы: вход, корзина,
+# облака тегов, пагинация, сортировки, версии для печати
+LOW_VALUE_PATTERNS = (
+    r'/(login|logout|signin|signup|sign-in|sign-up|register|auth|account|cart|checkout|basket)\b',
+    r'/(tag|tags|label|labels|category|categories)/',
+    r'[?&](page|p|start|offset)=\d+', r'/page/\d+',
+    r'[?&](sort|order|orderby|filter|view|print|share|replytocom)=',
+    r'/(print|share|feed|rss|comments?)/?$',
+)
+TOKEN = re.compile(r'\w+', re.UNICODE)
+DEFAULT_WEIGHTS = {'depth': 1.0, 'inlinks': 0.5, 'pattern': 1.0, 'keyword': 2.0, 'host_share': 1.0}
+
+
+class LinkInfo:
+    __slots__ = ('url', 'depth', 'inlinks', 'anchor')
+
+    def __init__(self, url, depth=0, inlinks=1, anchor=''):
+        self.url = url
+        self.depth = depth
+        self.inlinks = inlinks
+        self.anchor = anchor
+
+
+def depth_signal(link):
+    # 1 для seed, дальше убывает с числом переходов
+    return 1.0 / (1 + link.depth)
+
+
+def inlink_signal(link):
+    # Сколько найденных страниц уже ссылаются на URL, пока он ждет в очереди
+    return math.log2(link.inlinks) if link.inlinks > 1 else 0.0
+
+
+class PatternSignal:
+    def __init__(self, low_value=LOW_VALUE_PATTERNS, high_value=()):
+        self.low_value = [re.compile(pattern, re.IGNORECASE) for pattern in low_value]
+        self.high_value = [re.compile(pattern, re.IGNORECASE) for pattern in high_value]
+
+    def __call__(self, link):
+        if any(pattern.search(link.url) for pattern in self.low_value):
+            return -1.0
+        if any(pattern.search(link.url) for pattern in self.high_value):
+            return 1.0
+        return 0.0
+
+
+class KeywordSignal:
+    # Доля ключевых слов, встретившихся в тексте ссылки или в самом URL
+    def __init__(self, keywords):
+        self.keywords = {keyword.lower() for keyword in keywords}
+
+    def __call__(self, link):
+        if not self.keywords:
+            return 0.0
+        tokens = set(TOKEN.findall(f'{link.anchor} {link.url}'.lower()))
+        return len(self.keywords & tokens) / len(self.keywords)
+
+
+class Scorer:
+    # Сумма взвешенных сигналов. Сигнал - любая функция LinkInfo -> число,
+    # свои добавляются в signals вместе с весом
+    def __init__(self, signals):
+        self.signals = list(signals)
+
+    def score(self, link):
+        return sum(weight * signal(link) for weight, signal in self.signals)
+
+
+def parse_weights(spec):
+    # 'depth=1,inlinks=0.5,keyword=2' -> словарь весов; неизвестные имена - ошибка
+    weights = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_WEIGHTS:
+            raise ValueError(f"Неизвестный сигнал приоритета: {name}")
+        weights[name] = float(value)
+    return weights
+
+
+def default_scorer(weights=None, keywords=(), high_value=()):
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    return Scorer([
+        (weights['depth'], depth_signal),
+        (weights['inlinks'], inlink_signal),
+        (weights['pattern'], PatternSignal(high_value=high_value)),
+        (weights['keyword'], KeywordSignal(keywords)),
+    ])
+
+
+class PriorityFrontier:
+    # Тот же интерфейс, что у HostFrontier, но внутри хоста URL выдаются по
+    # убыванию оценки (куча), а хосты упорядочены по лучшей оценке за вычетом
+    # штрафа за долю уже потраченного на хост бюджета. Повторные ссылки на URL
+    # в очереди (touch) поднимают его оценку; старые записи кучи просто
+    # пропускаются при выдаче и вычищаются, когда их становится больше живых
+    def __init__(self, scorer=None, host_share_weight=DEFAULT_WEIGHTS['host_share'], depth_memory=100000):
+        self.scorer = scorer or default_scorer()
+        self.host_share_weight = host_share_weight
+        self.depth_memory = depth_memory
+        self.heaps = {}
+        self.stale = {}
+        self.entries = {}
+        self.host_sizes = {}
+        self.fetched = {}
+        self.total_fetched = 0
+        self.depths = OrderedDict()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def _push(self, host, url, link):
+        score = self.scorer.score(link)
+        version = next(self.counter)
+        self.entries[url] = (link, version, score)
+        heapq.heappush(self.heaps.setdefault(host, []), (-score, version, url))
+        return score
+
+    def put(self, url):
+        # Глубина - от страницы, где нашлась ссылка (Link.source), текст - Link.anchor
+        source = getattr(url, 'source', None)
+        anchor = getattr(url, 'anchor', '') or ''
+        url = str(url)
+        host = host_of(url)
+        with self.lock:
+            if url in self.entries:
+                return
+            depth = self.depths.get(source, -1) + 1 if source is not None else 0
+            self._push(host, url, LinkInfo(url, depth, 1, anchor))
+            self.host_sizes[host] = self.host_sizes.get(host, 0) + 1
+
+    def touch(self, url, anchor=''):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return
+            link = entry[0]
+            link.inlinks += 1
+            if anchor and anchor not in link.anchor:
+                link.anchor = f'{link.anchor} {anchor}'.strip()
+            host = host_of(url)
+            self._push(host, url, link)
+            self.stale[host] = self.stale.get(host, 0) + 1
+            if self.stale[host] > self.host_sizes.get(host, 0):
+                self._compact(host)
+
+    def _compact(self, host):
+        heap = [item for item in self.heaps.get(host, ()) if self._live(item)]
+        heapq.heapify(heap)
+        self.heaps[host] = heap
+        self.stale[host] = 0
+
+    def _live(self, item):
+        entry = self.entries.get(item[2])
+        return entry is not None and entry[1] == item[1]
+
+    def _host_priority(self, host):
+        heap = self.heaps[host]
+        while heap and not self._live(heap[0]):
+            heapq.heappop(heap)
+            self.stale[host] = max(0, self.stale.get(host, 0) - 1)
+        best = -heap[0][0] if heap else float('-inf')
+        share = self.fetched.get(host, 0) / self.total_fetched if self.total_fetched else 0.0
+        return best - self.host_share_weight * share
+
+    def hosts(self):
+        # Планировщик берет первый готовый хост, поэтому порядок здесь и есть приоритет
+        with self.lock:
+            hosts = [host for host, size in self.host_sizes.items() if size > 0]
+            return sorted(hosts, key=self._host_priority, reverse=True)
+
+    def pop(self, host):
+        with self.lock:
+            heap = self.heaps.get(host)
+            while heap:
+                item = heapq.heappop(heap)
+                if not self._live(item):
+                    self.stale[host] = max(0, self.stale.get(host, 0) - 1)
+                    continue
+                url = item[2]
+                link = self.entries.pop(url)[0]
+                self.host_sizes[host] -= 1
+                if not self.host_sizes[host]:
+                    del self.host_sizes[host]
+                    del self.heaps[host]
+                    self.stale.pop(host, None)
+                self.fetched[host] = self.fetched.get(host, 0) + 1
+                self.total_fetched += 1
+                # Глубина нужна, пока страница в работе и ее ссылки встают в очередь
+                self.depths[url] = link.depth
+                if len(self.depths) > self.depth_memory:
+                    self.depths.popitem(last=False)
+                return url
+            return None
+
+    def checkpoint(self):
+        pass
+
+    def __len__(self):
+        return len(self.entries)
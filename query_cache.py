@@ -0,0 +1,171 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Примерные накладные расходы на запись в памяти сверх сериализованного значения
+ENTRY_OVERHEAD = 200
+
+
+class DiskTier:
+    # Общий для нескольких процессов app.py уровень кэша в отдельной базе SQLite
+    def __init__(self, path, max_entries=100000, prune_every=1000):
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self.puts = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=2000')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS query_cache '
+            '(key TEXT PRIMARY KEY, generation INTEGER, expires REAL, value BLOB, created REAL)'
+        )
+        # Кэш прежней версии: старым записям created = 0, записи других
+        # поколений у них просто не совпадут. Колонку мог добавить и соседний процесс
+        if 'created' not in {row[1] for row in self.conn.execute('PRAGMA table_info(query_cache)')}:
+            try:
+                self.conn.execute('ALTER TABLE query_cache ADD COLUMN created REAL NOT NULL DEFAULT 0')
+            except sqlite3.OperationalError as e:
+                if 'duplicate column' not in str(e):
+                    raise
+
+    def get(self, key, generation, max_stale=0.0):
+        # (value, generation, created) или None; запись старого поколения
+        # подходит, если она моложе max_stale секунд
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT value, generation, created FROM query_cache WHERE key = ? AND expires > ? '
+                'AND (generation = ? OR (generation < ? AND created > ?))',
+                (key, now, generation, generation, now - max_stale),
+            ).fetchone()
+        return row
+
+    def put(self, key, generation, payload, expires, created):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO query_cache (key, generation, expires, value, created) VALUES (?, ?, ?, ?, ?)',
+                (key, generation, expires, payload, created),
+            )
+            self.puts += 1
+            if self.puts % self.prune_every == 0:
+                self._prune()
+
+    def _prune(self):
+        # Просроченные записи и все сверх max_entries, начиная с ближайших к истечению
+        self.conn.execute('DELETE FROM query_cache WHERE expires <= ?', (time.time(),))
+        self.conn.execute(
+            'DELETE FROM query_cache WHERE key IN (SELECT key FROM query_cache ORDER BY expires DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,),
+        )
+
+    def entries(self):
+        with self.lock:
+            return self.conn.execute('SELECT count(*) FROM query_cache').fetchone()[0]
+
+
+class QueryCache:
+    # LRU с TTL и бюджетом в байтах для готовых страниц выдачи. Каждая запись
+    # помечена поколением индекса: после новой записи в базу поколение растет,
+    # и старые записи просто перестают совпадать, сбрасывать кэш не нужно.
+    # Пока идет обход, поколение растет на каждой пачке краулера, поэтому
+    # запись старого поколения еще отдается, если ей меньше max_stale секунд:
+    # выдача отстает от базы не больше чем на max_stale
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=300.0, disk=None, max_stale=0.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk = disk
+        self.max_stale = max_stale
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    def get(self, key, generation):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry_generation, created, expires, size, value = entry
+                if expires > now and self._usable(entry_generation, created, generation, now):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    if entry_generation != generation:
+                        self.stale_hits += 1
+                    return value
+                self._remove(key)
+                self.stale += 1
+        if self.disk is not None:
+            row = self.disk.get(key, generation, self.max_stale)
+            if row is not None:
+                payload, entry_generation, created = row
+                value = json.loads(payload)
+                # Поколение и время записи остаются свои, иначе старая запись
+                # в памяти считалась бы свежей
+                self._store(key, entry_generation, created, value, len(payload), now + self.ttl)
+                with self.lock:
+                    self.disk_hits += 1
+                    if entry_generation != generation:
+                        self.stale_hits += 1
+                return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, generation, value):
+        payload = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        now = time.time()
+        expires = now + self.ttl
+        self._store(key, generation, now, value, len(payload), expires)
+        if self.disk is not None:
+            self.disk.put(key, generation, payload, expires, now)
+
+    def _usable(self, entry_generation, created, generation, now):
+        if entry_generation == generation:
+            return True
+        return entry_generation < generation and created > now - self.max_stale
+
+    def _store(self, key, generation, created, value, size, expires):
+        size += len(key) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (generation, created, expires, size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key)[3]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'stale': self.stale,
+                'stale_hits': self.stale_hits,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'max_stale': self.max_stale,
+            }
+        if self.disk is not None:
+            stats['disk_entries'] = self.disk.entries()
+        return stats
@@ -0,0 +1,238 @@
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+
+import requests
+from sqlalchemy import or_, select
+
+from crawler import (
+    CONTENT_CODEC, REVISIT_MAX, REVISIT_MIN, Session, WebCrawler, WebPage, content_hash, parse_pool,
+    print_pool_stats, print_writer_stats, stop_event, warc_writer,
+)
+from content_store import content_fields
+from scheduler import HostFrontier
+
+# 410 - страница удалена навсегда, 404 - возможно, временно: такая страница
+# удаляется из базы после GONE_AFTER ответов подряд, а до того проверяется
+# все реже, интервал растет в MISSING_BACKOFF раз
+GONE_STATUSES = (404, 410)
+GONE_AFTER = int(os.getenv('CRAWLER_GONE_AFTER', '3'))
+MISSING_BACKOFF = 4.0
+
+
+def next_interval(interval, changed):
+    # Изменилась страница — заходим вдвое чаще, нет — в полтора раза реже,
+    # так интервал подстраивается под наблюдаемую частоту изменений
+    interval = interval or REVISIT_MIN
+    if changed:
+        return max(REVISIT_MIN, interval / 2)
+    return min(REVISIT_MAX, interval * 1.5)
+
+
+class Recrawler(WebCrawler):
+    # Повторный обход уже сохраненных страниц, у которых подошел next_visit.
+    # Условные запросы и хеш извлеченного текста позволяют не трогать
+    # неизменившиеся страницы
+    def __init__(self, batch_size=1000, **kwargs):
+        super().__init__('recrawl', **kwargs)
+        self.batch_size = batch_size
+        self.frontier_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats = {'checked': 0, 'not_modified': 0, 'unchanged': 0, 'changed': 0, 'errors': 0, 'skipped': 0, 'missing': 0,
+                      'removed': 0, 'bytes': 0}
+
+    def due_pages(self):
+        session = Session()
+        try:
+            return session.execute(
+                select(
+                    WebPage.url, WebPage.etag, WebPage.last_modified, WebPage.content_hash,
+                    WebPage.revisit_interval, WebPage.check_count, WebPage.change_count, WebPage.missing_count,
+                )
+                .where(or_(WebPage.next_visit.is_(None), WebPage.next_visit <= time.time()))
+                .order_by(WebPage.next_visit)
+                .limit(self.batch_size)
+            ).all()
+        finally:
+            session.close()
+
+    def _count(self, key, value=1):
+        with self.stats_lock:
+            self.stats[key] += value
+
+    def _budget_left(self):
+        return self.max_pages is None or self.stats['checked'] < self.max_pages
+
+    def recrawl(self):
+        while not stop_event.is_set() and self._budget_left():
+            pages = self.due_pages()
+            if not pages:
+                break
+            self.revisit_batch(pages)
+            # Следующая выборка должна видеть обновленные next_visit
+            self.writer.flush()
+
+    def revisit_batch(self, pages):
+        frontier = HostFrontier()
+        by_url = {}
+        for page in pages:
+            frontier.put(page.url)
+            by_url[page.url] = page
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for _ in range(self.concurrency):
+                executor.submit(self._worker, frontier, by_url)
+
+    def _worker(self, frontier, by_url):
+        while not stop_event.is_set() and self._budget_left():
+            with self.frontier_lock:
+                hosts = frontier.hosts()
+            if not hosts:
+                return
+            host = self.scheduler.acquire(hosts)
+            with self.frontier_lock:
+                url = frontier.pop(host)
+            if url is None:
+                self.scheduler.refund(host)
+                continue
+            self._count('checked')
+            try:
+                self.revisit(by_url[url])
+            except Exception as e:
+                print(f"[recrawl] Неожиданная ошибка при обработке {url}: {str(e)}")
+                self._count('errors')
+
+    def revisit(self, page):
+        headers = dict(self.headers)
+        if page.etag:
+            headers['If-None-Match'] = page.etag
+        if page.last_modified:
+            headers['If-Modified-Since'] = page.last_modified
+        checks = (page.check_count or 0) + 1
+        # Страница снова отвечает: счетчик 404 подряд сбрасывается
+        found = {'missing_count': 0} if page.missing_count else {}
+
+        try:
+            self.scheduler.ensure_robots(page.url, self.headers, self.http)
+            response = self.http.get(page.url, headers=headers, timeout=self.timeout, stream=True)
+            if response.status_code == 304:
+                response.close()
+                self._count('not_modified')
+                self._reschedule(page, checks, **found)
+                return
+            if response.status_code in GONE_STATUSES:
+                response.close()
+                self._missing(page, checks, response.status_code)
+                return
+            if response.status_code != 200:
+                response.close()
+                self._count('errors')
+                self._reschedule(page, checks)
+                return
+            body = self.open_body(page.url, response)
+            if body is not None:
+                body.read()
+                if body.error is not None:
+                    raise body.error
+        except requests.exceptions.RequestException as e:
+            print(f"[recrawl] Ошибка сети при обработке {page.url}: {str(e)}")
+            self._count('errors')
+            self._reschedule(page, checks)
+            return
+
+        if body is None or body.too_large:
+            # Страница перестала быть HTML или выросла сверх лимита
+            if body is not None:
+                self.skip_content(page.url, 'too_large', body.bytes_saved())
+            self._count('skipped')
+            self._reschedule(page, checks)
+            return
+        self._count('bytes', body.size)
+
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        # Разбор нужен и для неизменившихся страниц: сравнивается извлеченный
+        # текст, иначе любая метка времени в разметке считалась бы изменением
+        title, text, links, _ = self.parse(page.url, body)
+        text_hash = content_hash(title, text)
+        if text_hash == page.content_hash:
+            self._count('unchanged')
+            self._reschedule(page, checks, **validators, **found)
+            return
+
+        self._count('changed')
+        if self.warc is not None:
+            self.warc.write_response(page.url, response, body.content)
+        interval = next_interval(page.revisit_interval, changed=True)
+        now = time.time()
+        self.writer.enqueue_update(
+            page.url,
+            title=title,
+            timestamp=now,
+            content_hash=text_hash,
+            revisit_interval=interval,
+            next_visit=now + interval,
+            check_count=checks,
+            change_count=(page.change_count or 0) + 1,
+            **validators,
+            **found,
+            **content_fields(text, CONTENT_CODEC),
+        )
+
+    def _missing(self, page, checks, status):
+        misses = (page.missing_count or 0) + 1
+        if status == 410 or misses >= GONE_AFTER:
+            self._count('removed')
+            self.writer.enqueue_delete(page.url)
+            return
+        self._count('missing')
+        interval = min(REVISIT_MAX, (page.revisit_interval or REVISIT_MIN) * MISSING_BACKOFF)
+        self.writer.enqueue_update(
+            page.url,
+            revisit_interval=interval,
+            next_visit=time.time() + interval,
+            check_count=checks,
+            missing_count=misses,
+        )
+
+    def _reschedule(self, page, checks, **fields):
+        # Для неизменившейся страницы пишутся только служебные колонки
+        interval = next_interval(page.revisit_interval, changed=False)
+        self.writer.enqueue_update(
+            page.url,
+            revisit_interval=interval,
+            next_visit=time.time() + interval,
+            check_count=checks,
+            **fields,
+        )
+
+    def print_stats(self):
+        stats = self.stats
+        print(f"Проверено: {stats['checked']}, 304: {stats['not_modified']}, без изменений: {stats['unchanged']}, "
+              f"изменилось: {stats['changed']}, ошибок: {stats['errors']}, пропущено: {stats['skipped']}, "
+              f"не найдено: {stats['missing']}, удалено: {stats['removed']}, скачано байт: {stats['bytes']}")
+
+
+if __name__ == "__main__":
+    max_pages = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    recrawler = Recrawler(
+        max_pages=max_pages,
+        concurrency=int(os.getenv('CRAWLER_CONCURRENCY', '10')),
+    )
+    try:
+        recrawler.recrawl()
+    except KeyboardInterrupt:
+        print("\nПовторный обход остановлен пользователем")
+        stop_event.set()
+    finally:
+        recrawler.writer.close()
+        if parse_pool is not None:
+            parse_pool.close()
+        if warc_writer is not None:
+            warc_writer.close()
+        recrawler.print_stats()
+        print_pool_stats()
+        print_writer_stats()
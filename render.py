@@ -0,0 +1,400 @@
+import concurrent.futures
+import fnmatch
+import itertools
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from scheduler import host_of
+
+# Qt импортируется только в процессе рендеринга (serve), краулер его не грузит.
+# PyQt5 не входит в requirements.txt: pip install -r requirements-render.txt
+QtCore = QtWebEngineCore = QtWebEngineWidgets = QtWidgets = None
+
+# Пока готовность документа и число загруженных ресурсов не меняются idle_ms,
+# сеть считается успокоившейся
+PROBE_SCRIPT = "[document.readyState, performance.getEntriesByType('resource').length]"
+PROBE_INTERVAL_MS = 100
+DELIVER_GRACE_MS = 2000
+# Раз в PROCESS_CHECK_INTERVAL секунд ждущий render() проверяет, жив ли процесс;
+# ответа нет дольше таймаута страницы на HANG_GRACE секунд - процесс завис
+PROCESS_CHECK_INTERVAL = 1.0
+HANG_GRACE = 5.0
+# Страница без окна для Chromium - фоновая вкладка: ее таймеры растягиваются
+# до секунды, и DOM снимался бы раньше, чем сработает setTimeout в скриптах
+CHROMIUM_FLAGS = '--disable-gpu --disable-background-timer-throttling --disable-renderer-backgrounding'
+
+
+class RenderError(Exception):
+    pass
+
+
+class RenderRules:
+    # Какие страницы рендерить: хосты из списка шаблонов всегда, остальные -
+    # только если статический HTML дал меньше min_text символов текста. Хост,
+    # где рендеринг несколько раз ничего не добавил, из авторежима выпадает
+    def __init__(self, hosts=(), min_text=0, give_up_after=3):
+        self.patterns = [pattern.lower() for pattern in hosts]
+        self.min_text = min_text
+        self.give_up_after = give_up_after
+        self.no_gain = Counter()
+        self.lock = threading.Lock()
+
+    def matches(self, host):
+        return any(fnmatch.fnmatchcase(host, pattern) for pattern in self.patterns)
+
+    def should_render(self, url, text):
+        host = host_of(url)
+        if self.matches(host):
+            return True
+        if not self.min_text or len(text.strip()) >= self.min_text:
+            return False
+        with self.lock:
+            return self.no_gain[host] < self.give_up_after
+
+    def learn(self, url, static_text, rendered_text):
+        host = host_of(url)
+        if self.matches(host):
+            return
+        with self.lock:
+            if len(rendered_text.strip()) <= len(static_text.strip()) + self.min_text // 2:
+                self.no_gain[host] += 1
+            else:
+                self.no_gain[host] = 0
+
+
+def robots_interceptor(slot):
+    class RobotsInterceptor(QtWebEngineCore.QWebEngineUrlRequestInterceptor):
+        # Скрипты и XHR страницы к ее же хосту проходят те же правила robots.txt,
+        # что и запросы краулера; чужие хосты (CDN) не проверяются
+        def interceptRequest(self, info):
+            host, robots, agent = slot.robots
+            url = info.requestUrl().toString()
+            if robots is not None and host_of(url) == host and not robots.can_fetch(agent, url):
+                info.block(True)
+
+    return RobotsInterceptor()
+
+
+class RenderSlot:
+    # Одна QWebEnginePage. После recycle_after страниц или после таймаута
+    # страница пересоздается, чтобы память Chromium не росла без конца
+    def __init__(self, profile, idle_ms, recycle_after, on_done):
+        self.profile = profile
+        self.idle_ms = idle_ms
+        self.recycle_after = recycle_after
+        self.on_done = on_done
+        self.page = None
+        self.renders = 0
+        self.job = None
+        self.robots = (None, None, '*')
+        self.interceptor = robots_interceptor(self)
+        self.deadline = QtCore.QTimer()
+        self.deadline.setSingleShot(True)
+        self.deadline.timeout.connect(lambda: self.finish(timed_out=True))
+        self.probe = QtCore.QTimer()
+        self.probe.setInterval(PROBE_INTERVAL_MS)
+        self.probe.timeout.connect(self.check_idle)
+        self.new_page()
+
+    def new_page(self):
+        if self.page is not None:
+            self.page.deleteLater()
+        self.page = QtWebEngineWidgets.QWebEnginePage(self.profile)
+        settings = self.page.settings()
+        settings.setAttribute(QtWebEngineWidgets.QWebEngineSettings.AutoLoadImages, False)
+        settings.setAttribute(QtWebEngineWidgets.QWebEngineSettings.PluginsEnabled, False)
+        self.page.loadFinished.connect(self.loaded)
+        # Перехватчик профиля для профиля без диска не вызывается, у страницы - работает
+        self.page.setUrlRequestInterceptor(self.interceptor)
+        self.renders = 0
+
+    def start(self, job_id, url, timeout, robots=None, agent='*'):
+        self.job = job_id
+        self.robots = (host_of(url), robots, agent)
+        self.load_ok = None
+        self.resources = -1
+        self.stable_since = time.monotonic()
+        self.finishing = False
+        self.deadline.start(int(timeout * 1000))
+        self.page.load(QtCore.QUrl(url))
+        self.probe.start()
+
+    def loaded(self, ok):
+        if self.job is None:
+            return
+        self.load_ok = ok
+        if not ok:
+            self.finish(error="Страница не загрузилась")
+
+    def check_idle(self):
+        if self.job is None or not self.load_ok or self.finishing:
+            return
+        job = self.job
+        self.page.runJavaScript(PROBE_SCRIPT, lambda value: self.probed(job, value))
+
+    def probed(self, job, value):
+        if job != self.job or self.finishing or not value:
+            return
+        state, resources = value
+        now = time.monotonic()
+        if state != 'complete' or resources != self.resources:
+            self.resources = resources
+            self.stable_since = now
+        elif (now - self.stable_since) * 1000 >= self.idle_ms:
+            self.finish()
+
+    def finish(self, timed_out=False, error=None):
+        if self.job is None or self.finishing:
+            return
+        self.finishing = True
+        self.probe.stop()
+        self.deadline.stop()
+        job = self.job
+        if error is not None:
+            self.deliver(job, None, timed_out, error)
+            return
+        # DOM после выполнения скриптов; если рендерер завис и не ответил, отдаем ошибку
+        self.page.toHtml(lambda html: self.deliver(job, html, timed_out))
+        QtCore.QTimer.singleShot(DELIVER_GRACE_MS, lambda: self.deliver(job, None, True, "Рендерер не ответил"))
+
+    def deliver(self, job, html, timed_out, error=None):
+        if job != self.job:
+            return
+        self.job = None
+        self.renders += 1
+        if timed_out or error is not None or self.renders >= self.recycle_after:
+            self.new_page()
+        self.on_done(job, html, timed_out, error)
+
+
+def serve(requests, results, pages, idle_ms, recycle_after):
+    # Точка входа процесса рендеринга: Qt живет в главном потоке этого процесса,
+    # задания и ответы идут через очереди multiprocessing
+    global QtCore, QtWebEngineCore, QtWebEngineWidgets, QtWidgets
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    os.environ.setdefault('QTWEBENGINE_CHROMIUM_FLAGS', CHROMIUM_FLAGS)
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        # Chromium не запускается от root с песочницей (обычный случай в контейнере)
+        os.environ.setdefault('QTWEBENGINE_DISABLE_SANDBOX', '1')
+    try:
+        from PyQt5 import QtCore, QtWebEngineCore, QtWebEngineWidgets, QtWidgets
+    except ImportError as e:
+        results.put((None, 'error', f"Для рендеринга нужен PyQt5 с QtWebEngine (requirements-render.txt): {e}"))
+        return
+
+    app = QtWidgets.QApplication([sys.argv[0]])
+    # Профиль без диска: кэш и cookies не переживают процесс
+    profile = QtWebEngineWidgets.QWebEngineProfile()
+    pending = deque()
+
+    def done(job, html, timed_out, error):
+        if error is not None and html is None:
+            results.put((job, 'error', error))
+        else:
+            results.put((job, 'ok', (html or '', timed_out)))
+        dispatch()
+
+    slots = [RenderSlot(profile, idle_ms, recycle_after, done) for _ in range(pages)]
+
+    def dispatch():
+        while True:
+            try:
+                item = requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                app.quit()
+                return
+            pending.append(item)
+        for slot in slots:
+            if slot.job is None and pending:
+                slot.start(*pending.popleft())
+
+    poller = QtCore.QTimer()
+    poller.timeout.connect(dispatch)
+    poller.start(20)
+    results.put((None, 'ready', None))
+    app.exec_()
+    for slot in slots:
+        slot.page.deleteLater()
+
+
+class RenderPool:
+    # Пул вкладок QtWebEngine в отдельном процессе. render() блокирует поток
+    # краулера до готового DOM; семафор ограничивает число ждущих страниц.
+    # Упавший или зависший процесс перезапускается; после max_restarts падений
+    # подряд рендеринг отключается
+    def __init__(self, pages=2, timeout=15.0, idle_ms=500, recycle_after=50, max_pending=None, max_restarts=3):
+        self.pages = pages
+        self.timeout = timeout
+        self.idle_ms = idle_ms
+        self.recycle_after = recycle_after
+        self.max_restarts = max_restarts
+        self.slots = threading.BoundedSemaphore(max_pending or pages * 4)
+        self.lock = threading.Lock()
+        self.process = None
+        self.requests = None
+        self.results = None
+        self.reader = None
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.failed = None
+        self.crashes = 0
+        self.restarts = 0
+
+    def start(self):
+        with self.lock:
+            if self.failed is not None:
+                raise RenderError(self.failed)
+            if self.process is not None:
+                return
+            context = multiprocessing.get_context('spawn')
+            self.requests = context.Queue()
+            self.results = context.Queue()
+            self.process = context.Process(
+                target=serve,
+                args=(self.requests, self.results, self.pages, self.idle_ms, self.recycle_after),
+                name='render-pool',
+                daemon=True,
+            )
+            self.process.start()
+            status, error = self._wait_ready(60)
+            if status != 'ready':
+                # Один раз: дальше render() сразу отвечает ошибкой, краулер берет статический HTML
+                self.failed = error
+                self.process.join(timeout=5)
+                print(f"Рендеринг JavaScript отключен: {error}")
+                raise RenderError(error)
+            self.reader = threading.Thread(target=self._read, args=(self.results,), name='render-results', daemon=True)
+            self.reader.start()
+
+    def _wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                _, status, error = self.results.get(timeout=1)
+                return status, error
+            except queue.Empty:
+                if not self.process.is_alive():
+                    return 'error', f"Процесс рендеринга завершился с кодом {self.process.exitcode}"
+        return 'error', f"Процесс рендеринга не запустился за {timeout} с"
+
+    def _read(self, results):
+        # Свой поток у каждого процесса; выходит, когда процесс заменен или закрыт.
+        # None в очередь не кладется: убитый процесс мог оставить занятой ее блокировку записи
+        try:
+            while True:
+                try:
+                    job, status, payload = results.get(timeout=PROCESS_CHECK_INTERVAL)
+                except queue.Empty:
+                    if self.results is not results:
+                        return
+                    continue
+                future = self.jobs.pop(job, None)
+                if future is None:
+                    continue
+                try:
+                    if status == 'ok':
+                        future.set_result(payload)
+                    else:
+                        future.set_exception(RenderError(payload))
+                except concurrent.futures.InvalidStateError:
+                    pass
+        finally:
+            results.close()
+            results.cancel_join_thread()
+
+    def _restart(self, process, reason):
+        # Задания упавшего процесса уже не выполнятся; новый процесс запустит следующий render()
+        with self.lock:
+            if self.process is not process:
+                return
+            if process.is_alive():
+                process.terminate()
+            process.join(timeout=5)
+            self._release_queues()
+            jobs, self.jobs = self.jobs, {}
+            self.process = None
+            self.restarts += 1
+            self.crashes += 1
+            if self.crashes > self.max_restarts:
+                self.failed = f"{reason} ({self.crashes} раза подряд)"
+                print(f"Рендеринг JavaScript отключен: {self.failed}")
+            else:
+                print(f"{reason}, процесс будет перезапущен")
+        for future in jobs.values():
+            try:
+                future.set_exception(RenderError(reason))
+            except concurrent.futures.InvalidStateError:
+                pass
+
+    def _release_queues(self):
+        # Очередь ответов закроет поток чтения, когда заметит замену; поток
+        # отправки заданий мертвому процессу не должен держать выход интерпретатора
+        self.requests.close()
+        self.requests.cancel_join_thread()
+        self.requests = self.results = None
+
+    def render(self, url, timeout=None, robots=None, agent='*'):
+        # (HTML после выполнения JS, истек ли таймаут). robots - правила хоста
+        # страницы для ее собственных запросов
+        self.start()
+        timeout = timeout or self.timeout
+        with self.slots:
+            with self.lock:
+                if self.process is None:
+                    raise RenderError(self.failed or "Процесс рендеринга перезапускается")
+                process = self.process
+                job = next(self.ids)
+                future = self.jobs[job] = concurrent.futures.Future()
+                self.requests.put((job, url, timeout, robots, agent))
+            deadline = time.monotonic() + timeout + DELIVER_GRACE_MS / 1000 + HANG_GRACE
+            while True:
+                try:
+                    result = future.result(PROCESS_CHECK_INTERVAL)
+                    self.crashes = 0
+                    return result
+                except concurrent.futures.TimeoutError:
+                    pass
+                if not process.is_alive():
+                    self._restart(process, f"Процесс рендеринга завершился с кодом {process.exitcode}")
+                elif time.monotonic() >= deadline:
+                    self._restart(process, f"Процесс рендеринга не ответил для {url}")
+
+    def close(self):
+        with self.lock:
+            if self.process is None:
+                return
+            self.requests.put(None)
+            self.process.join(timeout=10)
+            if self.process.is_alive():
+                self.process.terminate()
+            self._release_queues()
+            # Поток чтения должен выйти до остановки интерпретатора, иначе он падает в recv
+            self.reader.join(timeout=PROCESS_CHECK_INTERVAL * 2)
+            self.process = None
+
+
+if __name__ == '__main__':
+    # QT_QPA_PLATFORM=offscreen python render.py http://127.0.0.1:8000/app.html ...
+    from extractor import extract
+
+    pool = RenderPool(pages=int(os.getenv('CRAWLER_RENDER_PAGES', '2')))
+    try:
+        for target in sys.argv[1:]:
+            started = time.perf_counter()
+            try:
+                html, timed_out = pool.render(target)
+            except RenderError as e:
+                print(f"{target}: ошибка: {e}")
+                continue
+            title, text, links = extract(target, [html.encode('utf-8')], 'text/html; charset=utf-8')
+            print(f"{target}: {time.perf_counter() - started:.2f} с{' (таймаут)' if timed_out else ''}, "
+                  f"заголовок: {title!r}, текст: {len(text)} символов, ссылок: {len(links)}")
+    finally:
+        pool.close()
@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+
+def host_of(url):
+    return urlparse(url).netloc.lower()
+
+
+class TokenBucket:
+    def __init__(self, delay, burst=1):
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.set_delay(delay)
+
+    def set_delay(self, delay):
+        # delay <= 0 означает "без ограничений"
+        self.delay = max(0.0, delay)
+
+    def refill(self, now):
+        if self.delay > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.delay)
+        else:
+            self.tokens = float(self.burst)
+        self.updated = now
+
+    def wait_time(self, now):
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * self.delay
+
+    def take(self):
+        self.tokens -= 1
+
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class HostScheduler:
+    # Общий для всего процесса планировщик вежливости: для каждого хоста
+    # хранится ведро токенов, а воркер получает тот из своих хостов,
+    # который освободится раньше остальных
+    def __init__(self, delay=1.0, burst=1, respect_crawl_delay=True, user_agent='*', timeout=10):
+        self.delay = delay
+        self.burst = burst
+        self.respect_crawl_delay = respect_crawl_delay
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.buckets = {}
+        self.robots = {}
+        self.lock = threading.Lock()
+        self.robots_locks = {}
+
+    def _bucket(self, host):
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = TokenBucket(self.delay, self.burst)
+        return bucket
+
+    def try_acquire(self, hosts):
+        # Возвращает (хост, 0), если какой-то хост готов, иначе (None, сколько ждать)
+        with self.lock:
+            now = time.monotonic()
+            best_host = None
+            best_wait = None
+            for host in hosts:
+                wait = self._bucket(host).wait_time(now)
+                if best_wait is None or wait < best_wait:
+                    best_host, best_wait = host, wait
+                    if wait == 0:
+                        break
+            if best_host is None:
+                return None, None
+            if best_wait == 0:
+                self.buckets[best_host].take()
+                return best_host, 0.0
+            return None, best_wait
+
+    def acquire(self, hosts):
+        hosts = list(hosts)
+        while True:
+            host, wait = self.try_acquire(hosts)
+            if host is not None or wait is None:
+                return host
+            time.sleep(wait)
+
+    async def acquire_async(self, hosts):
+        hosts = list(hosts)
+        while True:
+            host, wait = self.try_acquire(hosts)
+            if host is not None or wait is None:
+                return host
+            await asyncio.sleep(wait)
+
+    def refund(self, host):
+        # Токен возвращается, если слот так и не был использован для запроса
+        with self.lock:
+            self._bucket(host).refund()
+
+    def ensure_robots(self, url, headers=None, http=None):
+        host = host_of(url)
+        if host in self.robots:
+            return self.robots[host]
+        with self.lock:
+            host_lock = self.robots_locks.setdefault(host, threading.Lock())
+        with host_lock:
+            if host not in self.robots:
+                self.robots[host] = self._load_robots(url, headers, http or requests)
+        return self.robots[host]
+
+    def _load_robots(self, url, headers, http):
+        parsed = urlparse(url)
+        parser = RobotFileParser(f"{parsed.scheme}://{parsed.netloc}/robots.txt")
+        try:
+            response = http.get(parser.url, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        parser.parse(response.text.splitlines())
+
+        crawl_delay = parser.crawl_delay(self.user_agent) if self.respect_crawl_delay else None
+        if crawl_delay:
+            with self.lock:
+                bucket = self._bucket(host_of(url))
+                if float(crawl_delay) > bucket.delay:
+                    bucket.set_delay(float(crawl_delay))
+                    bucket.burst = 1
+                    bucket.tokens = min(bucket.tokens, 1.0)
+        return parser
+
+
+class HostFrontier:
+    # Очередь краулера, разбитая по хостам, чтобы планировщик мог выбирать,
+    # к какому хосту идти следующим
+    def __init__(self):
+        self.queues = {}
+        self.size = 0
+
+    def put(self, url):
+        self.queues.setdefault(host_of(url), deque()).append(url)
+        self.size += 1
+
+    def hosts(self):
+        return list(self.queues)
+
+    def pop(self, host):
+        queue = self.queues.get(host)
+        if not queue:
+            return None
+        url = queue.popleft()
+        self.size -= 1
+        if not queue:
+            del self.queues[host]
+        return url
+
+    def touch(self, url, anchor=''):
+        # Повторная ссылка на URL в очереди; порядок FIFO от нее не меняется
+        pass
+
+    def checkpoint(self):
+        pass
+
+    def __len__(self):
+        return self.size
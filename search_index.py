@@ -0,0 +1,220 @@
+import argparse
+import re
+import sqlite3
+import time
+
+from content_store import register_functions
+
+# Полнотекстовый индекс FTS5 поверх webpages. Текст в индексе не копируется:
+# таблица external content читает заголовок и текст через представление, где
+# page_text() распаковывает сжатые страницы. Поэтому page_text должна быть
+# зарегистрирована во всех соединениях, которые пишут в webpages или ищут
+FTS_TABLE = 'pages_fts'
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+SNIPPET_CHARS = 200
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+# (тип, имя, команды): объект создается, только если его нет. Краулер вызывает
+# ensure_search_index при импорте в каждом процессе, и при готовой схеме это
+# одни чтения sqlite_master, без блокировки записи
+SCHEMA = (
+    ('view', 'pages_fts_source', (
+        """CREATE VIEW pages_fts_source AS
+           SELECT id, title, page_text(content, content_z, content_codec) AS body FROM webpages""",
+    )),
+    ('table', FTS_TABLE, (
+        f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+           title, body, content='pages_fts_source', content_rowid='id',
+           tokenize='unicode61 remove_diacritics 2')""",
+        # Заголовок весит больше текста; ORDER BY rank использует эти веса
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', 'bm25({TITLE_WEIGHT}, {CONTENT_WEIGHT})')",
+    )),
+    ('trigger', 'webpages_fts_insert', (
+        f"""CREATE TRIGGER webpages_fts_insert AFTER INSERT ON webpages BEGIN
+           INSERT INTO {FTS_TABLE}(rowid, title, body)
+           VALUES (new.id, new.title, page_text(new.content, new.content_z, new.content_codec));
+           END""",
+    )),
+    ('trigger', 'webpages_fts_delete', (
+        f"""CREATE TRIGGER webpages_fts_delete AFTER DELETE ON webpages BEGIN
+           INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body)
+           VALUES ('delete', old.id, old.title, page_text(old.content, old.content_z, old.content_codec));
+           END""",
+    )),
+    # Обновления служебных колонок (next_visit, etag...) индекс не трогают
+    ('trigger', 'webpages_fts_update', (
+        f"""CREATE TRIGGER webpages_fts_update AFTER UPDATE OF title, content, content_z ON webpages BEGIN
+           INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body)
+           VALUES ('delete', old.id, old.title, page_text(old.content, old.content_z, old.content_codec));
+           INSERT INTO {FTS_TABLE}(rowid, title, body)
+           VALUES (new.id, new.title, page_text(new.content, new.content_z, new.content_codec));
+           END""",
+    )),
+    # Поколение индекса: по нему app.py понимает, что закэшированная выдача
+    # устарела. Его увеличивает писатель, один раз на закоммиченную пачку
+    ('table', 'search_state', (
+        "CREATE TABLE search_state (id INTEGER PRIMARY KEY CHECK (id = 0), generation INTEGER NOT NULL)",
+        "INSERT INTO search_state (id, generation) VALUES (0, 0)",
+    )),
+)
+# Триггеры прежней схемы: увеличивали поколение на каждую строку
+OLD_TRIGGERS = ('webpages_generation_insert', 'webpages_generation_delete', 'webpages_generation_update')
+BUMP_GENERATION = 'UPDATE search_state SET generation = generation + 1 WHERE id = 0'
+# Колонки, изменение которых меняет выдачу (их же слушает webpages_fts_update)
+INDEXED_COLUMNS = ('title', 'content', 'content_z')
+
+
+def _exists(conn, kind, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?", (kind, name)).fetchone() is not None
+
+
+def has_search_index(conn):
+    return _exists(conn, 'table', FTS_TABLE)
+
+
+def create_search_index(conn):
+    # True, если индекс нужно заполнить заново (rebuild): его не было или
+    # webpages пересоздали вместе с триггерами, и индекс разошелся с таблицей
+    stale = not has_search_index(conn) or not _exists(conn, 'trigger', 'webpages_fts_insert')
+    for kind, name, statements in SCHEMA:
+        if not _exists(conn, kind, name):
+            for statement in statements:
+                conn.execute(statement)
+    for name in OLD_TRIGGERS:
+        if _exists(conn, 'trigger', name):
+            conn.execute(f'DROP TRIGGER {name}')
+    return stale
+
+
+def index_generation(conn):
+    # None, если индекса еще нет: тогда выдачу нельзя кэшировать
+    try:
+        row = conn.execute('SELECT generation FROM search_state WHERE id = 0').fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def bump_generation(conn):
+    # Один раз на транзакцию, которая меняла страницы; без индекса ничего не делает
+    if _exists(conn, 'table', 'search_state'):
+        conn.execute(BUMP_GENERATION)
+
+
+def rebuild(conn):
+    # Заново читает все страницы; нужен для баз, где страницы были до индекса
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    conn.execute(BUMP_GENERATION)
+
+
+def optimize(conn):
+    # Сливает сегменты индекса в один, после большого обхода поиск быстрее
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def ensure_search_index(engine):
+    # Для краулера: создать индекс и триггеры, если их нет, и один раз
+    # заполнить его уже сохраненными страницами
+    raw = engine.raw_connection()
+    try:
+        conn = raw.driver_connection
+        with conn:
+            if create_search_index(conn):
+                pages = conn.execute('SELECT count(*) FROM webpages').fetchone()[0]
+                if pages:
+                    print(f"Построение полнотекстового индекса для {pages} страниц...")
+                rebuild(conn)
+    finally:
+        raw.close()
+
+
+def match_query(text):
+    # Слова запроса в кавычках через пробел: все должны встретиться, а
+    # операторы FTS5 (NEAR, *, :, -) из пользовательского ввода не работают
+    terms = TOKEN.findall(text.lower())
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def search(conn, query, limit=50, offset=0):
+    # (url, title, summary, score) по убыванию релевантности; score = -bm25.
+    # Курсор, а не список: строки можно отдавать по мере чтения. Полный текст
+    # страниц не читается, фрагмент для выдачи строится из summary
+    match = match_query(query)
+    if not match:
+        return iter(())
+    return conn.execute(
+        f"""SELECT webpages.url, webpages.title,
+                   COALESCE(webpages.summary, substr(webpages.content, 1, 300)) AS summary,
+                   -{FTS_TABLE}.rank AS score
+            FROM {FTS_TABLE} JOIN webpages ON webpages.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH ?
+            ORDER BY {FTS_TABLE}.rank
+            LIMIT ? OFFSET ?""",
+        (match, limit, offset),
+    )
+
+
+def centred_snippet(text, query, width=SNIPPET_CHARS):
+    # Окно шириной width вокруг первого слова запроса в тексте, по границам слов
+    if not text or len(text) <= width:
+        return text or ''
+    terms = [re.escape(term) for term in TOKEN.findall(query.lower())]
+    found = re.search(r'\b(' + '|'.join(terms) + r')\b', text, re.IGNORECASE) if terms else None
+    start = 0
+    if found is not None:
+        start = max(0, min(found.start() - width // 3, len(text) - width))
+        if start:
+            space = text.find(' ', start)
+            start = space + 1 if 0 <= space < found.start() else start
+    end = start + width
+    if end < len(text):
+        space = text.rfind(' ', start, end)
+        end = space if space > start + width // 2 else end
+    return ('…' if start else '') + text[start:end] + ('…' if end < len(text) else '')
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    register_functions(conn)
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Полнотекстовый индекс FTS5 для /search")
+    parser.add_argument('--db', default='search_engine.db')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild', help="создать индекс, если его нет, и заново проиндексировать все страницы")
+    commands.add_parser('optimize', help="слить сегменты индекса")
+    command = commands.add_parser('search', help="поиск из командной строки")
+    command.add_argument('query')
+    command.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    started = time.perf_counter()
+    if args.command == 'rebuild':
+        with conn:
+            create_search_index(conn)
+            rebuild(conn)
+        pages = conn.execute('SELECT count(*) FROM webpages').fetchone()[0]
+        print(f"Проиндексировано страниц: {pages} за {time.perf_counter() - started:.1f} с")
+    elif args.command == 'optimize':
+        with conn:
+            optimize(conn)
+        print(f"Индекс оптимизирован за {time.perf_counter() - started:.1f} с")
+    elif args.command == 'search':
+        if not has_search_index(conn):
+            print("Индекса нет, сначала: python search_index.py rebuild")
+            return
+        rows = list(search(conn, args.query, args.limit))
+        elapsed = (time.perf_counter() - started) * 1000
+        for url, title, summary, score in rows:
+            print(f"{score:8.2f}  {title}  {url}\n          {centred_snippet(summary, args.query)}")
+        print(f"Найдено: {len(rows)} за {elapsed:.1f} мс")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
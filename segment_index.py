@@ -0,0 +1,824 @@
+import argparse
+import array
+import bisect
+import heapq
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import struct
+import time
+from collections import Counter
+
+from content_store import page_text, register_functions
+
+# Собственный инвертированный индекс по webpages. Сегмент - неизменяемый файл:
+# таблица документов (id страницы, длина, время), отсортированный словарь
+# терминов и списки вхождений блоками по BLOCK_SIZE (разности номеров и tf в
+# varint). Поиск читает сегменты через mmap и считает top-k BM25 с WAND:
+# документ, который даже с максимальными вкладами терминов не проходит порог
+# кучи, не разбирается. Новые страницы дописываются новыми сегментами,
+# мелкие сегменты сливаются в фоне
+MAGIC = b'PIESEG01'
+BLOCK_SIZE = 128
+TITLE_BOOST = 3
+K1 = 1.2
+B = 0.75
+TOKEN = re.compile(r'\w+', re.UNICODE)
+END = 1 << 62
+MANIFEST = 'manifest.json'
+PAGE_COLUMNS = 'id, title, content, content_z, content_codec, timestamp'
+# magic, документов, терминов, сумма длин; смещения: id, длины, время,
+# смещения терминов, строки терминов, описания терминов
+HEADER = struct.Struct('<8sIIQ6Q')
+# смещение вхождений, df, max tf, min длина, блоков, смещение каталога блоков
+TERM_INFO = struct.Struct('<QIIIIQ')
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower()) if text else []
+
+
+def document_terms(title, text):
+    # Слова заголовка считаются TITLE_BOOST раз: он весит больше текста
+    counts = Counter(tokenize(text))
+    for term in tokenize(title):
+        counts[term] += TITLE_BOOST
+    return counts
+
+
+def encode_varints(values, out):
+    if not values:
+        return
+    if max(values) < 0x80:
+        out += bytes(values)
+        return
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def decode_varints(data, count):
+    # Обычно все числа в блоке меньше 128: тогда байт и есть число
+    if len(data) == count:
+        return list(data)
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+def write_segment(path, doc_ids, doc_lens, doc_times, terms):
+    # terms: (термин в utf-8, номера документов, tf) по возрастанию термина.
+    # Файл пишется под временным именем и появляется целиком
+    tmp = path + '.tmp'
+    term_blob = bytearray()
+    term_offsets = array.array('I', [0])
+    term_infos = bytearray()
+    directory = bytearray()
+    with open(tmp, 'wb') as f:
+        f.write(bytes(HEADER.size))
+        offsets = []
+        for values in (doc_ids, doc_lens, doc_times):
+            offsets.append(f.tell())
+            f.write(values.tobytes())
+        for term, docs, tfs in terms:
+            postings_offset = f.tell()
+            last_docs = array.array('I')
+            block_offsets = array.array('I')
+            previous = -1
+            for start in range(0, len(docs), BLOCK_SIZE):
+                block = bytearray()
+                values = []
+                for doc, tf in zip(docs[start:start + BLOCK_SIZE], tfs[start:start + BLOCK_SIZE]):
+                    values.append(doc - previous)
+                    values.append(tf)
+                    previous = doc
+                encode_varints(values, block)
+                block_offsets.append(f.tell() - postings_offset)
+                last_docs.append(previous)
+                f.write(block)
+            block_offsets.append(f.tell() - postings_offset)
+            term_infos += TERM_INFO.pack(
+                postings_offset, len(docs), max(tfs), min(doc_lens[doc] for doc in docs),
+                len(last_docs), len(directory),
+            )
+            directory += last_docs.tobytes() + block_offsets.tobytes()
+            term_blob += term
+            term_offsets.append(len(term_blob))
+
+        directory_offset = f.tell()
+        f.write(directory)
+        offsets.append(f.tell())
+        f.write(term_offsets.tobytes())
+        offsets.append(f.tell())
+        f.write(term_blob)
+        # Описания терминов начинаются со смещения каталога блоков: в описаниях
+        # хранится смещение внутри него
+        offsets.append(f.tell())
+        f.write(struct.pack('<Q', directory_offset))
+        f.write(term_infos)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(doc_ids), len(term_offsets) - 1, sum(doc_lens), *offsets))
+    os.replace(tmp, path)
+
+
+class Segment:
+    def __init__(self, path, deleted=()):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.deleted = set(deleted)
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.doc_count, self.term_count, self.total_len, *offsets = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: не сегмент индекса")
+        ids_at, lens_at, times_at, term_offsets_at, blob_at, infos_at = offsets
+        self.view = memoryview(self.map)
+        n = self.doc_count
+        self.doc_ids = self.view[ids_at:ids_at + 8 * n].cast('q')
+        self.doc_lens = self.view[lens_at:lens_at + 4 * n].cast('I')
+        self.doc_times = self.view[times_at:times_at + 8 * n].cast('d')
+        self.term_offsets = self.view[term_offsets_at:term_offsets_at + 4 * (self.term_count + 1)].cast('I')
+        self.blob_at = blob_at
+        self.directory_at = struct.unpack_from('<Q', self.map, infos_at)[0]
+        self.infos_at = infos_at + 8
+
+    def live_docs(self):
+        return self.doc_count - len(self.deleted)
+
+    def term_bytes(self, index):
+        return self.map[self.blob_at + self.term_offsets[index]:self.blob_at + self.term_offsets[index + 1]]
+
+    def find(self, term):
+        # Двоичный поиск по словарю: байты utf-8 упорядочены так же, как при записи
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.term_bytes(middle) < term:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self.term_bytes(low) == term:
+            return TERM_INFO.unpack_from(self.map, self.infos_at + low * TERM_INFO.size)
+        return None
+
+    def terms(self, tag=None):
+        # (термин, tag, номер) по порядку словаря - для heapq.merge нескольких сегментов
+        for index in range(self.term_count):
+            yield self.term_bytes(index), tag, index
+
+    def info(self, index):
+        return TERM_INFO.unpack_from(self.map, self.infos_at + index * TERM_INFO.size)
+
+    def block_directory(self, info):
+        _, _, _, _, blocks, directory = info
+        start = self.directory_at + directory
+        last_docs = self.view[start:start + 4 * blocks].cast('I')
+        offsets = self.view[start + 4 * blocks:start + 8 * blocks + 4].cast('I')
+        return last_docs, offsets
+
+    def read_block(self, info, offsets, block):
+        postings_offset, df = info[0], info[1]
+        count = min(BLOCK_SIZE, df - block * BLOCK_SIZE)
+        data = self.map[postings_offset + offsets[block]:postings_offset + offsets[block + 1]]
+        return decode_varints(data, 2 * count)
+
+    def postings(self, info):
+        # Все вхождения термина целиком - для слияния сегментов
+        last_docs, offsets = self.block_directory(info)
+        docs, tfs = [], []
+        previous = -1
+        for block in range(info[4]):
+            values = self.read_block(info, offsets, block)
+            for position in range(0, len(values), 2):
+                previous += values[position]
+                docs.append(previous)
+                tfs.append(values[position + 1])
+        return docs, tfs
+
+    def find_doc(self, page_id):
+        index = bisect.bisect_left(self.doc_ids, page_id)
+        if index < self.doc_count and self.doc_ids[index] == page_id and page_id not in self.deleted:
+            return index
+        return None
+
+    def size(self):
+        return len(self.map)
+
+    def close(self):
+        for view in (self.doc_ids, self.doc_lens, self.doc_times, self.term_offsets, self.view):
+            view.release()
+        self.map.close()
+
+
+class PostingCursor:
+    # Курсор по вхождениям одного термина в сегменте: next() и advance(doc)
+    # с пропуском целых блоков по каталогу последних номеров
+    def __init__(self, segment, info, idf, avgdl):
+        self.segment = segment
+        self.info = info
+        self.idf = idf
+        self.avgdl = avgdl
+        self.last_docs, self.offsets = segment.block_directory(info)
+        self.blocks = info[4]
+        # Верхняя граница вклада: tf не больше max_tf, длина не меньше min_len
+        self.upper = idf * tf_weight(info[2], info[3], avgdl)
+        self.block = -1
+        self.load(0)
+
+    def load(self, block):
+        if block >= self.blocks:
+            self.doc = END
+            return
+        values = self.segment.read_block(self.info, self.offsets, block)
+        previous = self.last_docs[block - 1] if block else -1
+        docs = []
+        for delta in values[0::2]:
+            previous += delta
+            docs.append(previous)
+        self.block = block
+        self.docs = docs
+        self.tfs = values[1::2]
+        self.position = 0
+        self.doc = docs[0]
+
+    def next(self):
+        self.position += 1
+        if self.position < len(self.docs):
+            self.doc = self.docs[self.position]
+        else:
+            self.load(self.block + 1)
+
+    def advance(self, target):
+        if self.doc >= target:
+            return
+        if target > self.last_docs[self.block]:
+            self.load(bisect.bisect_left(self.last_docs, target, self.block + 1))
+            if self.doc >= target:
+                return
+        self.position = bisect.bisect_left(self.docs, target, self.position)
+        self.doc = self.docs[self.position]
+
+    def score(self):
+        return self.idf * tf_weight(self.tfs[self.position], self.segment.doc_lens[self.doc], self.avgdl)
+
+
+def tf_weight(tf, length, avgdl):
+    return tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avgdl))
+
+
+def idf(df, total):
+    return math.log(1 + (total - df + 0.5) / (df + 0.5))
+
+
+def wand(cursors, k, heap, deleted, doc_ids):
+    # heap - общая для всех сегментов мин-куча (score, id страницы) размера k,
+    # поэтому порог, набранный в одном сегменте, отсекает документы в следующих
+    cursors = [cursor for cursor in cursors if cursor.doc != END]
+    while cursors:
+        cursors.sort(key=lambda cursor: cursor.doc)
+        threshold = heap[0][0] if len(heap) >= k else 0.0
+        bound = 0.0
+        pivot = None
+        for index, cursor in enumerate(cursors):
+            bound += cursor.upper
+            if bound > threshold:
+                pivot = index
+                break
+        if pivot is None:
+            return
+        doc = cursors[pivot].doc
+        if cursors[0].doc == doc:
+            matched = [cursor for cursor in cursors if cursor.doc == doc]
+            page_id = doc_ids[doc]
+            if page_id not in deleted:
+                score = sum(cursor.score() for cursor in matched)
+                if len(heap) < k:
+                    heapq.heappush(heap, (score, page_id))
+                elif score > heap[0][0]:
+                    heapq.heapreplace(heap, (score, page_id))
+            for cursor in matched:
+                cursor.next()
+        else:
+            # Документы до doc не наберут порога: курсоры перед опорным прыгают к нему
+            for cursor in cursors[:pivot]:
+                cursor.advance(doc)
+        cursors = [cursor for cursor in cursors if cursor.doc != END]
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {'generation': 0, 'segments': [], 'last_id': 0, 'checked_at': 0.0, 'next_segment': 1}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(directory, manifest):
+    manifest['generation'] += 1
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+
+class SegmentIndex:
+    # Читающая сторона: набор сегментов из manifest.json. Изменение манифеста
+    # замечается по stat, новый набор подменяет старый целиком; запросы,
+    # которые уже идут, дорабатывают со старым
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = ()
+        self.generation = None
+        self.mtime = None
+
+    def refresh(self, attempts=3):
+        path = os.path.join(self.directory, MANIFEST)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return self.segments
+        if mtime == self.mtime:
+            return self.segments
+        manifest = read_manifest(self.directory)
+        loaded = {segment.name: segment for segment in self.segments}
+        segments = []
+        try:
+            for entry in manifest['segments']:
+                segment = loaded.get(entry['name'])
+                # Сегменты не меняются, у них только растет список удаленных
+                if segment is None or len(segment.deleted) != len(entry['deleted']):
+                    segment = Segment(os.path.join(self.directory, entry['name']), entry['deleted'])
+                segments.append(segment)
+        except FileNotFoundError:
+            # Слияние успело заменить манифест и удалить старые сегменты
+            if attempts > 1:
+                return self.refresh(attempts - 1)
+            raise
+        self.segments = tuple(segments)
+        self.generation = manifest['generation']
+        self.mtime = mtime
+        return self.segments
+
+    def search(self, query, k=10):
+        # [(id страницы, score)] по убыванию score; слова запроса через ИЛИ
+        segments = self.refresh()
+        terms = [term.encode('utf-8') for term in dict.fromkeys(tokenize(query))]
+        documents = sum(segment.doc_count for segment in segments)
+        if not documents or not terms:
+            return []
+        total = sum(segment.live_docs() for segment in segments) or 1
+        avgdl = sum(segment.total_len for segment in segments) / documents
+        found = [[segment.find(term) for term in terms] for segment in segments]
+        df = [sum(infos[index][1] for infos in found if infos[index]) for index in range(len(terms))]
+        heap = []
+        for segment, infos in zip(segments, found):
+            cursors = [
+                PostingCursor(segment, info, idf(df[index], total), avgdl)
+                for index, info in enumerate(infos) if info is not None
+            ]
+            wand(cursors, k, heap, segment.deleted, segment.doc_ids)
+        return [(page_id, score) for score, page_id in sorted(heap, reverse=True)]
+
+    def stats(self):
+        segments = self.refresh()
+        return {
+            'generation': self.generation,
+            'segments': len(segments),
+            'documents': sum(segment.live_docs() for segment in segments),
+            'deleted': sum(len(segment.deleted) for segment in segments),
+            'bytes': sum(segment.size() for segment in segments),
+        }
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path)
+    register_functions(conn)
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+
+class SegmentBuilder:
+    # Пишущая сторона, одна на каталог: добавляет сегменты из новых и
+    # изменившихся страниц и сливает мелкие сегменты
+    def __init__(self, directory, db_path, max_docs=20000, merge_factor=8, max_deleted=0.3, update_slack=300):
+        self.directory = directory
+        self.db_path = db_path
+        self.max_docs = max_docs
+        self.merge_factor = merge_factor
+        self.max_deleted = max_deleted
+        # Страница может закоммититься позже своего timestamp (пачки PageWriter)
+        self.update_slack = update_slack
+        os.makedirs(directory, exist_ok=True)
+
+    def open_segments(self, manifest):
+        return [Segment(os.path.join(self.directory, entry['name']), entry['deleted']) for entry in manifest['segments']]
+
+    def new_name(self, manifest):
+        name = f"seg-{manifest['next_segment']:06d}.idx"
+        manifest['next_segment'] += 1
+        return name
+
+    def build(self):
+        # Один сегмент за вызов, не больше max_docs страниц; 0 - индекс актуален
+        manifest = read_manifest(self.directory)
+        started = time.time()
+        if not manifest['last_id']:
+            # Первый проход: все страницы новые, изменения ищутся только после него
+            manifest['checked_at'] = started
+        segments = self.open_segments(manifest)
+        conn = connect(self.db_path)
+        try:
+            rows = conn.execute(
+                f'SELECT {PAGE_COLUMNS} FROM webpages WHERE id > ? ORDER BY id LIMIT ?',
+                (manifest['last_id'], self.max_docs),
+            ).fetchall()
+            # Измененные страницы находятся по индексу на timestamp; если в
+            # индексе страница с тем же timestamp, она не менялась
+            candidates = conn.execute(
+                'SELECT id, timestamp FROM webpages WHERE timestamp > ? AND id <= ?',
+                (manifest['checked_at'] - self.update_slack, manifest['last_id']),
+            ).fetchall()
+            changed = [page_id for page_id, timestamp in candidates if self.is_stale(segments, page_id, timestamp)]
+            room = self.max_docs - len(rows)
+            complete = len(changed) <= room
+            updated = []
+            for start in range(0, min(room, len(changed)), 500):
+                chunk = changed[start:min(room, start + 500)]
+                updated += conn.execute(
+                    f'SELECT {PAGE_COLUMNS} FROM webpages WHERE id IN ({",".join("?" * len(chunk))})', chunk,
+                ).fetchall()
+            # Удаленные страницы (recrawl, 410/404): живых документов в сегментах
+            # больше, чем страниц в уже проиндексированном диапазоне id
+            indexed = conn.execute('SELECT count(*) FROM webpages WHERE id <= ?', (manifest['last_id'],)).fetchone()[0]
+            gone = []
+            if sum(segment.live_docs() for segment in segments) > indexed:
+                gone = self.find_gone(conn, segments)
+        finally:
+            conn.close()
+
+        try:
+            for page_id in [row[0] for row in updated] + gone:
+                for segment in segments:
+                    if segment.find_doc(page_id) is not None:
+                        segment.deleted.add(page_id)
+            docs = sorted(rows + updated)
+            if not docs:
+                if gone:
+                    for entry, segment in zip(manifest['segments'], segments):
+                        entry['deleted'] = sorted(segment.deleted)
+                    write_manifest(self.directory, manifest)
+                return 0
+            if complete:
+                manifest['checked_at'] = started
+
+            postings = {}
+            doc_ids = array.array('q')
+            doc_lens = array.array('I')
+            doc_times = array.array('d')
+            for number, (page_id, title, content, content_z, codec, timestamp) in enumerate(docs):
+                counts = document_terms(title, page_text(content, content_z, codec))
+                doc_ids.append(page_id)
+                doc_lens.append(sum(counts.values()) or 1)
+                doc_times.append(timestamp or 0.0)
+                for term, tf in counts.items():
+                    entry = postings.get(term)
+                    if entry is None:
+                        entry = postings[term] = (array.array('I'), array.array('I'))
+                    entry[0].append(number)
+                    entry[1].append(tf)
+            terms = sorted((term.encode('utf-8'), docs, tfs) for term, (docs, tfs) in postings.items())
+            name = self.new_name(manifest)
+            write_segment(os.path.join(self.directory, name), doc_ids, doc_lens, doc_times, terms)
+
+            for entry, segment in zip(manifest['segments'], segments):
+                entry['deleted'] = sorted(segment.deleted)
+            manifest['segments'].append({'name': name, 'docs': len(docs), 'deleted': []})
+            if rows:
+                manifest['last_id'] = rows[-1][0]
+            write_manifest(self.directory, manifest)
+            return len(docs)
+        finally:
+            for segment in segments:
+                segment.close()
+
+    def find_gone(self, conn, segments):
+        # Живые документы сегментов, которых больше нет в webpages
+        gone = []
+        for segment in segments:
+            live = [page_id for page_id in segment.doc_ids if page_id not in segment.deleted]
+            for start in range(0, len(live), 500):
+                chunk = live[start:start + 500]
+                found = {row[0] for row in conn.execute(
+                    f'SELECT id FROM webpages WHERE id IN ({",".join("?" * len(chunk))})', chunk,
+                )}
+                gone += [page_id for page_id in chunk if page_id not in found]
+        return gone
+
+    def reset(self):
+        # Таблицу webpages очистили целиком (warc --rebuild): id страниц
+        # начнутся заново и совпадут со старыми, поэтому индекс строится с нуля
+        manifest = read_manifest(self.directory)
+        manifest.update(segments=[], last_id=0, checked_at=0.0)
+        write_manifest(self.directory, manifest)
+        self.remove_unused(manifest)
+
+    def is_stale(self, segments, page_id, timestamp):
+        holders = [(segment, segment.find_doc(page_id)) for segment in segments]
+        times = [segment.doc_times[index] for segment, index in holders if index is not None]
+        return not times or max(times) < (timestamp or 0)
+
+    def pick_merge(self, manifest):
+        entries = manifest['segments']
+        for entry in entries:
+            if entry['deleted'] and len(entry['deleted']) > self.max_deleted * entry['docs']:
+                return [entry]
+        if len(entries) <= self.merge_factor:
+            return []
+        return sorted(entries, key=lambda entry: entry['docs'] - len(entry['deleted']))[:self.merge_factor]
+
+    def merge(self):
+        # Слияние без обращения к базе: вхождения переписываются с новыми
+        # номерами документов, удаленные документы выпадают
+        manifest = read_manifest(self.directory)
+        chosen = self.pick_merge(manifest)
+        if not chosen:
+            return 0
+        segments = [Segment(os.path.join(self.directory, entry['name']), entry['deleted']) for entry in chosen]
+        try:
+            live = sorted(
+                (segment.doc_ids[index], number, index)
+                for number, segment in enumerate(segments)
+                for index in range(segment.doc_count)
+                if segment.doc_ids[index] not in segment.deleted
+            )
+            if not live:
+                name = None
+            remap = [array.array('i', [-1]) * segment.doc_count for segment in segments]
+            doc_ids = array.array('q')
+            doc_lens = array.array('I')
+            doc_times = array.array('d')
+            for new, (page_id, number, index) in enumerate(live):
+                remap[number][index] = new
+                doc_ids.append(page_id)
+                doc_lens.append(segments[number].doc_lens[index])
+                doc_times.append(segments[number].doc_times[index])
+
+            def merged_terms():
+                streams = [segment.terms(number) for number, segment in enumerate(segments)]
+                current, parts = None, []
+                for term, number, index in heapq.merge(*streams):
+                    if term != current and parts:
+                        result = combine(parts)
+                        if result:
+                            yield (current,) + result
+                        parts = []
+                    current = term
+                    parts.append((number, index))
+                if parts:
+                    result = combine(parts)
+                    if result:
+                        yield (current,) + result
+
+            def combine(parts):
+                lists = []
+                for number, index in parts:
+                    docs, tfs = segments[number].postings(segments[number].info(index))
+                    mapping = remap[number]
+                    lists.append([(mapping[doc], tf) for doc, tf in zip(docs, tfs) if mapping[doc] >= 0])
+                pairs = list(heapq.merge(*lists))
+                if not pairs:
+                    return None
+                return [doc for doc, _ in pairs], [tf for _, tf in pairs]
+
+            if live:
+                name = self.new_name(manifest)
+                write_segment(os.path.join(self.directory, name), doc_ids, doc_lens, doc_times, merged_terms())
+        finally:
+            for segment in segments:
+                segment.close()
+
+        merged = {entry['name'] for entry in chosen}
+        position = min(index for index, entry in enumerate(manifest['segments']) if entry['name'] in merged)
+        kept = [entry for entry in manifest['segments'] if entry['name'] not in merged]
+        if name is not None:
+            kept.insert(position, {'name': name, 'docs': len(doc_ids), 'deleted': []})
+        manifest['segments'] = kept
+        write_manifest(self.directory, manifest)
+        self.remove_unused(manifest)
+        return len(chosen)
+
+    def remove_unused(self, manifest):
+        # На Windows файл, открытый через mmap в app.py, удалить нельзя: он
+        # останется до следующей уборки
+        used = {entry['name'] for entry in manifest['segments']}
+        for name in os.listdir(self.directory):
+            if name.startswith('seg-') and name.endswith('.idx') and name not in used:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def run(self, stop_event=None, interval=30.0):
+        # Дописать все новые страницы, слить что нужно и ждать следующего прохода.
+        # После остановки делается еще один проход по тому, что успели записать
+        while True:
+            final = stop_event is None or stop_event.is_set()
+            while self.build():
+                pass
+            while self.merge():
+                pass
+            if final:
+                return
+            stop_event.wait(interval)
+
+
+def serve(directory, db_path, interval, stop_event, options):
+    SegmentBuilder(directory, db_path, **options).run(stop_event, interval)
+
+
+class SegmentIndexer:
+    # Фоновый процесс построения сегментов для краулера: разбор текста не
+    # делит GIL с потоками загрузки. При закрытии индексирует остаток
+    def __init__(self, directory, db_path, interval=30.0, **options):
+        self.directory = directory
+        self.db_path = db_path
+        self.interval = interval
+        self.options = options
+        self.process = None
+        self.stop_event = None
+
+    def start(self):
+        if self.process is not None:
+            return
+        context = multiprocessing.get_context('spawn')
+        self.stop_event = context.Event()
+        self.process = context.Process(
+            target=serve,
+            args=(self.directory, self.db_path, self.interval, self.stop_event, self.options),
+            name='segment-indexer',
+            daemon=True,
+        )
+        self.process.start()
+
+    def close(self):
+        if self.process is None:
+            return
+        self.stop_event.set()
+        self.process.join()
+        self.process = None
+
+
+def index_size(db_path, directory):
+    sizes = {'segments': sum(
+        os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory) if name.endswith('.idx')
+    )}
+    conn = connect(db_path)
+    try:
+        # Блоки FTS5 лежат в pages_fts_data, плюс длины документов
+        sizes['fts'] = conn.execute(
+            'SELECT (SELECT coalesce(sum(length(block)), 0) FROM pages_fts_data) + '
+            '(SELECT coalesce(sum(length(sz)), 0) FROM pages_fts_docsize)'
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        sizes['fts'] = None
+    finally:
+        conn.close()
+    return sizes
+
+
+def sample_queries(index, count, seed=1):
+    # Термины из словаря сегментов: и частые, и редкие, одно- и двухсловные
+    rng = random.Random(seed)
+    segments = index.refresh()
+    vocabulary = []
+    for segment in segments:
+        for _ in range(max(1, count // len(segments))):
+            term = segment.term_bytes(rng.randrange(segment.term_count)).decode('utf-8')
+            vocabulary.append(term)
+    common = []
+    for segment in segments[:1]:
+        infos = ((segment.info(index)[1], term) for term, _, index in segment.terms())
+        common = [term.decode('utf-8') for _, term in heapq.nlargest(20, infos)]
+    queries = []
+    for number in range(count):
+        pool = common if number % 4 == 0 and common else vocabulary
+        words = rng.sample(pool, min(len(pool), 1 + number % 2))
+        queries.append(' '.join(words))
+    return queries
+
+
+def timings(run, queries):
+    elapsed = []
+    for query in queries:
+        started = time.perf_counter()
+        run(query)
+        elapsed.append((time.perf_counter() - started) * 1000)
+    elapsed.sort()
+    return {
+        'queries': len(elapsed),
+        'p50_ms': elapsed[len(elapsed) // 2],
+        'p99_ms': elapsed[min(len(elapsed) - 1, int(0.99 * len(elapsed)))],
+    }
+
+
+def benchmark(db_path, directory, count=200, like_count=5, k=10):
+    # Сегменты против FTS5 и LIKE-скана на одних и тех же запросах
+    from search_index import has_search_index, search as fts_search
+
+    index = SegmentIndex(directory)
+    queries = sample_queries(index, count)
+    conn = connect(db_path)
+    report = {'documents': index.stats()['documents'], 'index_bytes': index_size(db_path, directory)}
+    report['segments'] = timings(lambda query: index.search(query, k), queries)
+    if has_search_index(conn):
+        report['fts'] = timings(lambda query: list(fts_search(conn, query, k)), queries)
+
+    def like(query):
+        pattern = f'%{query}%'
+        conn.execute(
+            'SELECT url FROM webpages WHERE title LIKE ? OR page_text(content, content_z, content_codec) LIKE ?',
+            (pattern, pattern),
+        ).fetchall()
+
+    report['like'] = timings(like, queries[:like_count])
+    conn.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Индекс из сегментов с BM25 для /search")
+    parser.add_argument('--db', default='search_engine.db')
+    parser.add_argument('--dir', default=os.getenv('SEARCH_SEGMENT_DIR', 'segments'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('build', help="проиндексировать новые и изменившиеся страницы и слить сегменты")
+    command.add_argument('--max-docs', type=int, default=20000, help="страниц в одном новом сегменте")
+    command = commands.add_parser('watch', help="то же в цикле, пока краулер добавляет страницы")
+    command.add_argument('--interval', type=float, default=30.0)
+    command = commands.add_parser('search', help="поиск из командной строки")
+    command.add_argument('query')
+    command.add_argument('--limit', type=int, default=10)
+    commands.add_parser('stats', help="сегменты, документы и размер индекса")
+    command = commands.add_parser('bench', help="размер индекса и p50/p99 запросов против FTS5 и LIKE")
+    command.add_argument('--queries', type=int, default=200)
+    command.add_argument('--like-queries', type=int, default=5, help="LIKE сканирует всю таблицу, хватит нескольких")
+    command.add_argument('--output', help="записать отчет в JSON")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        builder = SegmentBuilder(args.dir, args.db, max_docs=args.max_docs)
+        started = time.perf_counter()
+        indexed = 0
+        while True:
+            count = builder.build()
+            if not count:
+                break
+            indexed += count
+            print(f"Проиндексировано страниц: {indexed}")
+        merges = 0
+        while builder.merge():
+            merges += 1
+        print(f"Готово за {time.perf_counter() - started:.1f} с, слияний: {merges}")
+        print(json.dumps(SegmentIndex(args.dir).stats(), ensure_ascii=False))
+    elif args.command == 'watch':
+        try:
+            SegmentBuilder(args.dir, args.db).run(multiprocessing.Event(), args.interval)
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'search':
+        index = SegmentIndex(args.dir)
+        started = time.perf_counter()
+        hits = index.search(args.query, args.limit)
+        elapsed = (time.perf_counter() - started) * 1000
+        conn = connect(args.db)
+        for page_id, score in hits:
+            row = conn.execute('SELECT url, title FROM webpages WHERE id = ?', (page_id,)).fetchone()
+            if row is not None:
+                print(f"{score:8.2f}  {row[1]}  {row[0]}")
+        conn.close()
+        print(f"Найдено: {len(hits)} за {elapsed:.1f} мс")
+    elif args.command == 'stats':
+        print(json.dumps(SegmentIndex(args.dir).stats(), ensure_ascii=False))
+    elif args.command == 'bench':
+        report = benchmark(args.db, args.dir, args.queries, args.like_queries)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import hashlib
+import re
+import threading
+from collections import Counter
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+BITS = 64
+# Счетчики всех 64 бит в одном большом целом, по FIELD бит на счетчик:
+# SPREAD[i][b] раскладывает байт b хеша (i-й по счету) в его 8 полей. Вместо
+# цикла по битам на каждый признак - 8 обращений к таблице и одно сложение
+FIELD = 32
+FIELD_MASK = (1 << FIELD) - 1
+SPREAD = [
+    [sum(((byte >> bit) & 1) << ((8 * i + bit) * FIELD) for bit in range(8)) for byte in range(256)]
+    for i in range(BITS // 8)
+]
+
+
+def features(text, shingle=3):
+    tokens = TOKEN.findall(text.lower())
+    if len(tokens) < shingle:
+        return Counter(tokens)
+    return Counter(' '.join(tokens[i:i + shingle]) for i in range(len(tokens) - shingle + 1))
+
+
+def simhash(text, shingle=3):
+    # Бит b установлен, если вес признаков с единицей в бите b больше половины
+    # общего веса - то же, что сумма +weight/-weight по биту больше нуля
+    t0, t1, t2, t3, t4, t5, t6, t7 = SPREAD
+    counters = 0
+    total = 0
+    for feature, weight in features(text, shingle).items():
+        d = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        spread = t0[d[0]] + t1[d[1]] + t2[d[2]] + t3[d[3]] + t4[d[4]] + t5[d[5]] + t6[d[6]] + t7[d[7]]
+        counters += spread if weight == 1 else spread * weight
+        total += weight
+    fingerprint = 0
+    for bit in range(BITS):
+        if 2 * ((counters >> (bit * FIELD)) & FIELD_MASK) > total:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def to_signed(fingerprint):
+    # SQLite хранит INTEGER как знаковое 64-битное число
+    return fingerprint - (1 << BITS) if fingerprint >= 1 << (BITS - 1) else fingerprint
+
+
+def from_signed(value):
+    return value + (1 << BITS) if value < 0 else value
+
+
+class SimHashIndex:
+    # Отпечатки на расстоянии Хэмминга <= max_distance совпадают хотя бы в одной
+    # из max_distance + 1 полос, поэтому искать кандидатов достаточно по полосам
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = BITS // self.bands
+        self.tables = [{} for _ in range(self.bands)]
+        self.lock = threading.Lock()
+        self.count = 0
+        self.warmed = False
+
+    def _keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(fingerprint >> (i * self.band_bits)) & mask for i in range(self.bands)]
+
+    def _find(self, fingerprint, keys):
+        for table, key in zip(self.tables, keys):
+            for other, url in table.get(key, ()):
+                if distance(fingerprint, other) <= self.max_distance:
+                    return url
+        return None
+
+    def _add(self, fingerprint, url, keys):
+        for table, key in zip(self.tables, keys):
+            table.setdefault(key, []).append((fingerprint, url))
+        self.count += 1
+
+    def find(self, fingerprint):
+        with self.lock:
+            return self._find(fingerprint, self._keys(fingerprint))
+
+    def add(self, fingerprint, url):
+        with self.lock:
+            self._add(fingerprint, url, self._keys(fingerprint))
+
+    def check_and_add(self, fingerprint, url):
+        # URL уже сохраненной почти такой же страницы или None, если страница новая
+        keys = self._keys(fingerprint)
+        with self.lock:
+            original = self._find(fingerprint, keys)
+            if original is None:
+                self._add(fingerprint, url, keys)
+            return original
+
+    def warm_start(self, rows):
+        with self.lock:
+            if self.warmed:
+                return
+            self.warmed = True
+            for fingerprint, url in rows:
+                self._add(fingerprint, url, self._keys(fingerprint))
+
+    def __len__(self):
+        return self.count
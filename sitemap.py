@@ -0,0 +1,136 @@
+import io
+import zlib
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+from xml.etree.ElementTree import ParseError, iterparse
+
+import requests
+
+from download import BodyReader
+from scheduler import host_of
+
+# Лимиты протокола sitemaps.org: 50 000 URL и 50 МБ без сжатия на файл
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def parse_lastmod(value):
+    # W3C Datetime: 2024-05-17, 2024-05-17T10:00:00Z, 2024-05-17T10:00:00+03:00
+    if not value:
+        return None
+    value = value.strip()
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def gunzip(data, limit=MAX_SITEMAP_BYTES):
+    # Размер распакованного ограничен, чтобы gzip-бомба не съела память
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    result = decompressor.decompress(data, limit)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Распакованная карта сайта больше лимита")
+    return result
+
+
+def parse_sitemap(data):
+    # (вложенные карты, [(url, lastmod)]). Текстовые карты - один URL на строку
+    if data.lstrip(b'\xef\xbb\xbf \t\r\n')[:1] != b'<':
+        lines = data.decode('utf-8', errors='replace').splitlines()
+        return [], [(line.strip(), None) for line in lines if line.strip().startswith(('http://', 'https://'))]
+
+    sitemaps, urls = [], []
+    loc = lastmod = None
+    for event, element in iterparse(io.BytesIO(data), events=('end',)):
+        tag = _local(element.tag)
+        if tag == 'loc':
+            loc = (element.text or '').strip()
+        elif tag == 'lastmod':
+            lastmod = parse_lastmod(element.text)
+        elif tag in ('url', 'sitemap'):
+            if loc:
+                (urls if tag == 'url' else sitemaps).append((loc, lastmod))
+            loc = lastmod = None
+            element.clear()
+    return [url for url, _ in sitemaps], urls
+
+
+class SitemapReader:
+    # Обходит карты сайта из robots.txt, включая индексы карт и .gz. Запросы идут
+    # через тот же пул соединений и планировщик хостов, что и обычные страницы
+    def __init__(self, http, scheduler=None, headers=None, timeout=10, max_urls=100000, max_sitemaps=1000):
+        self.http = http
+        self.scheduler = scheduler
+        self.headers = headers
+        self.timeout = timeout
+        self.max_urls = max_urls
+        self.max_sitemaps = max_sitemaps
+        self.fetched = 0
+        self.errors = 0
+
+    def fetch(self, url):
+        if self.scheduler is not None:
+            self.scheduler.acquire([host_of(url)])
+        response = self.http.get(url, headers=self.headers, timeout=self.timeout, stream=True)
+        if response.status_code != 200:
+            response.close()
+            return None
+        body = BodyReader(response, MAX_SITEMAP_BYTES)
+        data = body.read()
+        if body.error is not None:
+            raise body.error
+        if body.too_large:
+            raise ValueError("Карта сайта больше лимита")
+        self.fetched += 1
+        if data[:2] == GZIP_MAGIC:
+            data = gunzip(data)
+        return data
+
+    def read(self, sitemap_urls):
+        # [(url, lastmod)] со всех карт. URL с чужих хостов отбрасываются:
+        # по протоколу карта описывает только свой хост
+        pending = list(sitemap_urls)
+        visited = set()
+        entries = {}
+        while pending and len(visited) < self.max_sitemaps and len(entries) < self.max_urls:
+            sitemap_url = pending.pop(0)
+            if sitemap_url in visited:
+                continue
+            visited.add(sitemap_url)
+            try:
+                data = self.fetch(sitemap_url)
+                if data is None:
+                    continue
+                children, urls = parse_sitemap(data)
+            except (requests.exceptions.RequestException, ParseError, ValueError, zlib.error) as e:
+                self.errors += 1
+                print(f"Не удалось прочитать карту сайта {sitemap_url}: {e}")
+                continue
+            host = urlsplit(sitemap_url).netloc
+            pending.extend(child for child in children if urlsplit(child).netloc == host)
+            for url, lastmod in urls:
+                if urlsplit(url).netloc != host:
+                    continue
+                if url not in entries or (lastmod or 0) > (entries[url] or 0):
+                    entries[url] = lastmod
+                if len(entries) >= self.max_urls:
+                    break
+        return list(entries.items())
+
+    def sitemaps_for(self, robots, start_url):
+        # Карты из строк Sitemap: в robots.txt, иначе /sitemap.xml по соглашению
+        site_maps = robots.site_maps() if robots is not None else None
+        if site_maps:
+            return site_maps
+        parts = urlsplit(start_url)
+        return [f'{parts.scheme}://{parts.netloc}/sitemap.xml']
@@ -0,0 +1,295 @@
+import argparse
+import bisect
+import heapq
+import json
+import random
+import sqlite3
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from search_index import TOKEN
+
+# Верхняя граница для bisect: строка с префиксом p лежит в [p, p + MAX_CHAR)
+MAX_CHAR = '\U0010ffff'
+# Один поиск с результатами весит как столько заголовков с тем же словом
+QUERY_WEIGHT = 5
+MAX_KEY_WORDS = 8
+MIN_WORD = 2
+
+QUERIES_SCHEMA = 'CREATE TABLE IF NOT EXISTS search_queries (query TEXT PRIMARY KEY, count INTEGER NOT NULL)'
+
+
+def normalize(text):
+    return ' '.join(TOKEN.findall(text.lower()))
+
+
+def title_keys(title):
+    # Слова заголовка и сам заголовок (первые MAX_KEY_WORDS слов) как фраза
+    words = TOKEN.findall((title or '').lower())
+    keys = {word for word in words if len(word) >= MIN_WORD and not word.isdigit()}
+    if len(words) > 1:
+        keys.add(' '.join(words[:MAX_KEY_WORDS]))
+    return keys
+
+
+class PrefixArray:
+    # Неизменяемый снимок: ключи по алфавиту и их ранги (вес со знаком минус).
+    # Для каждого префикса, под который попадает больше threshold ключей,
+    # лучшие k посчитаны заранее, поэтому короткий префикс стоит одного
+    # обращения к словарю, а длинный - двоичного поиска и просмотра не больше
+    # threshold соседних ключей
+    def __init__(self, weights, k=10, threshold=64):
+        self.k = k
+        self.threshold = threshold
+        self.keys = sorted(weights)
+        self.ranks = [-weights[key] for key in self.keys]
+        self.top = {}
+        if self.keys:
+            self._build('', 0, len(self.keys))
+
+    def _build(self, prefix, lo, hi):
+        best = []
+        i = lo
+        if self.keys[i] == prefix:
+            best.append((self.ranks[i], prefix))
+            i += 1
+        depth = len(prefix) + 1
+        while i < hi:
+            child = self.keys[i][:depth]
+            j = bisect.bisect_left(self.keys, child + MAX_CHAR, i, hi)
+            if j - i > self.threshold:
+                best.extend(self._build(child, i, j))
+            else:
+                best.extend(zip(self.ranks[i:j], self.keys[i:j]))
+            i = j
+        best = heapq.nsmallest(self.k, best)
+        self.top[prefix] = best
+        return best
+
+    def lookup(self, prefix):
+        # [(ранг, ключ)] по убыванию веса, при равном весе - по алфавиту
+        best = self.top.get(prefix)
+        if best is not None:
+            return best
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + MAX_CHAR, lo)
+        return heapq.nsmallest(self.k, zip(self.ranks[lo:hi], self.keys[lo:hi]))
+
+    def rank(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        return self.ranks[i] if i < len(self.keys) and self.keys[i] == key else 0
+
+    def weights(self):
+        return {key: -rank for key, rank in zip(self.keys, self.ranks)}
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+
+class Suggester:
+    # Подсказки для /suggest. Основной снимок строится целиком по всем
+    # заголовкам и сохраненным запросам, новые страницы и запросы между
+    # пересборками копятся в маленьком втором снимке и сливаются с основным,
+    # когда в нем становится больше merge_after ключей. Обновляет снимки
+    # фоновый поток, запрос только читает пару текущих снимков без блокировок.
+    # Память ограничена: в основном снимке не больше max_keys самых частых ключей
+    def __init__(self, db_path, max_keys=200000, k=10, interval=5.0, merge_after=5000, rebuild_every=3600.0):
+        self.db_path = db_path
+        self.max_keys = max_keys
+        self.k = k
+        self.interval = interval
+        self.merge_after = merge_after
+        self.rebuild_every = rebuild_every
+        self.snapshot = (PrefixArray({}, k), PrefixArray({}, k))
+        self.delta = Counter()
+        self.last_id = 0
+        self.built_at = None
+        self.pending = Counter()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def record_query(self, query):
+        # Запросы, по которым что-то нашлось; в базу уходят при обновлении
+        key = normalize(query)
+        if not key or key.count(' ') >= MAX_KEY_WORDS:
+            return
+        with self.lock:
+            # Пока фоновый поток не запущен, копится не больше merge_after разных запросов
+            if key in self.pending or len(self.pending) < self.merge_after:
+                self.pending[key] += 1
+
+    def _drain(self):
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+        return pending
+
+    def _cap(self, weights):
+        if len(weights) <= self.max_keys:
+            return weights
+        return dict(heapq.nlargest(self.max_keys, weights.items(), key=lambda item: item[1]))
+
+    def rebuild(self, conn):
+        weights = Counter()
+        last_id = 0
+        for page_id, title in conn.execute('SELECT id, title FROM webpages ORDER BY id'):
+            weights.update(title_keys(title))
+            last_id = page_id
+        for query, count in conn.execute('SELECT query, count FROM search_queries'):
+            weights[query] += QUERY_WEIGHT * count
+        self.delta = Counter()
+        self.last_id = last_id
+        self.built_at = time.monotonic()
+        self.snapshot = (PrefixArray(self._cap(weights), self.k), PrefixArray({}, self.k))
+
+    def update(self, conn):
+        # Только страницы с id больше последнего учтенного: сканирование по
+        # первичному ключу, сколько бы страниц ни было в базе
+        rows = conn.execute('SELECT id, title FROM webpages WHERE id > ? ORDER BY id', (self.last_id,)).fetchall()
+        for page_id, title in rows:
+            self.delta.update(title_keys(title))
+            self.last_id = page_id
+        return bool(rows)
+
+    def refresh(self):
+        conn = connect(self.db_path)
+        try:
+            queries = self._drain()
+            with conn:
+                conn.execute(QUERIES_SCHEMA)
+                conn.executemany(
+                    'INSERT INTO search_queries (query, count) VALUES (?, ?) '
+                    'ON CONFLICT(query) DO UPDATE SET count = count + excluded.count',
+                    queries.items(),
+                )
+            if self.built_at is None or time.monotonic() - self.built_at >= self.rebuild_every:
+                # Полная пересборка заодно учитывает измененные и удаленные страницы
+                self.rebuild(conn)
+                return
+            changed = self.update(conn)
+            for query, count in queries.items():
+                self.delta[query] += QUERY_WEIGHT * count
+            if not changed and not queries:
+                return
+            main = self.snapshot[0]
+            if len(self.delta) > self.merge_after:
+                weights = Counter(main.weights())
+                weights.update(self.delta)
+                self.delta = Counter()
+                self.snapshot = (PrefixArray(self._cap(weights), self.k), PrefixArray({}, self.k))
+            else:
+                self.snapshot = (main, PrefixArray(self.delta, self.k))
+        finally:
+            conn.close()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.refresh()
+            except sqlite3.Error as e:
+                print(f"Ошибка обновления подсказок: {e}")
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name='suggest-refresh', daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _complete(self, main, delta, prefix):
+        found = dict((key, rank) for rank, key in main.lookup(prefix))
+        for rank, key in delta.lookup(prefix):
+            found[key] = found.get(key, main.rank(key)) + rank
+        return heapq.nsmallest(self.k, ((rank, key) for key, rank in found.items()))
+
+    def suggest(self, text, limit=None):
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        if text[-1:].isspace():
+            prefix += ' '
+        main, delta = self.snapshot
+        found = self._complete(main, delta, prefix)
+        head, _, last = prefix.rpartition(' ')
+        if not found and head and last:
+            # Фразы целиком нет - дополняется последнее слово
+            found = [(rank, f'{head} {key}') for rank, key in self._complete(main, delta, last) if ' ' not in key]
+        return [key for _, key in found[:limit or self.k]]
+
+    def stats(self):
+        main, delta = self.snapshot
+        return {
+            'keys': len(main),
+            'delta_keys': len(delta),
+            'prefixes': len(main.top) + len(delta.top),
+            'last_id': self.last_id,
+            'max_keys': self.max_keys,
+        }
+
+
+def benchmark(db_path, count=2000, seed=1, max_keys=200000):
+    # Время и память полной сборки, p50/p99 подсказок для префиксов из 1-6 символов
+    from segment_index import timings
+
+    suggester = Suggester(db_path, max_keys=max_keys)
+    tracemalloc.start()
+    started = time.perf_counter()
+    suggester.refresh()
+    build_s = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    keys = suggester.snapshot[0].keys
+    rng = random.Random(seed)
+    prefixes = [rng.choice(keys)[:rng.randint(1, 6)] for _ in range(count)] if keys else []
+    for prefix in prefixes[:100]:
+        suggester.suggest(prefix)
+    report = {**suggester.stats(), 'build_s': build_s, 'memory_bytes': memory}
+    report['suggest'] = timings(suggester.suggest, prefixes)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Подсказки по префиксу из заголовков страниц и частых запросов")
+    parser.add_argument('--db', default='search_engine.db')
+    parser.add_argument('--max-keys', type=int, default=200000)
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('suggest', help="подсказки из командной строки")
+    command.add_argument('prefix')
+    command = commands.add_parser('bench', help="время сборки, память и p50/p99 подсказок")
+    command.add_argument('--queries', type=int, default=2000)
+    command.add_argument('--output', help="записать отчет в JSON")
+    args = parser.parse_args()
+
+    if args.command == 'suggest':
+        suggester = Suggester(args.db, max_keys=args.max_keys)
+        suggester.refresh()
+        started = time.perf_counter()
+        found = suggester.suggest(args.prefix)
+        elapsed = (time.perf_counter() - started) * 1000
+        for key in found:
+            print(key)
+        print(f"Подсказок: {len(found)} за {elapsed:.3f} мс")
+    elif args.command == 'bench':
+        report = benchmark(args.db, args.queries, max_keys=args.max_keys)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
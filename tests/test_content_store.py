@@ -0,0 +1,26 @@
+import sqlite3
+
+from content_store import compress, content_fields, content_hash, decompress, ensure_columns, page_text
+
+
+def test_content_hash_ignores_layout_whitespace():
+    assert content_hash('Title', 'one  two\nthree') == content_hash(' Title ', 'one two three')
+    assert content_hash('Title', 'one two three') != content_hash('Title', 'one two four')
+    assert content_hash('Title', 'text') != content_hash('Other', 'text')
+
+
+def test_compressed_fields_round_trip():
+    fields = content_fields('текст страницы ' * 50, 'zlib')
+    assert fields['content'] is None
+    assert page_text(fields['content'], fields['content_z'], fields['content_codec']) == 'текст страницы ' * 50
+    assert decompress(compress('abc'), 'zlib') == 'abc'
+
+
+def test_ensure_columns_upgrades_baseline_schema():
+    conn = sqlite3.connect(':memory:')
+    ensure_columns(conn)
+    conn.execute('CREATE TABLE webpages (id INTEGER PRIMARY KEY, url TEXT, title TEXT, content TEXT, timestamp FLOAT)')
+    ensure_columns(conn)
+    ensure_columns(conn)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(webpages)')}
+    assert {'summary', 'content_z', 'content_codec'} <= columns
@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, select
+
+from page_writer import PageWriter, enable_wal
+
+
+def make_writer(tmp_path, **options):
+    engine = create_engine(f'sqlite:///{tmp_path / "pages.db"}')
+    enable_wal(engine, busy_timeout_ms=50)
+    metadata = MetaData()
+    table = Table(
+        'webpages', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('url', String, unique=True),
+        Column('title', String, nullable=False),
+        Column('content', String),
+        Column('timestamp', Integer),
+    )
+    metadata.create_all(engine)
+    return engine, table, PageWriter(engine, table, batch_size=10, flush_interval=0.05, **options)
+
+
+def urls(engine, table):
+    with engine.connect() as connection:
+        return sorted(row.url for row in connection.execute(select(table.c.url)))
+
+
+def test_locked_database_is_retried(tmp_path):
+    engine, table, writer = make_writer(tmp_path, retry_delay=0.05)
+    # Другой процесс держит блокировку записи дольше busy_timeout
+    blocker = sqlite3.connect(tmp_path / 'pages.db', isolation_level=None, check_same_thread=False)
+    blocker.execute('BEGIN IMMEDIATE')
+    release = threading.Timer(0.4, blocker.execute, ('COMMIT',))
+    release.start()
+
+    writer.enqueue('http://a/1', 'one', 'text')
+    writer.enqueue('http://a/2', 'two', 'text')
+    writer.close()
+    release.join()
+
+    assert urls(engine, table) == ['http://a/1', 'http://a/2']
+    assert writer.stats()['retried'] > 0
+    assert writer.stats()['failed'] == 0
+
+
+def test_failed_rows_are_reported(tmp_path):
+    failed = []
+    engine, table, writer = make_writer(tmp_path, on_failure=failed.extend)
+    writer.enqueue('http://a/1', 'one', 'text')
+    # title NOT NULL: ломается только эта строка, остальные пачки записываются по одной
+    writer.enqueue('http://a/2', None, 'text')
+    writer.enqueue('http://a/3', 'three', 'text')
+    writer.close()
+
+    assert urls(engine, table) == ['http://a/1', 'http://a/3']
+    assert [(kind, row['url']) for kind, row in failed] == [('insert', 'http://a/2')]
+    assert writer.stats()['failed'] == 1
+
+
+def test_lock_that_never_clears_hands_batch_back(tmp_path):
+    failed = []
+    engine, table, writer = make_writer(tmp_path, retries=2, retry_delay=0.01, on_failure=failed.extend)
+    blocker = sqlite3.connect(tmp_path / 'pages.db', isolation_level=None, check_same_thread=False)
+    blocker.execute('BEGIN IMMEDIATE')
+    started = time.monotonic()
+    writer.enqueue('http://a/1', 'one', 'text')
+    writer.flush()
+    blocker.execute('COMMIT')
+    writer.close()
+
+    assert [row['url'] for _, row in failed] == ['http://a/1']
+    assert writer.stats()['retried'] == 2
+    assert time.monotonic() - started < 5
+
+
+def test_upsert_overwrites_all_but_kept_columns(tmp_path):
+    engine, table, writer = make_writer(tmp_path, upsert_keep=('timestamp',))
+    writer.enqueue('http://a/1', 'old', 'old text', timestamp=1)
+    writer.flush()
+    writer.enqueue_upsert('http://a/1', 'new', 'new text', timestamp=2)
+    writer.enqueue_upsert('http://a/2', 'two', 'text', timestamp=3)
+    writer.close()
+
+    with engine.connect() as connection:
+        rows = connection.execute(select(table.c.url, table.c.title, table.c.timestamp).order_by(table.c.url)).all()
+    assert [tuple(row) for row in rows] == [('http://a/1', 'new', 1), ('http://a/2', 'two', 3)]
+
+
+def test_batch_keeps_queue_order(tmp_path):
+    engine, table, writer = make_writer(tmp_path)
+    writer.enqueue('http://a/1', 'one', 'text')
+    writer.enqueue('http://a/2', 'two', 'text')
+    writer.flush()
+    # В одной пачке: страница пропала и тут же снова найдена
+    writer.enqueue_delete('http://a/1')
+    writer.enqueue('http://a/1', 'again', 'text')
+    writer.enqueue_delete('http://a/2')
+    writer.enqueue_upsert('http://a/2', 'back', 'text')
+    writer.enqueue_update('http://a/2', title='first')
+    writer.enqueue_update('http://a/2', title='second', content='new')
+    writer.close()
+
+    with engine.connect() as connection:
+        rows = connection.execute(select(table.c.url, table.c.title).order_by(table.c.url)).all()
+    assert [tuple(row) for row in rows] == [('http://a/1', 'again'), ('http://a/2', 'second')]
+
@@ -0,0 +1,33 @@
+import time
+
+from query_cache import DiskTier, QueryCache
+
+
+def test_exact_generation_without_max_stale():
+    cache = QueryCache()
+    cache.put('q', 1, ['a'])
+    assert cache.get('q', 1) == ['a']
+    assert cache.get('q', 2) is None
+
+
+def test_older_generation_is_served_within_max_stale(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    disk = DiskTier(str(tmp_path / 'cache.db'))
+    cache = QueryCache(disk=disk, max_stale=5.0)
+    cache.put('q', 1, ['a'])
+
+    # Краулер закоммитил пачку: поколение выросло, но запись еще свежая
+    now[0] += 3
+    assert cache.get('q', 2) == ['a']
+    # Другой процесс видит ту же запись через общий уровень на диске
+    other = QueryCache(disk=disk, max_stale=5.0)
+    assert other.get('q', 2) == ['a']
+    assert other.stats()['stale_hits'] == 1
+
+    now[0] += 3
+    assert cache.get('q', 2) is None
+    assert other.get('q', 2) is None
+    # Запись более нового поколения, чем текущее, не отдается
+    cache.put('q', 3, ['b'])
+    assert cache.get('q', 2) is None
@@ -0,0 +1,93 @@
+import http.server
+import subprocess
+import sys
+import threading
+import time
+from urllib.robotparser import RobotFileParser
+
+import pytest
+
+from render import RenderError, RenderPool
+
+
+def webengine_available():
+    # QtWebEngine грузит Chromium и системные библиотеки X11: проверяется в отдельном процессе
+    code = 'from PyQt5 import QtWebEngineWidgets'
+    return subprocess.run([sys.executable, '-c', code], capture_output=True).returncode == 0
+
+
+pytestmark = pytest.mark.skipif(not webengine_available(), reason="нет PyQt5 с QtWebEngine")
+
+PAGES = {
+    '/app.html': (
+        '<html><head><title>static</title></head><body><div id="root"></div><script>'
+        'setTimeout(function () { document.title = "rendered";'
+        ' document.getElementById("root").textContent = "from javascript"; }, 200);'
+        '</script></body></html>'
+    ),
+    '/xhr.html': (
+        '<html><head><title>xhr</title></head><body><div id="root">waiting</div><script>'
+        'fetch("/private/data").then(function (r) { return r.text(); })'
+        '.then(function (t) { document.getElementById("root").textContent = t; })'
+        '.catch(function () { document.getElementById("root").textContent = "blocked"; });'
+        '</script></body></html>'
+    ),
+    '/private/data': 'secret',
+}
+
+
+@pytest.fixture(scope='module')
+def site():
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = PAGES.get(self.path)
+            self.send_response(200 if body is not None else 404)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.end_headers()
+            self.wfile.write((body or '').encode('utf-8'))
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def pool():
+    pool = RenderPool(pages=1, timeout=10, idle_ms=300)
+    yield pool
+    pool.close()
+
+
+def test_dom_after_timers(site, pool):
+    html, timed_out = pool.render(f'{site}/app.html')
+    assert not timed_out
+    assert '<title>rendered</title>' in html
+    assert 'from javascript' in html
+
+
+def test_robots_applies_to_page_requests(site, pool):
+    robots = RobotFileParser()
+    robots.parse(['User-agent: *', 'Disallow: /private/'])
+    html, _ = pool.render(f'{site}/xhr.html', robots=robots)
+    assert 'blocked' in html
+    assert 'secret' not in html
+    html, _ = pool.render(f'{site}/xhr.html')
+    assert 'secret' in html
+
+
+def test_dead_process_is_restarted(site, pool):
+    pool.render(f'{site}/app.html')
+    pool.process.kill()
+    pool.process.join()
+    started = time.monotonic()
+    with pytest.raises(RenderError):
+        pool.render(f'{site}/app.html')
+    assert time.monotonic() - started < 5
+    html, _ = pool.render(f'{site}/app.html')
+    assert 'from javascript' in html
+    assert pool.restarts == 1
@@ -0,0 +1,92 @@
+import sqlite3
+
+from sqlalchemy import Column, Integer, LargeBinary, MetaData, String, Table, Text, create_engine, event
+
+from content_store import register_functions
+from page_writer import PageWriter
+from search_index import BUMP_GENERATION, INDEXED_COLUMNS, create_search_index, index_generation, search
+
+
+def make_table():
+    metadata = MetaData()
+    return Table(
+        'webpages', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('url', String, unique=True),
+        Column('title', String, nullable=False),
+        Column('content', Text),
+        Column('content_z', LargeBinary),
+        Column('content_codec', String),
+        Column('summary', Text),
+        Column('timestamp', Integer),
+        Column('next_visit', Integer),
+    )
+
+
+def make_engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "pages.db"}')
+    event.listen(engine, 'connect', lambda dbapi_connection, record: register_functions(dbapi_connection))
+    table = make_table()
+    table.metadata.create_all(engine)
+    raw = engine.raw_connection()
+    try:
+        with raw.driver_connection as conn:
+            create_search_index(conn)
+    finally:
+        raw.close()
+    return engine, table
+
+
+def generation(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'pages.db')
+    try:
+        return index_generation(conn)
+    finally:
+        conn.close()
+
+
+def test_existing_index_is_not_written(tmp_path):
+    make_engine(tmp_path)
+    conn = sqlite3.connect(tmp_path / 'pages.db')
+    register_functions(conn)
+    # Схема прежней версии: поколение увеличивал триггер на каждую строку
+    conn.execute(f"CREATE TRIGGER webpages_generation_insert AFTER INSERT ON webpages BEGIN {BUMP_GENERATION}; END")
+    conn.commit()
+
+    assert create_search_index(conn) is False
+    conn.commit()
+    assert conn.execute("SELECT count(*) FROM sqlite_master WHERE name = 'webpages_generation_insert'").fetchone()[0] == 0
+
+    changes = conn.total_changes
+    assert create_search_index(conn) is False
+    assert conn.total_changes == changes
+    assert not conn.in_transaction
+    conn.close()
+
+
+def test_generation_grows_once_per_batch(tmp_path):
+    engine, table = make_engine(tmp_path)
+    writer = PageWriter(
+        engine, table, batch_size=100, flush_interval=0.5,
+        on_change=lambda connection: connection.exec_driver_sql(BUMP_GENERATION), watch_columns=INDEXED_COLUMNS,
+    )
+    writer.start()
+    for number in range(5):
+        writer.enqueue(f'http://a/{number}', f'page {number}', 'общий текст')
+    writer.flush()
+    assert generation(tmp_path) == 1
+
+    # Служебные колонки выдачу не меняют
+    writer.enqueue_update('http://a/1', next_visit=100)
+    writer.flush()
+    assert generation(tmp_path) == 1
+
+    writer.enqueue_update('http://a/1', title='renamed')
+    writer.enqueue_delete('http://a/2')
+    writer.close()
+    assert generation(tmp_path) == 2
+
+    conn = sqlite3.connect(tmp_path / 'pages.db')
+    register_functions(conn)
+    assert {row[1] for row in search(conn, 'общий')} == {'page 0', 'renamed', 'page 3', 'page 4'}
+    conn.close()
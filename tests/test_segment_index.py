@@ -0,0 +1,52 @@
+import sqlite3
+
+from segment_index import SegmentBuilder, SegmentIndex
+
+
+def make_db(path, count):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        'CREATE TABLE webpages (id INTEGER PRIMARY KEY, url TEXT, title TEXT, content TEXT, '
+        'content_z BLOB, content_codec TEXT, timestamp FLOAT)'
+    )
+    conn.executemany(
+        'INSERT INTO webpages (id, url, title, content, timestamp) VALUES (?, ?, ?, ?, 1.0)',
+        [(number, f'http://a/{number}', f'page {number}', 'общий текст') for number in range(1, count + 1)],
+    )
+    # Остальные страницы без искомого слова, чтобы у него был положительный idf
+    conn.executemany(
+        'INSERT INTO webpages (id, url, title, content, timestamp) VALUES (?, ?, ?, ?, 1.0)',
+        [(number, f'http://b/{number}', 'other', 'прочее') for number in range(100, 100 + 2 * count)],
+    )
+    conn.commit()
+    return conn
+
+
+def test_deleted_pages_are_tombstoned(tmp_path):
+    conn = make_db(tmp_path / 'pages.db', 10)
+    builder = SegmentBuilder(str(tmp_path / 'segments'), str(tmp_path / 'pages.db'))
+    assert builder.build() == 30
+    conn.execute('DELETE FROM webpages WHERE id IN (2, 5)')
+    conn.commit()
+
+    assert builder.build() == 0
+    index = SegmentIndex(str(tmp_path / 'segments'))
+    assert sorted(page_id for page_id, _ in index.search('общий', 20)) == [1, 3, 4, 6, 7, 8, 9, 10]
+    assert index.stats()['deleted'] == 2
+    # Пометки уже записаны, следующий проход ничего не делает
+    assert builder.build() == 0
+    assert index.stats()['generation'] == 2
+
+
+def test_reset_starts_from_scratch(tmp_path):
+    conn = make_db(tmp_path / 'pages.db', 3)
+    builder = SegmentBuilder(str(tmp_path / 'segments'), str(tmp_path / 'pages.db'))
+    builder.build()
+    conn.execute("UPDATE webpages SET content = 'другой текст' WHERE id < 100")
+    conn.commit()
+
+    builder.reset()
+    assert builder.build() == 9
+    index = SegmentIndex(str(tmp_path / 'segments'))
+    assert index.search('общий', 10) == []
+    assert len(index.search('другой', 10)) == 3
@@ -0,0 +1,52 @@
+import hashlib
+import random
+
+from parse_pool import parse_body
+from simhash import SimHashIndex, distance, features, from_signed, simhash, to_signed
+
+
+def reference_simhash(text):
+    # Определение SimHash как есть: +weight/-weight по каждому биту каждого признака
+    weights = [0] * 64
+    for feature, weight in features(text).items():
+        value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+        for bit in range(64):
+            weights[bit] += weight if value >> bit & 1 else -weight
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def test_matches_reference():
+    rng = random.Random(7)
+    words = [f'слово{i}' for i in range(200)]
+    for length in (0, 1, 2, 3, 10, 500):
+        text = ' '.join(rng.choice(words) for _ in range(length))
+        assert simhash(text) == reference_simhash(text)
+
+
+def test_near_duplicates_are_close():
+    rng = random.Random(3)
+    words = [f'w{i}' for i in range(1000)]
+    text = [rng.choice(words) for _ in range(400)]
+    edited = text[:]
+    edited[200] = 'changed'
+    other = [rng.choice(words) for _ in range(400)]
+    assert distance(simhash(' '.join(text)), simhash(' '.join(edited))) <= 3
+    assert distance(simhash(' '.join(text)), simhash(' '.join(other))) > 3
+
+
+def test_index_and_signed_round_trip():
+    index = SimHashIndex(max_distance=3)
+    assert index.check_and_add(0b1011, 'http://a/1') is None
+    assert index.check_and_add(0b1001, 'http://a/2') == 'http://a/1'
+    value = (1 << 63) + 5
+    assert from_signed(to_signed(value)) == value
+
+
+def test_parse_body_returns_fingerprint():
+    html = ('<html><head><title>T</title></head><body><p>' + ' '.join(f'w{i}' for i in range(60))
+            + '</p></body></html>').encode('utf-8')
+    title, text, links, fingerprint = parse_body('http://a/', html, 'text/html', min_tokens=50)
+    assert title == 'T'
+    assert fingerprint == simhash(text)
+    assert parse_body('http://a/', html, 'text/html', min_tokens=100)[3] is None
+    assert parse_body('http://a/', html, 'text/html')[3] is None
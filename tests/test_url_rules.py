@@ -0,0 +1,79 @@
+from extractor import extract
+from url_rules import Canonicalizer, TrapDetector
+
+
+def test_host_scheme_port_and_fragment():
+    canonicalize = Canonicalizer()
+    assert canonicalize('HTTPS://Ex.COM:443/a#top') == 'https://ex.com/a'
+    assert canonicalize('http://ex.com:8080') == 'http://ex.com:8080/'
+    assert canonicalize('http://ex.com./') == 'http://ex.com/'
+    assert canonicalize('http://[::1]:8080/a') == 'http://[::1]:8080/a'
+    assert canonicalize('HTTP://[2001:DB8::1]:80/') == 'http://[2001:db8::1]/'
+
+
+def test_path_normalization():
+    canonicalize = Canonicalizer()
+    assert canonicalize('http://ex.com/a/./b/../c//d') == 'http://ex.com/a/c/d'
+    assert canonicalize('http://ex.com/%7euser/%2f') == 'http://ex.com/~user/%2F'
+    assert canonicalize('http://ex.com/app;jsessionid=ABC123/page') == 'http://ex.com/app/page'
+
+
+def test_trailing_slash_is_kept_by_default():
+    assert Canonicalizer()('https://Ex.com/docs/') == 'https://ex.com/docs/'
+    assert Canonicalizer()('https://ex.com/docs') == 'https://ex.com/docs'
+    assert Canonicalizer(trailing_slash='strip')('https://ex.com/docs/') == 'https://ex.com/docs'
+    assert Canonicalizer(trailing_slash='add')('https://ex.com/docs') == 'https://ex.com/docs/'
+
+
+def test_query_keeps_bare_keys_and_encoding():
+    canonicalize = Canonicalizer()
+    assert canonicalize('http://ex.com/?b') == 'http://ex.com/?b'
+    assert canonicalize('http://ex.com/login?next=/x') == 'http://ex.com/login?next=/x'
+    assert canonicalize('http://ex.com/?q=a%2Fb&q=c+d') == 'http://ex.com/?q=a%2Fb&q=c+d'
+    assert canonicalize('http://ex.com/?b=2&a=1&utm_source=x&gclid=1') == 'http://ex.com/?a=1&b=2'
+    assert canonicalize('http://ex.com/?z=1&a=2&z=0') == 'http://ex.com/?a=2&z=1&z=0'
+    assert canonicalize('http://ex.com/?utm_source=x') == 'http://ex.com/'
+
+
+def test_relative_links_resolve_against_fetched_url():
+    html = b'<html><body><a href="intro.html">intro</a></body></html>'
+    _, _, links = extract('https://ex.com/docs/', [html], 'text/html', 'https://ex.com/docs/')
+    assert links == ['https://ex.com/docs/intro.html']
+    # Ключ страницы после канонизации без слеша, база - адрес ответа
+    _, _, links = extract('https://ex.com/docs', [html], 'text/html', 'https://ex.com/docs/')
+    assert links == ['https://ex.com/docs/intro.html']
+    assert links[0].source == 'https://ex.com/docs'
+
+
+def test_trap_heuristics():
+    traps = TrapDetector(max_depth=3, max_segment_repeats=2, max_query_params=2)
+    assert traps.check('http://ex.com/a/b/c') is None
+    assert traps.check('http://ex.com/a/b/c/d') == 'depth'
+    assert traps.check('http://ex.com/a/x/a/a') == 'depth'
+    assert TrapDetector().check('http://ex.com/a/x/a/y/a') == 'repeat'
+    assert traps.check('http://ex.com/?a=1&b=2&c=3') == 'query'
+    assert traps.rejected['depth'] == 2
+
+
+def test_pattern_cap_is_off_by_default():
+    traps = TrapDetector()
+    for page in range(1500):
+        url = f'http://shop.com/product/{page}'
+        assert traps.check(url) is None
+        traps.record(url)
+
+
+def test_budgets_count_only_recorded_urls():
+    traps = TrapDetector(pattern_cap=2, host_budget=3)
+    # Проверка сама ничего не засчитывает
+    for _ in range(5):
+        assert traps.check('http://a.com/item/1') is None
+    traps.record('http://a.com/item/1')
+    traps.record('http://a.com/item/2')
+    assert traps.check('http://a.com/item/3') == 'pattern_cap'
+    # Лимит шаблона - по хосту
+    assert traps.check('http://b.com/item/3') is None
+    assert traps.check('http://a.com/other') is None
+    traps.record('http://a.com/other')
+    assert traps.check('http://a.com/more') == 'host_budget'
+    assert TrapDetector.pattern('/calendar/2024/05/17', 'view=day&b=1') == '/calendar/#/#/#?b&view'
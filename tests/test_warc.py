@@ -0,0 +1,51 @@
+import gzip
+
+import pytest
+
+from warc import WarcWriter, offset_ranges, read_range, read_records
+
+
+class FakeResponse:
+    status_code = 200
+    reason = 'OK'
+    headers = {'Content-Type': 'text/html; charset=utf-8'}
+
+
+@pytest.fixture
+def archive(tmp_path):
+    writer = WarcWriter(str(tmp_path))
+    for i in range(40):
+        writer.write_response(f'http://a/{i}', FakeResponse(), f'<p>page {i} {"x" * 500}</p>'.encode('utf-8'))
+    writer.close()
+    return writer.path
+
+
+def urls(records):
+    return [headers.get('WARC-Target-URI') for headers, _ in records]
+
+
+def test_ranges_cover_every_record_once(archive):
+    ranges = offset_ranges(archive, range_bytes=2000)
+    assert len(ranges) > 1
+    assert [start for start, _ in ranges[1:]] == [end for _, end in ranges[:-1]]
+    split = [url for start, end in ranges for url in urls(read_range(archive, start, end))]
+    assert split == urls(read_records(archive))
+    assert split[-1] == 'http://a/39'
+
+
+def test_plain_warc_is_split_too(archive, tmp_path):
+    plain = str(tmp_path / 'plain.warc')
+    with gzip.open(archive, 'rb') as source, open(plain, 'wb') as target:
+        target.write(source.read())
+    ranges = offset_ranges(plain, range_bytes=2000)
+    assert len(ranges) > 1
+    assert [url for start, end in ranges for url in urls(read_range(plain, start, end))] == urls(read_records(plain))
+
+
+def test_truncated_last_member_is_skipped(archive):
+    with open(archive, 'rb') as f:
+        data = f.read()
+    with open(archive, 'wb') as f:
+        f.write(data[:-30])
+    start, end = offset_ranges(archive)[-1]
+    assert urls(read_range(archive, start, end))[-1] == 'http://a/38'
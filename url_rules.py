@@ -0,0 +1,149 @@
+import fnmatch
+import posixpath
+import re
+import threading
+from collections import Counter
+from urllib.parse import parse_qsl, unquote_plus, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+DEFAULT_STRIP_PARAMS = (
+    'utm_*', 'gclid', 'fbclid', 'yclid', 'msclkid', 'mc_cid', 'mc_eid', '_ga', '_gl', '_hsenc', '_hsmi',
+    'ref_src', 'sessionid', 'session_id', 'sid', 'phpsessid', 'jsessionid',
+)
+UNRESERVED = set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+PERCENT = re.compile(r'%([0-9A-Fa-f]{2})')
+PATH_SESSION = re.compile(r';(jsessionid|phpsessid|sid)=[^/]*', re.IGNORECASE)
+DIGITS = re.compile(r'\d+')
+
+
+def _percent(match):
+    char = chr(int(match.group(1), 16))
+    return char if char in UNRESERVED else '%' + match.group(1).upper()
+
+
+class Canonicalizer:
+    # Приводит варианты одного адреса к одной записи до проверки seen и сохранения:
+    # регистр схемы и хоста, порт по умолчанию, фрагмент, точки в пути,
+    # повторные слеши, %-кодирование, порядок и мусорные параметры запроса.
+    # Завершающий слеш по умолчанию не трогается: /docs/ и /docs - разные базы
+    # для относительных ссылок, и сервер не обязан отдавать по ним одно и то же
+    def __init__(self, strip_params=DEFAULT_STRIP_PARAMS, sort_query=True, trailing_slash='keep',
+                 drop_fragment=True):
+        if trailing_slash not in ('strip', 'add', 'keep'):
+            raise ValueError(f"Неизвестное правило для завершающего слеша: {trailing_slash}")
+        self.strip_params = [pattern.lower() for pattern in strip_params]
+        self.sort_query = sort_query
+        self.trailing_slash = trailing_slash
+        self.drop_fragment = drop_fragment
+
+    def _strip(self, key):
+        key = key.lower()
+        return any(fnmatch.fnmatchcase(key, pattern) for pattern in self.strip_params)
+
+    def _path(self, path):
+        path = PATH_SESSION.sub('', path)
+        path = PERCENT.sub(_percent, path or '/')
+        trailing = path.endswith('/')
+        path = re.sub(r'/{2,}', '/', posixpath.normpath(path))
+        if path in ('.', ''):
+            return '/'
+        if path == '/':
+            return path
+        if self.trailing_slash == 'add' or (self.trailing_slash == 'keep' and trailing):
+            return path + '/'
+        return path
+
+    def _query(self, query):
+        # Параметры остаются в исходном виде: ?b не становится ?b=, а next=/x -
+        # next=%2Fx. Раскодируются только незарезервированные символы, как в пути
+        pairs = []
+        for pair in query.split('&'):
+            if not pair:
+                continue
+            pair = PERCENT.sub(_percent, pair)
+            key = pair.partition('=')[0]
+            # latin-1 сохраняет исходные байты имени, даже если это не UTF-8
+            if not self._strip(unquote_plus(key, encoding='latin-1')):
+                pairs.append((key, pair))
+        if self.sort_query:
+            # Сортировка по имени устойчива: порядок повторов одного параметра сохраняется
+            pairs.sort(key=lambda pair: pair[0])
+        return '&'.join(pair for _, pair in pairs)
+
+    def __call__(self, url):
+        try:
+            parts = urlsplit(url.strip())
+            port = parts.port
+        except ValueError:
+            return url
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower().rstrip('.')
+        # hostname отдает адрес IPv6 без скобок, в netloc они обязательны
+        if ':' in host:
+            host = f'[{host}]'
+        netloc = host
+        if port and DEFAULT_PORTS.get(scheme) != port:
+            netloc = f'{host}:{port}'
+        if parts.username:
+            userinfo = parts.username + (f':{parts.password}' if parts.password else '')
+            netloc = f'{userinfo}@{netloc}'
+        fragment = '' if self.drop_fragment else parts.fragment
+        return urlunsplit((scheme, netloc, self._path(parts.path), self._query(parts.query), fragment))
+
+
+class TrapDetector:
+    # Эвристики против бесконечных пространств URL (календари, рекурсивные пути,
+    # фасетные фильтры). Счетчики общие для всех краулеров процесса. check()
+    # только проверяет, в бюджеты хоста и шаблона URL засчитывает record() -
+    # после того как URL действительно встал в очередь. Лимит на шаблон
+    # (pattern_cap) считается по хосту и по умолчанию выключен: у обычного
+    # магазина тысячи /product/N, и все они нужны
+    def __init__(self, max_depth=12, max_segment_repeats=2, max_query_params=8, host_budget=0, pattern_cap=0):
+        self.max_depth = max_depth
+        self.max_segment_repeats = max_segment_repeats
+        self.max_query_params = max_query_params
+        self.host_budget = host_budget
+        self.pattern_cap = pattern_cap
+        self.host_counts = Counter()
+        self.pattern_counts = Counter()
+        self.rejected = Counter()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def pattern(path, query):
+        # /calendar/2024/05/17?view=day -> /calendar/#/#/#?view
+        keys = sorted({key for key, _ in parse_qsl(query, keep_blank_values=True)})
+        return DIGITS.sub('#', path) + ('?' + '&'.join(keys) if keys else '')
+
+    def check(self, url):
+        # Причина отказа или None, если URL можно ставить в очередь
+        parts = urlsplit(url)
+        segments = [segment for segment in parts.path.split('/') if segment]
+        reason = None
+        if self.max_depth and len(segments) > self.max_depth:
+            reason = 'depth'
+        elif self.max_segment_repeats and segments and max(Counter(segments).values()) > self.max_segment_repeats:
+            reason = 'repeat'
+        elif self.max_query_params and parts.query.count('&') + 1 > self.max_query_params:
+            reason = 'query'
+
+        with self.lock:
+            if reason is None and self.host_budget and self.host_counts[parts.netloc] >= self.host_budget:
+                reason = 'host_budget'
+            if reason is None and self.pattern_cap and self.pattern_counts[self._pattern_key(parts)] >= self.pattern_cap:
+                reason = 'pattern_cap'
+            if reason is not None:
+                self.rejected[reason] += 1
+        return reason
+
+    def _pattern_key(self, parts):
+        return parts.netloc, self.pattern(parts.path, parts.query)
+
+    def record(self, url):
+        if not self.host_budget and not self.pattern_cap:
+            return
+        parts = urlsplit(url)
+        with self.lock:
+            self.host_counts[parts.netloc] += 1
+            if self.pattern_cap:
+                self.pattern_counts[self._pattern_key(parts)] += 1
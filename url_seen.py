@@ -0,0 +1,147 @@
+import hashlib
+import math
+import threading
+from array import array
+
+
+def fingerprint(url):
+    value = int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little')
+    # 0 занят под пустую ячейку таблицы
+    return value or 1
+
+
+class FingerprintTable:
+    # Хеш-множество с открытой адресацией поверх array('Q'): 8 байт на слот
+    def __init__(self, capacity=1 << 16):
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.slots = array('Q', bytes(8 * size))
+        self.mask = size - 1
+        self.count = 0
+
+    def nbytes(self):
+        return self.slots.itemsize * len(self.slots)
+
+    def _index(self, fp):
+        index = fp & self.mask
+        slots = self.slots
+        while True:
+            value = slots[index]
+            if value == 0 or value == fp:
+                return index
+            index = (index + 1) & self.mask
+
+    def __contains__(self, fp):
+        return self.slots[self._index(fp)] == fp
+
+    def add(self, fp):
+        index = self._index(fp)
+        if self.slots[index] == fp:
+            return False
+        self.slots[index] = fp
+        self.count += 1
+        return True
+
+    def needs_grow(self):
+        return self.count * 2 > len(self.slots)
+
+    def grown(self):
+        table = FingerprintTable(len(self.slots) * 2)
+        for fp in self.slots:
+            if fp:
+                table.add(fp)
+        return table
+
+    def __iter__(self):
+        return (fp for fp in self.slots if fp)
+
+
+class BloomFilter:
+    def __init__(self, nbytes, fp_rate):
+        self.bits = bytearray(max(8, nbytes))
+        self.nbits = len(self.bits) * 8
+        self.hashes = max(1, round(-math.log2(fp_rate)))
+        self.count = 0
+
+    def nbytes(self):
+        return len(self.bits)
+
+    def capacity(self, fp_rate):
+        # Сколько элементов влезет при заданной доле ложных срабатываний
+        return int(self.nbits * math.log(2) ** 2 / -math.log(fp_rate))
+
+    def _positions(self, fp):
+        h1 = fp & 0xFFFFFFFF
+        h2 = (fp >> 32) | 1
+        return [(h1 + i * h2) % self.nbits for i in range(self.hashes)]
+
+    def __contains__(self, fp):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(fp))
+
+    def add(self, fp):
+        new = False
+        for pos in self._positions(fp):
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+
+class SeenUrls:
+    # Общее для всех краулеров множество уже встреченных URL. Пока таблица
+    # отпечатков помещается в memory_budget, ответы точные (коллизия 64-битных
+    # отпечатков практически невозможна); дальше все переносится в фильтр Блума
+    # того же размера с заданной долей ложных срабатываний
+    def __init__(self, memory_budget=64 * 1024 * 1024, fp_rate=0.001):
+        self.memory_budget = memory_budget
+        self.fp_rate = fp_rate
+        self.store = FingerprintTable(min(1 << 16, max(1, memory_budget // 8)))
+        self.lock = threading.Lock()
+        self.warmed = False
+
+    def _maybe_grow(self):
+        store = self.store
+        if not isinstance(store, FingerprintTable) or not store.needs_grow():
+            return
+        if store.nbytes() * 2 <= self.memory_budget:
+            self.store = store.grown()
+        elif store.count >= len(store.slots) * 0.9:
+            bloom = BloomFilter(self.memory_budget, self.fp_rate)
+            for fp in store:
+                bloom.add(fp)
+            self.store = bloom
+            print(f"Множество URL превысило {self.memory_budget} байт, переход на фильтр Блума "
+                  f"(~{bloom.capacity(self.fp_rate)} URL при доле ошибок {self.fp_rate})")
+
+    def add(self, url):
+        # True, если URL встретился впервые
+        fp = fingerprint(url)
+        with self.lock:
+            added = self.store.add(fp)
+            if added:
+                self._maybe_grow()
+            return added
+
+    def __contains__(self, url):
+        fp = fingerprint(url)
+        with self.lock:
+            return fp in self.store
+
+    def __len__(self):
+        return self.store.count
+
+    def nbytes(self):
+        return self.store.nbytes()
+
+    def warm_start(self, urls):
+        with self.lock:
+            if self.warmed:
+                return
+            self.warmed = True
+            for url in urls:
+                if self.store.add(fingerprint(url)):
+                    self._maybe_grow()
@@ -0,0 +1,360 @@
+import argparse
+import base64
+import concurrent.futures
+import glob
+import gzip
+import hashlib
+import io
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+
+from requests.structures import CaseInsensitiveDict
+
+from content_store import content_fields, content_hash
+from extractor import extract
+from segment_index import SegmentBuilder
+from simhash import simhash
+
+# Заголовки транспорта: тело в архиве уже без сжатия и без chunked
+HOP_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length', 'connection', 'keep-alive')
+# Размер задачи повторного извлечения: диапазон целых записей архива примерно такого объема
+RANGE_BYTES = 8 * 1024 * 1024
+
+
+def warc_date(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_warc_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+def make_record(warc_type, block, url=None, timestamp=None, content_type=None, extra=()):
+    headers = [
+        ('WARC-Type', warc_type),
+        ('WARC-Record-ID', f'<urn:uuid:{uuid.uuid4()}>'),
+        ('WARC-Date', warc_date(timestamp or time.time())),
+    ]
+    if url:
+        headers.append(('WARC-Target-URI', url))
+    if content_type:
+        headers.append(('Content-Type', content_type))
+    headers.extend(extra)
+    headers.append(('Content-Length', str(len(block))))
+    head = 'WARC/1.0\r\n' + ''.join(f'{name}: {value}\r\n' for name, value in headers) + '\r\n'
+    return head.encode('utf-8') + block + b'\r\n\r\n'
+
+
+class WarcWriter:
+    # Сырые ответы в WARC: каждая запись - отдельный gzip-член, поэтому файл
+    # читается стандартными инструментами и остается целым до последней записи
+    # при падении. Файл сменяется, когда вырастает больше max_bytes
+    def __init__(self, directory, prefix='pieser', max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.file = None
+        self.path = None
+        self.serial = 0
+        self.records = 0
+        self.bytes_written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        self.serial += 1
+        name = f'{self.prefix}-{time.strftime("%Y%m%d%H%M%S")}-{os.getpid()}-{self.serial:05d}.warc.gz'
+        self.path = os.path.join(self.directory, name)
+        self.file = open(self.path, 'ab')
+        info = 'software: pieser\r\nformat: WARC File Format 1.0\r\n'.encode('utf-8')
+        self.file.write(gzip.compress(make_record('warcinfo', info, content_type='application/warc-fields')))
+
+    def write_response(self, url, response, body, timestamp=None):
+        status_line = f'HTTP/1.1 {response.status_code} {response.reason or ""}\r\n'
+        headers = ''.join(
+            f'{name}: {value}\r\n' for name, value in response.headers.items() if name.lower() not in HOP_HEADERS
+        )
+        block = (status_line + headers + f'Content-Length: {len(body)}\r\n\r\n').encode('latin-1', 'replace') + body
+        digest = base64.b32encode(hashlib.sha1(body).digest()).decode('ascii')
+        record = gzip.compress(make_record(
+            'response', block, url, timestamp, 'application/http; msgtype=response',
+            [('WARC-Payload-Digest', f'sha1:{digest}')],
+        ))
+        with self.lock:
+            if self.file is None or self.file.tell() >= self.max_bytes:
+                self.close_file()
+                self._open()
+            self.file.write(record)
+            self.file.flush()
+            self.records += 1
+            self.bytes_written += len(record)
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        with self.lock:
+            self.close_file()
+
+
+def read_records(path):
+    # (заголовки WARC, блок) для каждой записи; gzip.open читает все члены подряд
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        yield from parse_records(f, path)
+
+
+def parse_records(f, path):
+    while True:
+        line = f.readline()
+        if not line:
+            return
+        if not line.strip():
+            continue
+        if not line.startswith(b'WARC/'):
+            raise ValueError(f"{path}: ожидалась запись WARC, получено {line[:40]!r}")
+        headers = CaseInsensitiveDict()
+        for line in iter(f.readline, b'\r\n'):
+            if not line:
+                return
+            name, _, value = line.decode('utf-8', 'replace').partition(':')
+            headers[name.strip()] = value.strip()
+        block = f.read(int(headers.get('Content-Length', 0)))
+        f.readline()
+        f.readline()
+        yield headers, block
+
+
+def record_offsets(path):
+    # Смещения начала записей без их разбора. В .warc.gz это границы
+    # gzip-членов: WarcWriter пишет каждую запись отдельным членом
+    offsets = []
+    with open(path, 'rb') as f:
+        if path.endswith('.gz'):
+            decompressor = zlib.decompressobj(31)
+            offsets.append(0)
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                while chunk:
+                    decompressor.decompress(chunk)
+                    if not decompressor.eof:
+                        break
+                    # Остаток куска - начало следующего члена
+                    chunk = decompressor.unused_data
+                    offsets.append(f.tell() - len(chunk))
+                    decompressor = zlib.decompressobj(31)
+        else:
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                if not line.startswith(b'WARC/'):
+                    raise ValueError(f"{path}: ожидалась запись WARC, получено {line[:40]!r}")
+                length = 0
+                for line in iter(f.readline, b'\r\n'):
+                    if not line:
+                        break
+                    name, _, value = line.partition(b':')
+                    if name.strip().lower() == b'content-length':
+                        length = int(value)
+                offsets.append(offset)
+                f.seek(length, os.SEEK_CUR)
+    size = os.path.getsize(path)
+    return [offset for offset in offsets if offset < size]
+
+
+def offset_ranges(path, range_bytes=RANGE_BYTES):
+    # Архив делится на диапазоны целых записей примерно по range_bytes,
+    # чтобы несколько больших архивов разбирались всеми процессами пула
+    offsets = record_offsets(path)
+    if not offsets:
+        return []
+    bounds = [offsets[0]]
+    for offset in offsets[1:]:
+        if offset - bounds[-1] >= range_bytes:
+            bounds.append(offset)
+    bounds.append(os.path.getsize(path))
+    return list(zip(bounds, bounds[1:]))
+
+
+def read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    if path.endswith('.gz'):
+        parts = []
+        while data:
+            decompressor = zlib.decompressobj(31)
+            part = decompressor.decompress(data)
+            # Оборванный последний член (краулер упал во время записи) пропускается
+            if not decompressor.eof:
+                break
+            parts.append(part)
+            data = decompressor.unused_data
+        data = b''.join(parts)
+    return parse_records(io.BytesIO(data), path)
+
+
+def parse_http_response(block):
+    head, _, body = block.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ', 2)
+    status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+    headers = CaseInsensitiveDict()
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip()] = value.strip()
+    return status, headers, body
+
+
+def extract_range(path, start, end, codec=None, min_tokens=50):
+    # Выполняется в дочернем процессе: разбор, хеш, SimHash и сжатие текста.
+    # В родитель уходят только готовые строки таблицы, пачкой на диапазон
+    rows = []
+    for headers, block in read_range(path, start, end):
+        if headers.get('WARC-Type') != 'response':
+            continue
+        status, http_headers, body = parse_http_response(block)
+        if status != 200:
+            continue
+        url = headers.get('WARC-Target-URI')
+        title, text, _ = extract(url, [body], http_headers.get('Content-Type'))
+        rows.append({
+            'url': url,
+            'fetched_at': parse_warc_date(headers.get('WARC-Date')),
+            'title': title,
+            'etag': http_headers.get('ETag'),
+            'last_modified': http_headers.get('Last-Modified'),
+            'content_hash': content_hash(title, text),
+            'simhash': simhash(text) if len(text.split()) >= min_tokens else None,
+            **content_fields(text, codec),
+        })
+    return rows
+
+
+def archive_paths(paths):
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            result.extend(glob.glob(os.path.join(path, '*.warc.gz')) + glob.glob(os.path.join(path, '*.warc')))
+        else:
+            result.append(path)
+    # Имена начинаются с времени создания: от новых архивов к старым
+    return sorted(result, key=os.path.basename, reverse=True)
+
+
+def reextract(paths, workers=None, rebuild=False, range_bytes=RANGE_BYTES):
+    # Импорт здесь: crawler сам импортирует этот модуль ради WarcWriter
+    import crawler
+    from simhash import SimHashIndex, to_signed
+
+    paths = archive_paths(paths)
+    if not paths:
+        print("Не найдено ни одного архива WARC")
+        return
+    if rebuild:
+        with crawler.engine.begin() as connection:
+            connection.execute(crawler.WebPage.__table__.delete())
+            if crawler.SEARCH_INDEX:
+                crawler.bump_search_generation(connection)
+        if crawler.segment_indexer is not None:
+            SegmentBuilder(crawler.segment_indexer.directory, crawler.segment_indexer.db_path).reset()
+
+    dedup = SimHashIndex(max_distance=crawler.dedup_index.max_distance)
+    if not rebuild and crawler.DEDUP_ENABLED:
+        crawler.warm_start_dedup_index(dedup)
+    seen = set()
+    saved = duplicates = 0
+    started = time.time()
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        spans = dict(zip(paths, executor.map(offset_ranges, paths, [range_bytes] * len(paths))))
+        # Архивы идут от новых к старым, диапазоны и записи в них - от конца к
+        # началу, поэтому из повторных снимков URL остается самый свежий
+        tasks = iter([(path, start, end) for path in paths for start, end in reversed(spans[path])])
+        remaining = {path: len(spans[path]) for path in paths}
+        records = dict.fromkeys(paths, 0)
+        # Результаты забираются по порядку задач, в работе не больше window диапазонов
+        window = 4 * (workers or os.cpu_count() or 1)
+        pending = deque(
+            (path, executor.submit(extract_range, path, start, end, crawler.CONTENT_CODEC, crawler.DEDUP_MIN_TOKENS))
+            for path, start, end in itertools.islice(tasks, window)
+        )
+        while pending:
+            path, future = pending.popleft()
+            rows = future.result()
+            for path_next, start, end in itertools.islice(tasks, 1):
+                pending.append((path_next, executor.submit(
+                    extract_range, path_next, start, end, crawler.CONTENT_CODEC, crawler.DEDUP_MIN_TOKENS,
+                )))
+            for row in reversed(rows):
+                url = row.pop('url')
+                if url in seen:
+                    continue
+                seen.add(url)
+                fingerprint = row.pop('simhash')
+                row['simhash'] = None
+                if crawler.DEDUP_ENABLED and fingerprint is not None:
+                    original = dedup.check_and_add(fingerprint, url)
+                    # Совпадение со своим же отпечатком из базы - не дубликат
+                    if original is not None and original != url:
+                        duplicates += 1
+                        continue
+                    row['simhash'] = to_signed(fingerprint)
+                fetched_at = row.pop('fetched_at')
+                fields = crawler.new_page_fields(row.pop('etag'), row.pop('last_modified'), row.pop('content_hash'),
+                                                 fetched_at)
+                fields.update(row)
+                title = fields.pop('title')
+                content = fields.pop('content')
+                if rebuild:
+                    crawler.page_writer.enqueue(url, title, content, fetched_at, **fields)
+                else:
+                    # Уже сохраненная страница перезаписывается, расписание обхода остается.
+                    # timestamp - время записи: по нему segment_index находит измененные страницы
+                    crawler.page_writer.enqueue_upsert(url, title, content, time.time(), **fields)
+                saved += 1
+            records[path] += len(rows)
+            remaining[path] -= 1
+            if not remaining[path]:
+                print(f"{os.path.basename(path)}: записей {records[path]}, диапазонов {len(spans[path])}")
+    crawler.page_writer.close()
+    elapsed = time.time() - started
+    print(f"Страниц: {saved}, почти дубликатов: {duplicates}, архивов: {len(paths)} за {elapsed:.1f} с "
+          f"({saved / elapsed if elapsed else 0:.1f} страниц/с)")
+    crawler.print_writer_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Архивы WARC: повторное извлечение без обращения к сети")
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('reextract', help="заново разобрать архивы и записать страницы в базу")
+    command.add_argument('paths', nargs='+', help="файлы .warc.gz или каталоги с ними")
+    command.add_argument('--workers', type=int, default=None, help="процессов разбора (по умолчанию - по числу ядер)")
+    command.add_argument('--rebuild', action='store_true', help="очистить таблицу webpages перед записью; без него сохраненные страницы обновляются, расписание обхода у них остается")
+    command.add_argument('--range-mb', type=float, default=RANGE_BYTES / (1024 * 1024),
+                         help="объем диапазона записей на одну задачу пула")
+    args = parser.parse_args()
+    if args.command == 'reextract':
+        reextract(args.paths, args.workers, args.rebuild, int(args.range_mb * 1024 * 1024))
+
+
+if __name__ == '__main__':
+    main()